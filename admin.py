@@ -1,13 +1,20 @@
 import os
 import sys
 import time
+import traceback
 import gradio as gr
 from database import (
     get_prompt, update_prompt, get_error_logs, log_error,
     get_all_knowledge_base, add_knowledge_item,
-    get_all_interests, add_interest, update_interest_active, delete_interest
+    get_all_interests, add_interest, update_interest_active, delete_interest,
+    clear_llm_cache, get_storage_stats, get_auto_vacuum_mode
 )
-from search import add_resource_to_vector_db
+from search import request_kb_sync, get_search_cache_stats
+from kb_import import iter_import, format_progress
+from retention import RETENTION_POLICIES, run_retention, get_last_run, convert_to_incremental_vacuum
+from llm import get_llm_cache_stats
+from llm_client import get_llm_client_stats
+from voice import get_transcription_stats, get_tts_cache_stats
 
 # ========== ПРОМПТЫ ==========
 def load_prompt(agent_name):
@@ -22,9 +29,23 @@ def add_kb_item_ui(title, link, tags):
     if not title or not link:
         return "⚠️ Название и ссылка обязательны!", gr.update()
     add_knowledge_item(title, link, tags)
-    add_resource_to_vector_db(title, link, tags)
+    # Эмбеддинг выполняет фоновая синхронизация, запрос администратора его не ждёт
+    request_kb_sync()
     return "✅ Ресурс добавлен!", get_all_knowledge_base()
 
+def import_kb_file_ui(file, restart):
+    if file is None:
+        yield "⚠️ Выберите файл CSV или JSONL"
+        return
+    path = getattr(file, "name", file)
+    try:
+        for progress in iter_import(path, restart=restart):
+            prefix = "✅ Импорт завершён. " if progress["status"] == "done" else "⏳ "
+            yield prefix + format_progress(progress)
+    except Exception as e:
+        log_error("KBImport", str(e), traceback.format_exc())
+        yield f"❌ Импорт прерван: {e}. Повторная загрузка того же файла продолжит с последней пачки."
+
 # ========== ИНТЕРЕСЫ ==========
 def get_all_interests_ui():
     return get_all_interests()
@@ -43,6 +64,134 @@ def delete_interest_ui(interest_id):
     delete_interest(interest_id)
     return get_all_interests()
 
+# ========== КЭШ LLM ==========
+def get_llm_cache_stats_ui():
+    stats = get_llm_cache_stats()
+    return [
+        ["Кэш включён", "да" if stats["enabled"] else "нет"],
+        ["Попаданий", stats["hits"]],
+        ["Промахов", stats["misses"]],
+        ["Hit rate", f"{stats['hit_rate']:.1%}"],
+        ["Запросов в обход кэша", stats["bypassed"]],
+        ["Сэкономлено, КБ", round(stats["bytes_saved"] / 1024, 1)],
+        ["Записей в кэше", stats["entries"]],
+        ["Размер кэша, КБ", round(stats["bytes"] / 1024, 1)],
+    ]
+
+def clear_llm_cache_ui():
+    clear_llm_cache()
+    return get_llm_cache_stats_ui()
+
+# ========== КЛИЕНТ LLM ==========
+BREAKER_STATES = {"closed": "🟢 закрыт", "open": "🔴 открыт", "half_open": "🟡 пробный запрос"}
+
+def get_llm_client_stats_ui():
+    stats = get_llm_client_stats()
+    breaker = stats["breaker"]
+    reasons = ", ".join(f"{reason}: {count}" for reason, count in sorted(stats["retry_reasons"].items())) or "—"
+    return [
+        ["Circuit breaker", BREAKER_STATES.get(breaker["state"], breaker["state"])],
+        ["Ошибок подряд", breaker["consecutive_failures"]],
+        ["Открывался раз", breaker["times_opened"]],
+        ["До пробного запроса, с", breaker["retry_in_s"]],
+        ["Запросов", stats["requests"]],
+        ["Попыток (с повторами)", stats["attempts"]],
+        ["Повторов", stats["retries"]],
+        ["Причины повторов", reasons],
+        ["Отклонено breaker'ом", stats["short_circuited"]],
+        ["Неудачных запросов", stats["failures"]],
+        ["Объединено одинаковых запросов", stats["coalesced"]],
+        ["В полёте / ждут слота", f"{stats['limiter']['in_flight']} / {stats['limiter']['waiting']} "
+                                  f"(пользователей: {stats['limiter']['waiting_users']})"],
+        ["Ждали в очереди", stats["queued"]],
+        ["Ожидание в очереди p50 / p95 / max, мс",
+         f"{stats['queue_wait_ms']['p50']} / {stats['queue_wait_ms']['p95']} / {stats['queue_wait_ms']['max']}"],
+        ["Лимит частоты, запросов/с", stats["rate_per_s"] or "без ограничения"],
+        ["Асинхронный backend", stats["async_backend"]],
+    ]
+
+# ========== РАСПОЗНАВАНИЕ РЕЧИ ==========
+def get_transcription_stats_ui():
+    stats = get_transcription_stats()
+    rtf = f"{stats['realtime_factor']:.2f}" if stats["realtime_factor"] is not None else "—"
+    last = stats["recent"][-1] if stats["recent"] else None
+    return [
+        ["Модель", f"{stats['model']} (загружено копий: {stats['models_loaded']})"],
+        ["В очереди", stats["queue_depth"]],
+        ["Выполняется", stats["running"]],
+        ["Запросов", stats["requests"]],
+        ["Распознано", stats["completed"]],
+        ["Отклонено (перегрузка)", stats["rejected"]],
+        ["Ошибок", stats["errors"]],
+        ["Аудио, с / обработка, с", f"{stats['audio_seconds']:.1f} / {stats['wall_seconds']:.1f}"],
+        ["Обработка / аудио (RTF)", rtf],
+        ["Последний запрос (аудио, обработка, RTF)", str(last) if last else "—"],
+    ]
+
+def get_tts_cache_stats_ui():
+    stats = get_tts_cache_stats()
+    return [
+        ["Каталог", stats["directory"]],
+        ["Попаданий / промахов", f"{stats['hits']} / {stats['misses']}"],
+        ["Hit ratio", f"{stats['hit_ratio']:.1%}"],
+        ["Файлов", stats["files"]],
+        ["На диске, МБ", f"{stats['disk_bytes'] / 1024 / 1024:.1f} из {stats['max_bytes'] / 1024 / 1024:.0f}"],
+        ["Удалено reaper'ом", stats["evicted"]],
+    ]
+
+# ========== КЭШ ПОИСКА ==========
+def get_search_cache_stats_ui():
+    stats = get_search_cache_stats()
+    return [
+        ["Эмбеддинги запросов: hit rate", f"{stats['embed_hit_rate']:.1%} ({stats['embed_hits']} / {stats['embed_hits'] + stats['embed_misses']})"],
+        ["Эмбеддингов в кэше", stats["embeddings"]],
+        ["Результаты поиска: hit rate", f"{stats['result_hit_rate']:.1%} ({stats['result_hits']} / {stats['result_hits'] + stats['result_misses']})"],
+        ["Результатов в кэше", stats["results"]],
+        ["Сбросов после синхронизации БЗ", stats["invalidations"]],
+        ["Отметка синхронизации", stats["high_water_mark"] if stats["high_water_mark"] is not None else "—"],
+    ]
+
+# ========== ХРАНЕНИЕ ==========
+def _mb(size):
+    return f"{size / 1024 / 1024:.1f} МБ" if size is not None else "—"
+
+def get_storage_stats_ui():
+    stats = get_storage_stats()
+    summary = [
+        ["Файл БД", _mb(stats["file_bytes"])],
+        ["WAL", _mb(stats["wal_bytes"])],
+        ["Свободные страницы", f"{stats['free_pages']} из {stats['page_count']} ({_mb(stats['free_pages'] * stats['page_size'])})"],
+        ["Последняя архивация", get_last_run() or "ещё не выполнялась"],
+        ["auto_vacuum", get_auto_vacuum_mode()],
+    ]
+    tables = [
+        [table, info["rows"], _mb(info["bytes"]),
+         f"{RETENTION_POLICIES[table]} дн." if RETENTION_POLICIES.get(table) else "бессрочно"]
+        for table, info in stats["tables"].items()
+    ]
+    return summary, tables
+
+def run_retention_ui():
+    try:
+        result = run_retention()
+    except Exception as e:
+        log_error("Retention", str(e), traceback.format_exc())
+        return (f"❌ Ошибка архивации: {e}", *get_storage_stats_ui())
+    if result is None:
+        return ("⏳ Архивация уже выполняется", *get_storage_stats_ui())
+    moved = ", ".join(f"{table}: {count}" for table, count in result["moved"].items())
+    return (f"✅ Перенесено в архив — {moved}; из журнала изменений БЗ удалено: {result['pruned_changelog']}; "
+            f"освобождено страниц: {result['freed_pages']}", *get_storage_stats_ui())
+
+def enable_incremental_vacuum_ui():
+    try:
+        converted = convert_to_incremental_vacuum()
+    except Exception as e:
+        log_error("Vacuum", str(e), traceback.format_exc())
+        return (f"❌ Ошибка VACUUM: {e}", *get_storage_stats_ui())
+    message = "✅ auto_vacuum=INCREMENTAL включён" if converted else "auto_vacuum=INCREMENTAL уже включён"
+    return (message, *get_storage_stats_ui())
+
 # ========== УПРАВЛЕНИЕ СЕРВЕРОМ ==========
 def shutdown_server():
     log_error("INFO", "Сервер остановлен администратором", "")
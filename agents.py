@@ -1,9 +1,23 @@
-from database import get_prompt, error_logged, save_weekly_plan, save_llm_dialogue
+from database import get_prompt_template, error_logged, log_error, save_weekly_plans_batch
 from search import search_resources
-from llm import call_llm
+from llm import call_llm, call_llm_stream, is_llm_error
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import json
 import traceback
 import re
 
+PLAN_WEEKS = 4
+# Увеличивать при любом изменении промптов плана: готовые шаблоны планов (jobs.py) привязаны к версии
+PLAN_PROMPT_VERSION = "1"
+# per_week — отдельный потоковый запрос на каждую неделю; single — один запрос с JSON-схемой на все недели
+PLAN_MODE = os.getenv("PLAN_MODE", "per_week")
+PLAN_SINGLE_ATTEMPTS = int(os.getenv("PLAN_SINGLE_ATTEMPTS", "3"))
+PLAN_SINGLE_TOKENS_PER_WEEK = int(os.getenv("PLAN_SINGLE_TOKENS_PER_WEEK", "700"))
+PLAN_SYSTEM_PROMPT = "Ты опытный методист. Отвечай строго по формату, на русском языке."
+PLAN_AGENT_SYSTEM_PROMPT = "Ты — опытный HR-аналитик и карьерный консультант. Отвечай на русском языке."
+
 def chat_respond(message, history):
     if "план" in message.lower():
         return plan_agent(message)
@@ -12,47 +26,74 @@ def chat_respond(message, history):
     else:
         return "Я могу: составить план развития, найти учебные материалы, проверить файл, провести голосовое собеседование. Выберите вкладку."
 
-@error_logged
-def plan_agent(user_input: str) -> str:
-    prompt_template = get_prompt("plan_agent")
+def chat_respond_stream(message, history):
+    """Как chat_respond, но отдаёт ответ частями (накопленным текстом) для потокового вывода."""
+    if "план" in message.lower():
+        yield from plan_agent_stream(message)
+    else:
+        yield chat_respond(message, history)
+
+def _detect_grade(user_input: str) -> str:
     if "junior" in user_input.lower():
-        grade = "Junior"
+        return "Junior"
     elif "middle" in user_input.lower():
-        grade = "Middle"
-    else:
-        grade = "General"
-    full_prompt = prompt_template.format(grade=grade)
-    full_prompt += f"\n\nЗапрос пользователя: {user_input}"
-    llm_response = call_llm(full_prompt, system_prompt="Ты — опытный HR-аналитик и карьерный консультант. Отвечай на русском языке.")
-    if llm_response.startswith("⚠️") or llm_response.startswith("❌"):
-        if grade == "Junior":
-            plan = """
+        return "Middle"
+    return "General"
+
+def _static_plan_reply(agent_prompt: str, grade: str) -> str:
+    if grade == "Junior":
+        plan = """
 📚 **Неделя 1:** Основы SQL (SELECT, JOIN, агрегация) — тренажёр SQL-EX  
 📚 **Неделя 2:** Нотация BPMN 2.0, создание диаграмм — видео на YouTube  
 📚 **Неделя 3:** REST API, OpenAPI, Postman — документация Swagger  
 📚 **Неделя 4:** Подготовка к аттестации, mock-интервью, soft skills  
 """
-        elif grade == "Middle":
-            plan = """
+    elif grade == "Middle":
+        plan = """
 🚀 **Неделя 1:** Проектирование API, идемпотентность, пагинация  
 🚀 **Неделя 2:** Kafka basics, event-driven архитектура, протоколы  
 🚀 **Неделя 3:** Event Storming, DDD, bounded context  
 🚀 **Неделя 4:** Проведение интервью, менторство, code review  
 """
-        else:
-            plan = """
+    else:
+        plan = """
 🎯 **Неделя 1:** SQL (оптимизация запросов, индексы)  
 🎯 **Неделя 2:** BPMN, CMMN, DMN — сравнение  
 🎯 **Неделя 3:** REST, gRPC, GraphQL — когда что выбирать  
 🎯 **Неделя 4:** Софт-скиллы: коммуникация с заказчиком, управление ожиданиями  
 """
-        return f"**Промпт агента:** {prompt_template.format(grade=grade)}\n\n{plan}\n\n*Примечание: использован статический план, так как AI-помощник временно недоступен.*"
+    return f"**Промпт агента:** {agent_prompt}\n\n{plan}\n\n*Примечание: использован статический план, так как AI-помощник временно недоступен.*"
+
+@error_logged
+def plan_agent(user_input: str) -> str:
+    prompt_template = get_prompt_template("plan_agent")
+    grade = _detect_grade(user_input)
+    full_prompt = prompt_template.format(grade=grade)
+    full_prompt += f"\n\nЗапрос пользователя: {user_input}"
+    llm_response = call_llm(full_prompt, system_prompt=PLAN_AGENT_SYSTEM_PROMPT)
+    if is_llm_error(llm_response):
+        return _static_plan_reply(prompt_template.format(grade=grade), grade)
     else:
         return f"**Промпт агента:** {prompt_template.format(grade=grade)}\n\n**AI-рекомендация:**\n{llm_response}"
 
+@error_logged
+def plan_agent_stream(user_input: str):
+    prompt_template = get_prompt_template("plan_agent")
+    grade = _detect_grade(user_input)
+    agent_prompt = prompt_template.format(grade=grade)
+    full_prompt = f"{agent_prompt}\n\nЗапрос пользователя: {user_input}"
+    header = f"**Промпт агента:** {agent_prompt}\n\n**AI-рекомендация:**\n"
+    text = ""
+    for chunk in call_llm_stream(full_prompt, system_prompt=PLAN_AGENT_SYSTEM_PROMPT):
+        if not text and is_llm_error(chunk):
+            yield _static_plan_reply(agent_prompt, grade)
+            return
+        text += chunk
+        yield header + text
+
 @error_logged
 def validate_file(content: str, filename: str, question: str) -> str:
-    prompt = get_prompt("validator")
+    prompt = get_prompt_template("validator")
     ext = filename.split(".")[-1].lower() if "." in filename else ""
     try:
         import sqlparse
@@ -83,13 +124,13 @@ def validate_file(content: str, filename: str, question: str) -> str:
 @error_logged
 def search_agent(query: str) -> str:
     from search import search_resources
-    prompt = get_prompt("search_agent")
+    prompt = get_prompt_template("search_agent")
     resources = search_resources(query)
     return f"**Промпт агента:** {prompt.format(query=query)}\n\n**Найденные ресурсы:**\n{resources}"
 
 @error_logged
 def interview_agent(topic: str, grade: str) -> str:
-    prompt = get_prompt("interview_agent")
+    prompt = get_prompt_template("interview_agent")
     questions_db = {
         "sql": [
             "Чем отличается INNER JOIN от LEFT JOIN?",
@@ -128,46 +169,237 @@ def extract_section(text, header):
         return match.group(1).strip()
     return ""
 
+def build_week_prompt(week: int, grade: str, interests_text: str) -> str:
+    return (
+        f"Ты — карьерный консультант для системных аналитиков.\n"
+        f"Уровень аналитика: {grade}.\n"
+        f"Выбранные направления:\n{interests_text}\n\n"
+        f"Составь план обучения на **неделю {week}** из 4-недельного курса. "
+        f"Учти уровень {grade} и выбранные направления.\n"
+        f"Твой ответ должен содержать:\n"
+        f"1. Краткое описание целей недели (2-3 предложения).\n"
+        f"2. Ключевые определения (список терминов, которые нужно усвоить).\n"
+        f"3. Ключевые теги (например: #sql, #bpmn).\n"
+        f"4. Ключевые знания (что именно должен знать и уметь аналитик после этой недели).\n\n"
+        f"Формат ответа:\n"
+        f"**Неделя {week}**\n"
+        f"**Цели:** ...\n"
+        f"**Определения:** термин1, термин2, ...\n"
+        f"**Теги:** #тег1, #тег2, ...\n"
+        f"**Знания:** ...\n"
+        f"Ответ должен быть кратким и укладываться в 1000 токенов."
+    )
+
+def _generate_week(week: int, grade: str, interests_text: str, user: str = None):
+    prompt = build_week_prompt(week, grade, interests_text)
+    try:
+        response = call_llm(prompt, PLAN_SYSTEM_PROMPT, user=user)
+    except Exception as e:
+        log_error("GenerateWeek", str(e), traceback.format_exc())
+        response = f"❌ Не удалось сгенерировать неделю {week}: {e}"
+    return week, prompt, response, not is_llm_error(response)
+
+def _stream_week(week: int, grade: str, interests_text: str, on_chunk, user: str = None):
+    prompt = build_week_prompt(week, grade, interests_text)
+    stream = call_llm_stream(prompt, PLAN_SYSTEM_PROMPT, user=user)
+    try:
+        for chunk in stream:
+            on_chunk(week, chunk)
+        return week, prompt, stream.text, stream.ok
+    except Exception as e:
+        log_error("GenerateWeek", str(e), traceback.format_exc())
+        response = f"❌ Не удалось сгенерировать неделю {week}: {e}"
+        on_chunk(week, response)
+        return week, prompt, response, False
+
+def plan_week_fields(response: str):
+    """Поля недели для weekly_plans: (content, key_defs, key_tags, key_knowledge)."""
+    return (response, extract_section(response, "Определения:"), extract_section(response, "Теги:"),
+            extract_section(response, "Знания:"))
+
+# ========== ПЛАН ОДНИМ ЗАПРОСОМ (JSON-СХЕМА) ==========
+PLAN_WEEK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "week": {"type": "integer"},
+        "goals": {"type": "string"},
+        "definitions": {"type": "array", "items": {"type": "string"}},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "knowledge": {"type": "string"},
+    },
+    "required": ["week", "goals", "definitions", "tags", "knowledge"],
+    "additionalProperties": False,
+}
+PLAN_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "weekly_plan",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"weeks": {"type": "array", "items": PLAN_WEEK_SCHEMA}},
+            "required": ["weeks"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+def build_plan_prompt(weeks, grade: str, interests_text: str) -> str:
+    numbers = ", ".join(str(week) for week in weeks)
+    return (
+        f"Ты — карьерный консультант для системных аналитиков.\n"
+        f"Уровень аналитика: {grade}.\n"
+        f"Выбранные направления:\n{interests_text}\n\n"
+        f"Составь план обучения из {PLAN_WEEKS}-недельного курса для недель: {numbers}. "
+        f"Недели должны идти от простого к сложному и не повторять друг друга.\n"
+        f"Для каждой недели верни объект в массиве weeks:\n"
+        f"- week — номер недели;\n"
+        f"- goals — цели недели (2-3 предложения);\n"
+        f"- definitions — ключевые термины, которые нужно усвоить;\n"
+        f"- tags — ключевые теги без решётки (например: sql, bpmn);\n"
+        f"- knowledge — что аналитик должен знать и уметь после недели.\n"
+        f"Ответ — только JSON без пояснений, не длиннее {PLAN_SINGLE_TOKENS_PER_WEEK} токенов на неделю."
+    )
+
+def _is_text(value) -> bool:
+    return isinstance(value, str) and bool(value.strip())
+
+def parse_plan_json(text: str, weeks) -> dict:
+    """Строго разбирает ответ по PLAN_RESPONSE_FORMAT.
+
+    Возвращает {неделя: (goals, definitions, tags, knowledge)} только для запрошенных недель,
+    прошедших проверку; недели с пропущенными или пустыми полями в результат не попадают.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        # Модели без поддержки structured outputs иногда оборачивают JSON в блок кода
+        text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return {}
+    items = data.get("weeks") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return {}
+    parsed = {}
+    for item in items:
+        if not isinstance(item, dict) or set(item) != set(PLAN_WEEK_SCHEMA["required"]):
+            continue
+        week = item["week"]
+        if isinstance(week, bool) or not isinstance(week, int) or week not in weeks or week in parsed:
+            continue
+        definitions, tags = item["definitions"], item["tags"]
+        if not (_is_text(item["goals"]) and _is_text(item["knowledge"])
+                and isinstance(definitions, list) and definitions and all(_is_text(d) for d in definitions)
+                and isinstance(tags, list) and tags and all(_is_text(t) for t in tags)):
+            continue
+        parsed[week] = (item["goals"].strip(), [d.strip() for d in definitions],
+                        ["#" + t.strip().lstrip("#") for t in tags], item["knowledge"].strip())
+    return parsed
+
+def render_plan_week(week: int, fields):
+    """Неделя в том же виде, что и ответ в режиме per_week, и поля для weekly_plans."""
+    goals, definitions, tags, knowledge = fields
+    key_defs, key_tags = ", ".join(definitions), ", ".join(tags)
+    content = (f"**Неделя {week}**\n**Цели:** {goals}\n**Определения:** {key_defs}\n"
+               f"**Теги:** {key_tags}\n**Знания:** {knowledge}\n")
+    return content, key_defs, key_tags, knowledge
+
+def _generate_weeks_single(weeks, grade: str, interests_text: str, on_chunk, user: str = None):
+    """Все недели одним запросом; повторно запрашиваются только недостающие или битые недели.
+
+    Недели, которые так и не удалось получить за PLAN_SINGLE_ATTEMPTS попыток, догенерируются
+    по одной в режиме per_week. Возвращает список (week, prompt, response, plan).
+    """
+    pending = list(weeks)
+    generated = []
+    for attempt in range(PLAN_SINGLE_ATTEMPTS):
+        prompt = build_plan_prompt(pending, grade, interests_text)
+        try:
+            # Повтор идёт мимо кэша, иначе вернулся бы тот же негодный ответ
+            # Неполный или битый JSON не кэшируется: иначе первая попытка следующего пользователя получила бы его же
+            expected = set(pending)
+            response = call_llm(prompt, PLAN_SYSTEM_PROMPT, use_cache=attempt == 0,
+                                max_tokens=PLAN_SINGLE_TOKENS_PER_WEEK * len(pending),
+                                response_format=PLAN_RESPONSE_FORMAT, user=user,
+                                validate=lambda text, expected=expected: set(parse_plan_json(text, expected)) == expected)
+        except Exception as e:
+            log_error("GeneratePlanSingle", str(e), traceback.format_exc())
+            break
+        if is_llm_error(response):
+            # API недоступен или не принимает схему — повтор того же запроса не поможет
+            break
+        parsed = parse_plan_json(response, pending)
+        for week in sorted(parsed):
+            plan = render_plan_week(week, parsed[week])
+            on_chunk(week, plan[0])
+            # В диалог идёт сырой ответ модели, а не отрисованная неделя — по нему разбираются сбои
+            generated.append((week, prompt, response, plan))
+        pending = [week for week in pending if week not in parsed]
+        if not pending:
+            return generated
+        log_error("GeneratePlanSingle", f"Нет корректных недель {pending}, попытка {attempt + 1} из {PLAN_SINGLE_ATTEMPTS}",
+                  response)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ⚠️ План одним запросом: "
+              f"нет корректных недель {pending}, попытка {attempt + 1} из {PLAN_SINGLE_ATTEMPTS}")
+    for week in pending:
+        week, prompt, response, ok = _stream_week(week, grade, interests_text, on_chunk, user)
+        generated.append((week, prompt, response, plan_week_fields(response) if ok else None))
+    return generated
+
+# ========== ГЕНЕРАЦИЯ ПЛАНА ==========
+def generate_plan_weeks(interests: list, grade: str, weeks, on_chunk, on_week, user: str = None):
+    """Генерирует указанные недели для фоновой задачи в режиме PLAN_MODE.
+
+    on_chunk(week, chunk) получает текст по мере генерации, on_week(week, prompt, response, plan) —
+    готовую неделю; plan — (content, key_defs, key_tags, key_knowledge) или None, если неделя
+    не получилась. user — email для справедливой очереди запросов к LLM.
+    Возвращает список (week, prompt, response, plan).
+    """
+    interests_text = "\n".join([f"- {interest}" for interest in interests])
+    if PLAN_MODE == "single":
+        generated = _generate_weeks_single(weeks, grade, interests_text, on_chunk, user)
+        for result in generated:
+            on_week(*result)
+        return generated
+
+    def run(week):
+        week, prompt, response, ok = _stream_week(week, grade, interests_text, on_chunk, user)
+        result = (week, prompt, response, plan_week_fields(response) if ok else None)
+        # В режиме per_week неделя сохраняется сразу, не дожидаясь остальных
+        on_week(*result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, len(weeks)), thread_name_prefix="plan-week") as pool:
+        return list(pool.map(run, weeks))
+
+def _save_generated_weeks(generated, grade: str, user_email: str) -> list:
+    results = []
+    plans = []
+    dialogues = []
+    for week, prompt, response, plan in generated:
+        dialogues.append((prompt, response))
+        if plan is None:
+            # Неудачная неделя не сохраняется, но остальные недели не теряются
+            results.append((week, response, "", "", ""))
+            continue
+        plans.append((week, *plan))
+        results.append((week, *plan))
+    save_weekly_plans_batch(user_email, grade, plans, dialogues)
+    return sorted(results)
+
 @error_logged
 def generate_weekly_plans(interests: list, grade: str, user_email: str) -> list:
     if not user_email:
         raise ValueError("Email пользователя обязателен")
     interests_text = "\n".join([f"- {interest}" for interest in interests])
-    results = []
-    for week in range(1, 5):
-        prompt = (
-            f"Ты — карьерный консультант для системных аналитиков.\n"
-            f"Уровень аналитика: {grade}.\n"
-            f"Выбранные направления:\n{interests_text}\n\n"
-            f"Составь план обучения на **неделю {week}** из 4-недельного курса. "
-            f"Учти уровень {grade} и выбранные направления.\n"
-            f"Твой ответ должен содержать:\n"
-            f"1. Краткое описание целей недели (2-3 предложения).\n"
-            f"2. Ключевые определения (список терминов, которые нужно усвоить).\n"
-            f"3. Ключевые теги (например: #sql, #bpmn).\n"
-            f"4. Ключевые знания (что именно должен знать и уметь аналитик после этой недели).\n\n"
-            f"Формат ответа:\n"
-            f"**Неделя {week}**\n"
-            f"**Цели:** ...\n"
-            f"**Определения:** термин1, термин2, ...\n"
-            f"**Теги:** #тег1, #тег2, ...\n"
-            f"**Знания:** ...\n"
-            f"Ответ должен быть кратким и укладываться в 1000 токенов."
-        )
-        system_prompt = "Ты опытный методист. Отвечай строго по формату, на русском языке."
-        response = call_llm(prompt, system_prompt)
-        save_llm_dialogue(user_email, prompt, response)
-        key_defs = extract_section(response, "Определения:")
-        key_tags = extract_section(response, "Теги:")
-        key_knowledge = extract_section(response, "Знания:")
-        save_weekly_plan(
-            user_email=user_email,
-            grade=grade,
-            week_number=week,
-            content=response,
-            key_defs=key_defs,
-            key_tags=key_tags,
-            key_knowledge=key_knowledge
-        )
-        results.append((week, response, key_defs, key_tags, key_knowledge))
-    return results
\ No newline at end of file
+    weeks = range(1, PLAN_WEEKS + 1)
+    if PLAN_MODE == "single":
+        return _save_generated_weeks(_generate_weeks_single(weeks, grade, interests_text, lambda *_: None, user_email),
+                                     grade, user_email)
+    # Недели генерируются параллельно; общий лимит запросов к LLM задаёт LLM_MAX_CONCURRENCY
+    with ThreadPoolExecutor(max_workers=PLAN_WEEKS, thread_name_prefix="plan-week") as pool:
+        futures = [pool.submit(_generate_week, week, grade, interests_text, user_email) for week in weeks]
+        generated = [(week, prompt, response, plan_week_fields(response) if ok else None)
+                     for week, prompt, response, ok in (future.result() for future in futures)]
+    return _save_generated_weeks(generated, grade, user_email)
\ No newline at end of file
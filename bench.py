@@ -0,0 +1,208 @@
+"""Бенчмарки SkillForge. Запуск: python bench.py <команда> [параметры]."""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+def _ts():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def _report(name, timings_ms, extra=""):
+    print(f"  {name:<28} avg {sum(timings_ms) / len(timings_ms):8.2f} мс | "
+          f"p50 {_percentile(timings_ms, 0.5):8.2f} мс | p95 {_percentile(timings_ms, 0.95):8.2f} мс {extra}")
+
+def _temp_database():
+    """База в отдельном каталоге: SKILLFORGE_DB нужно задать до импорта database."""
+    directory = tempfile.mkdtemp(prefix="skillforge_bench_")
+    os.environ["SKILLFORGE_DB"] = os.path.join(directory, "bench.db")
+    import database
+    return database, directory
+
+# ========== ПОИСК ПО БАЗЕ ЗНАНИЙ ==========
+KB_TOPICS = [
+    ("SQL", "sql,базы данных"), ("PostgreSQL", "sql,postgresql"), ("REST API", "api,rest"),
+    ("BPMN", "bpmn,процессы"), ("UML", "uml,моделирование"), ("микросервисы", "архитектура,микросервисы"),
+    ("Kafka", "kafka,event-driven"), ("Docker", "docker,devops"), ("тестирование", "qa,тестирование"),
+    ("требования", "требования,аналитика"), ("Python", "python,разработка"), ("AWS", "aws,облака"),
+]
+KB_TITLE_PATTERNS = [
+    "Введение в {}", "{}: практическое руководство", "Продвинутые техники {}", "Шпаргалка по {}",
+    "{} для системного аналитика", "Типичные ошибки в {}", "Разбор задач: {}", "{} на собеседовании",
+]
+KB_QUERIES = [
+    "найди ресурсы по SQL", "статьи про микросервисную архитектуру", "REST API",
+    "как готовиться к собеседованию по Python", "моделирование процессов в BPMN",
+    "Kafka и event-driven", "тестирование требований", "облачные сервисы AWS",
+]
+
+def bench_kb_search(args):
+    database, directory = _temp_database()
+    try:
+        rng = random.Random(42)
+        rows = []
+        for i in range(args.rows):
+            topic, tags = rng.choice(KB_TOPICS)
+            title = rng.choice(KB_TITLE_PATTERNS).format(topic)
+            rows.append((f"{title} #{i}", f"https://example.com/kb/{i}", tags))
+        started = time.perf_counter()
+        with database.write_cursor() as c:
+            c.executemany("INSERT INTO knowledge_base (title, link, tags) VALUES (?, ?, ?)", rows)
+        print(f"[{_ts()}] Вставлено {args.rows} ресурсов за {time.perf_counter() - started:.1f} с "
+              f"(FTS5: {'да' if database.kb_fts_available() else 'нет'})")
+
+        variants = [("LIKE (весь запрос)", database.search_knowledge_base_like)]
+        if database.kb_fts_available():
+            variants.append(("FTS5 + bm25", database.search_knowledge_base_fts))
+        for name, search in variants:
+            timings, found = [], 0
+            for _ in range(args.repeat):
+                for query in KB_QUERIES:
+                    started = time.perf_counter()
+                    found += len(search(query, args.limit))
+                    timings.append((time.perf_counter() - started) * 1000)
+            _report(name, timings, f"| найдено в среднем {found / len(timings):.1f}")
+    finally:
+        database.close_db()
+        shutil.rmtree(directory, ignore_errors=True)
+
+# ========== ВЕКТОРНЫЙ ПОИСК ==========
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _random_vectors(rng, rows, dim):
+    vectors = rng.standard_normal((rows, dim), dtype="float32")
+    return vectors / ((vectors ** 2).sum(axis=1, keepdims=True) ** 0.5)
+
+def _open_bench_backend(backend, directory):
+    if backend == "chroma":
+        import chromadb
+        client = chromadb.PersistentClient(path=os.path.join(directory, "chroma"))
+        return client.create_collection("bench", metadata={"hnsw:space": "cosine"}, embedding_function=None)
+    from vector_index import NumpyVectorIndex
+    return NumpyVectorIndex(os.path.join(directory, backend), quantize=backend == "numpy-int8")
+
+def _bench_vector_backend(args):
+    import numpy as np
+    # Эмбеддинги случайные: сравниваем сами индексы, а не модель
+    rng = np.random.default_rng(42)
+    vectors = _random_vectors(rng, args.rows, args.dim)
+    queries = _random_vectors(rng, args.queries, args.dim)
+    directory = tempfile.mkdtemp(prefix="skillforge_bench_")
+    try:
+        rss_before = _rss_mb()
+        index = _open_bench_backend(args.backend, directory)
+        started = time.perf_counter()
+        for start in range(0, args.rows, 5000):
+            batch = vectors[start:start + 5000]
+            ids = [str(i) for i in range(start, start + len(batch))]
+            index.add(ids=ids, embeddings=batch.tolist() if args.backend == "chroma" else batch,
+                      metadatas=[{"title": f"#{i}", "link": ""} for i in ids])
+        build_s = time.perf_counter() - started
+
+        single = []
+        for query in queries:
+            started = time.perf_counter()
+            index.query(query_embeddings=[query.tolist()], n_results=args.k)
+            single.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        index.query(query_embeddings=queries.tolist() if args.backend == "chroma" else queries, n_results=args.k)
+        batch_ms = (time.perf_counter() - started) * 1000
+        print(f"[{_ts()}] {args.backend}: {args.rows} векторов x {args.dim}, построение {build_s:.1f} с, "
+              f"RSS +{_rss_mb() - rss_before:.0f} МБ")
+        _report("один запрос", single)
+        print(f"  {'пачка из ' + str(args.queries):<28} {batch_ms:8.2f} мс всего, {batch_ms / args.queries:8.3f} мс на запрос")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def bench_vector_search(args):
+    if args.backend != "all":
+        return _bench_vector_backend(args)
+    # Каждый бэкенд в отдельном процессе, чтобы RSS не смешивался
+    for backend in ("numpy", "numpy-int8", "chroma"):
+        cmd = [sys.executable, os.path.abspath(__file__), "vector-search", "--backend", backend,
+               "--rows", str(args.rows), "--dim", str(args.dim), "--queries", str(args.queries), "--k", str(args.k)]
+        if subprocess.run(cmd).returncode != 0:
+            print(f"[{_ts()}] ⚠️ {backend}: бенчмарк не выполнен (бэкенд не установлен?)")
+
+# ========== ГЕНЕРАЦИЯ ПЛАНА ==========
+def bench_plan_modes(args):
+    from mock_openrouter import MockOpenRouter
+    mock = MockOpenRouter(latency_ms=args.latency_ms, ms_per_token=args.ms_per_token,
+                          drop_week_rate=args.bad_week_rate, seed=42).start()
+    os.environ["OPENROUTER_API_KEY"] = "bench"
+    os.environ["OPENROUTER_API_URL"] = mock.url
+    os.environ["LLM_CACHE_ENABLED"] = "0"
+    database, directory = _temp_database()
+    try:
+        import llm
+        import agents
+        interests = ["SQL и базы данных", "Проектирование REST API", "BPMN и моделирование процессов"]
+        print(f"[{_ts()}] Мок LLM: задержка {args.latency_ms} мс + {args.ms_per_token} мс/токен, "
+              f"потеря недели в JSON: {args.bad_week_rate:.0%}")
+        for mode in ("per_week", "single"):
+            agents.PLAN_MODE = mode
+            timings, calls, prompt_tokens, completion_tokens, complete = [], 0, 0, 0, 0
+            for i in range(args.runs):
+                before = llm.get_llm_usage()
+                started = time.perf_counter()
+                results = agents.generate_weekly_plans(interests, "Middle", f"bench{i}@example.com")
+                timings.append((time.perf_counter() - started) * 1000)
+                after = llm.get_llm_usage()
+                calls += after["calls"] - before["calls"]
+                prompt_tokens += after["prompt_tokens"] - before["prompt_tokens"]
+                completion_tokens += after["completion_tokens"] - before["completion_tokens"]
+                complete += all(key_defs and key_tags for _, _, key_defs, key_tags, _ in results)
+            _report(mode, timings, f"| запросов {calls / args.runs:.1f} | токенов промпта {prompt_tokens / args.runs:.0f} "
+                                   f"| ответа {completion_tokens / args.runs:.0f} | полных планов {complete}/{args.runs}")
+    finally:
+        mock.stop()
+        database.close_db()
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки SkillForge")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    kb = commands.add_parser("kb-search", help="FTS5 против LIKE на синтетической базе знаний")
+    kb.add_argument("--rows", type=int, default=100_000)
+    kb.add_argument("--repeat", type=int, default=5)
+    kb.add_argument("--limit", type=int, default=10)
+    kb.set_defaults(func=bench_kb_search)
+
+    vec = commands.add_parser("vector-search", help="NumpyVectorIndex против Chroma: задержка и RSS")
+    vec.add_argument("--backend", choices=["all", "numpy", "numpy-int8", "chroma"], default="all")
+    vec.add_argument("--rows", type=int, default=20_000)
+    vec.add_argument("--dim", type=int, default=384)
+    vec.add_argument("--queries", type=int, default=200)
+    vec.add_argument("--k", type=int, default=5)
+    vec.set_defaults(func=bench_vector_search)
+
+    plan = commands.add_parser("plan-modes", help="План по неделям против одного запроса с JSON-схемой (мок LLM)")
+    plan.add_argument("--runs", type=int, default=5)
+    plan.add_argument("--latency-ms", type=float, default=300)
+    plan.add_argument("--ms-per-token", type=float, default=2)
+    plan.add_argument("--bad-week-rate", type=float, default=0.1)
+    plan.set_defaults(func=bench_plan_modes)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
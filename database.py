@@ -1,77 +1,750 @@
+import os
+import inspect
+import queue
+import re
 import sqlite3
+import string
+import threading
+import time
 import traceback
+from contextlib import contextmanager
 from datetime import datetime
 from threading import Lock
 from functools import wraps
+from itertools import groupby
 import atexit
 
+DB_PATH = os.getenv("SKILLFORGE_DB", "skillforge.db")
+# Размер пула соединений для чтения; запись всегда идёт через одно соединение-писатель
+DB_READ_POOL_SIZE = int(os.getenv("SKILLFORGE_DB_READ_POOL", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("SKILLFORGE_DB_BUSY_TIMEOUT_MS", "5000"))
+DB_PRAGMAS = [
+    # Действует только для новой БД; существующую переводит однократный VACUUM из админ-панели
+    # или команда python retention.py enable-incremental-vacuum
+    ("auto_vacuum", "INCREMENTAL"),
+    ("busy_timeout", DB_BUSY_TIMEOUT_MS),
+    ("journal_mode", "WAL"),  # читатели не блокируются писателем
+    ("synchronous", os.getenv("SKILLFORGE_DB_SYNCHRONOUS", "NORMAL")),
+    ("cache_size", int(os.getenv("SKILLFORGE_DB_CACHE_SIZE", "-16000"))),  # отрицательное значение — в KiB
+    ("mmap_size", int(os.getenv("SKILLFORGE_DB_MMAP_SIZE", str(256 * 1024 * 1024)))),
+    ("temp_store", "MEMORY"),
+]
+
+# db_lock сериализует только запись; чтение идёт параллельно через пул
 db_lock = Lock()
-conn = sqlite3.connect("skillforge.db", check_same_thread=False)
-c = conn.cursor()
-
-# Таблицы
-c.execute('''CREATE TABLE IF NOT EXISTS progress
-             (user_id TEXT, skill TEXT, status TEXT, date TEXT)''')
-c.execute('''CREATE TABLE IF NOT EXISTS agent_prompts
-             (agent_name TEXT PRIMARY KEY, prompt_template TEXT)''')
-c.execute('''CREATE TABLE IF NOT EXISTS error_logs
-             (timestamp TEXT, error_type TEXT, message TEXT, traceback TEXT)''')
-c.execute('''CREATE TABLE IF NOT EXISTS test_results
-             (user_id TEXT, topic TEXT, score INTEGER, total INTEGER, date TEXT)''')
-c.execute('''CREATE TABLE IF NOT EXISTS chat_history
-             (user_id TEXT, role TEXT, content TEXT, date TEXT)''')
-c.execute('''CREATE TABLE IF NOT EXISTS test_answers
-             (user_id TEXT, topic TEXT, question_index INTEGER,
-              selected TEXT, correct BOOLEAN, date TEXT)''')
-c.execute('''CREATE TABLE IF NOT EXISTS knowledge_base
-             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-              title TEXT NOT NULL,
-              link TEXT NOT NULL,
-              tags TEXT,
-              created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
-c.execute('''CREATE TABLE IF NOT EXISTS interests
-             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-              title TEXT NOT NULL,
-              active BOOLEAN DEFAULT 1,
-              created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
-# Таблицы для недельных планов и диалогов LLM
-c.execute('''CREATE TABLE IF NOT EXISTS weekly_plans
-             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-              user_email TEXT NOT NULL,
-              grade TEXT NOT NULL,
-              week_number INTEGER NOT NULL,
-              content TEXT NOT NULL,
-              key_definitions TEXT,
-              key_tags TEXT,
-              key_knowledge TEXT,
-              created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
-c.execute('''CREATE TABLE IF NOT EXISTS llm_dialogues
-             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-              user_email TEXT NOT NULL,
-              prompt TEXT NOT NULL,
-              response TEXT NOT NULL,
-              created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
-conn.commit()
+_pool_lock = Lock()
+_read_pool = queue.LifoQueue()
+_read_pool_created = 0
+_all_connections = []
+_closed = False  # close_db уже выполнен (вызывается явно и из atexit)
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    for name, value in DB_PRAGMAS:
+        conn.execute(f"PRAGMA {name}={value}")
+    with _pool_lock:
+        _all_connections.append(conn)
+    return conn
+
+_writer = _connect()
+
+def _acquire_reader():
+    global _read_pool_created
+    try:
+        return _read_pool.get_nowait()
+    except queue.Empty:
+        pass
+    with _pool_lock:
+        can_create = _read_pool_created < DB_READ_POOL_SIZE
+        if can_create:
+            _read_pool_created += 1
+    if can_create:
+        return _connect()
+    return _read_pool.get()
+
+@contextmanager
+def read_cursor():
+    conn = _acquire_reader()
+    cur = conn.cursor()
+    try:
+        yield cur
+    finally:
+        cur.close()
+        _read_pool.put(conn)
+
+@contextmanager
+def write_cursor(*tables):
+    """Транзакция на соединении-писателе; после коммита сдвигает версии перечисленных таблиц."""
+    with db_lock:
+        cur = _writer.cursor()
+        try:
+            yield cur
+            _writer.commit()
+        except Exception:
+            _writer.rollback()
+            raise
+        finally:
+            cur.close()
+        # Сдвигаем под db_lock: следующая запись уже видит новую версию (см. save_plan_template)
+        if tables:
+            bump_table_version(*tables)
+
+# ========== ВЕРСИИ ТАБЛИЦ ==========
+# Счётчик изменений на таблицу: UI опрашивает его и перечитывает данные, только когда он сдвинулся.
+# Счётчики живут в памяти процесса и стартуют от текущего времени в мс, чтобы версия,
+# запомненная браузером до перезапуска сервера, не совпала случайно с новой.
+_version_base = int(time.time() * 1000)
+_table_versions = {}
+_versions_lock = Lock()
+_SQL_TABLE_RE = re.compile(r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+(\w+)", re.I)
+
+def bump_table_version(*tables):
+    with _versions_lock:
+        for table in tables:
+            _table_versions[table] = _table_versions.get(table, _version_base) + 1
+
+def get_table_version(table):
+    return _table_versions.get(table, _version_base)
+
+def _sql_table(sql):
+    match = _SQL_TABLE_RE.match(sql)
+    return match.group(1) if match else None
+
+# ========== ОТЛОЖЕННАЯ ЗАПИСЬ (WRITE-BEHIND) ==========
+# Частые INSERT'ы (чат, ответы тестов, лог ошибок, диалоги LLM) можно копить в очереди
+# и сбрасывать одной транзакцией через executemany — раз в N мс или каждые N строк.
+WRITE_BEHIND_ENABLED = os.getenv("SKILLFORGE_WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("SKILLFORGE_WRITE_BEHIND_FLUSH_MS", "200"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("SKILLFORGE_WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("SKILLFORGE_WRITE_BEHIND_MAX_QUEUE", "10000"))
+# Сколько секунд ждать места в переполненной очереди, прежде чем записать синхронно
+WRITE_BEHIND_PUT_TIMEOUT = float(os.getenv("SKILLFORGE_WRITE_BEHIND_PUT_TIMEOUT", "2"))
+
+class WriteBehindQueue:
+    def __init__(self, flush_ms, batch_size, max_queue):
+        self.flush_interval = flush_ms / 1000
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = Lock()
+        self._stats_lock = Lock()
+        self._stopped = False
+        self._stats = {
+            "enqueued": 0,
+            "flushed_rows": 0,
+            "flushes": 0,
+            "sync_fallbacks": 0,
+            "errors": 0,
+            "dropped_rows": 0,
+            "rejected_after_close": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+                self._thread.start()
+
+    @property
+    def stopped(self):
+        return self._stopped
+
+    def reject(self, sql):
+        # После close_db писатель закрыт: синхронная запись упала бы, поэтому строку только отмечаем
+        with self._stats_lock:
+            self._stats["rejected_after_close"] += 1
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ❌ Запись после закрытия БД отклонена: {sql[:80]}")
+
+    def submit(self, sql, params):
+        """Ставит INSERT в очередь; при переполнении ждёт (backpressure), затем пишет синхронно."""
+        if self._stopped:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put((sql, params), timeout=WRITE_BEHIND_PUT_TIMEOUT)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["sync_fallbacks"] += 1
+            return False
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            if stop:
+                return
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        # Версии таблиц сдвигаются при сбросе пакета, когда строки действительно видны читателям
+        tables = {_sql_table(sql) for sql, _ in batch} - {None}
+        written = len(batch)
+        try:
+            with write_cursor(*tables) as c:
+                for sql, group in groupby(batch, key=lambda item: item[0]):
+                    c.executemany(sql, [params for _, params in group])
+        except Exception as e:
+            # Не теряем весь пакет из-за одной строки: досохраняем построчно
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ❌ Ошибка пакетной записи: {e}")
+            with self._stats_lock:
+                self._stats["errors"] += 1
+            written = 0
+            for sql, params in batch:
+                try:
+                    with write_cursor(*tables) as c:
+                        c.execute(sql, params)
+                    written += 1
+                except Exception as row_error:
+                    # log_error сам пишет через эту очередь, поэтому потерю строки сообщаем в консоль
+                    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ❌ Строка не сохранена "
+                          f"({_sql_table(sql)}): {row_error}")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._stats["flushes"] += 1
+            self._stats["flushed_rows"] += written
+            self._stats["dropped_rows"] += len(batch) - written
+            self._stats["last_flush_ms"] = elapsed_ms
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+            self._stats["total_flush_ms"] += elapsed_ms
+
+    def stop(self):
+        """Останавливает фонового писателя и сбрасывает всё, что осталось в очереди."""
+        if self._stopped:
+            return
+        self._stopped = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftover.append(item)
+        if leftover:
+            self._flush(leftover)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_flush_ms"] = stats["total_flush_ms"] / stats["flushes"] if stats["flushes"] else 0.0
+        return stats
+
+_write_behind = WriteBehindQueue(WRITE_BEHIND_FLUSH_MS, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_MAX_QUEUE)
+
+def _insert(sql, params):
+    if WRITE_BEHIND_ENABLED and _write_behind.stopped:
+        _write_behind.reject(sql)
+        return
+    if WRITE_BEHIND_ENABLED and _write_behind.submit(sql, params):
+        return
+    table = _sql_table(sql)
+    with write_cursor(*([table] if table else [])) as c:
+        c.execute(sql, params)
+
+def get_write_behind_stats():
+    stats = _write_behind.stats()
+    stats["enabled"] = WRITE_BEHIND_ENABLED
+    return stats
+
+# ========== МИГРАЦИИ СХЕМЫ ==========
+# Каждый шаг выполняется в своей транзакции и должен быть идемпотентным.
+# Новые изменения схемы добавляются только новым шагом в конец MIGRATIONS.
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"  # ISO 8601, сортируется как строка
+
+def _now():
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+def _migration_initial_schema(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS progress
+                 (user_id TEXT, skill TEXT, status TEXT, date TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS agent_prompts
+                 (agent_name TEXT PRIMARY KEY, prompt_template TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS error_logs
+                 (timestamp TEXT, error_type TEXT, message TEXT, traceback TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS test_results
+                 (user_id TEXT, topic TEXT, score INTEGER, total INTEGER, date TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS chat_history
+                 (user_id TEXT, role TEXT, content TEXT, date TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS test_answers
+                 (user_id TEXT, topic TEXT, question_index INTEGER,
+                  selected TEXT, correct BOOLEAN, date TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS knowledge_base
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  title TEXT NOT NULL,
+                  link TEXT NOT NULL,
+                  tags TEXT,
+                  created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS interests
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  title TEXT NOT NULL,
+                  active BOOLEAN DEFAULT 1,
+                  created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+    # Таблицы для недельных планов и диалогов LLM
+    c.execute('''CREATE TABLE IF NOT EXISTS weekly_plans
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_email TEXT NOT NULL,
+                  grade TEXT NOT NULL,
+                  week_number INTEGER NOT NULL,
+                  content TEXT NOT NULL,
+                  key_definitions TEXT,
+                  key_tags TEXT,
+                  key_knowledge TEXT,
+                  created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS llm_dialogues
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_email TEXT NOT NULL,
+                  prompt TEXT NOT NULL,
+                  response TEXT NOT NULL,
+                  created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+
+def _migration_user_time_indexes(c):
+    # Составные индексы (пользователь, время) покрывают WHERE + ORDER BY без полного сканирования
+    c.execute("CREATE INDEX IF NOT EXISTS idx_progress_user_date ON progress (user_id, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_progress_date ON progress (date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_user_date ON chat_history (user_id, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_test_results_user_date ON test_results (user_id, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_test_answers_user_date ON test_answers (user_id, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_error_logs_timestamp ON error_logs (timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_weekly_plans_user_week ON weekly_plans (user_email, week_number)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_llm_dialogues_user_created ON llm_dialogues (user_email, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_llm_dialogues_created ON llm_dialogues (created_at)")
+
+def _migration_iso_timestamps(c):
+    # Старые записи хранились с точностью до минут ('YYYY-MM-DD HH:MM'); приводим к единому формату
+    for table in ("progress", "chat_history", "test_results", "test_answers"):
+        c.execute(f"UPDATE {table} SET date = date || ':00' WHERE length(date) = 16")
+
+def _migration_llm_cache(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS llm_cache
+                 (cache_key TEXT PRIMARY KEY,
+                  model TEXT NOT NULL,
+                  response TEXT NOT NULL,
+                  size_bytes INTEGER NOT NULL,
+                  created_at REAL NOT NULL,
+                  last_access REAL NOT NULL,
+                  hits INTEGER NOT NULL DEFAULT 0)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache (created_at)")
+
+def _migration_knowledge_base_fts(c):
+    # Внешний контент: FTS хранит только индекс, сами строки остаются в knowledge_base
+    try:
+        c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_base_fts
+                     USING fts5(title, tags, content='knowledge_base', content_rowid='id',
+                                tokenize='unicode61 remove_diacritics 2')""")
+    except sqlite3.OperationalError as e:
+        # SQLite собран без FTS5 — поиск останется на LIKE
+        print(f"[{_now()}] ⚠️ FTS5 недоступен ({e}), полнотекстовый индекс не создан")
+        return
+    c.execute("""CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_ai AFTER INSERT ON knowledge_base BEGIN
+                     INSERT INTO knowledge_base_fts (rowid, title, tags) VALUES (new.id, new.title, new.tags);
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_ad AFTER DELETE ON knowledge_base BEGIN
+                     INSERT INTO knowledge_base_fts (knowledge_base_fts, rowid, title, tags)
+                     VALUES ('delete', old.id, old.title, old.tags);
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_au AFTER UPDATE ON knowledge_base BEGIN
+                     INSERT INTO knowledge_base_fts (knowledge_base_fts, rowid, title, tags)
+                     VALUES ('delete', old.id, old.title, old.tags);
+                     INSERT INTO knowledge_base_fts (rowid, title, tags) VALUES (new.id, new.title, new.tags);
+                 END""")
+    # Индексируем строки, добавленные до появления триггеров
+    c.execute("INSERT INTO knowledge_base_fts (knowledge_base_fts) VALUES ('rebuild')")
+
+def _migration_kb_changelog(c):
+    # Журнал изменений базы знаний: по нему векторный индекс догоняет SQLite
+    c.execute('''CREATE TABLE IF NOT EXISTS kb_changelog
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                  kb_id INTEGER NOT NULL,
+                  op TEXT NOT NULL,
+                  changed_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_state
+                 (name TEXT PRIMARY KEY,
+                  value INTEGER NOT NULL,
+                  updated_at TEXT NOT NULL)''')
+    c.execute("""CREATE TRIGGER IF NOT EXISTS knowledge_base_changelog_ai AFTER INSERT ON knowledge_base BEGIN
+                     INSERT INTO kb_changelog (kb_id, op) VALUES (new.id, 'upsert');
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS knowledge_base_changelog_au AFTER UPDATE ON knowledge_base BEGIN
+                     INSERT INTO kb_changelog (kb_id, op) VALUES (new.id, 'upsert');
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS knowledge_base_changelog_ad AFTER DELETE ON knowledge_base BEGIN
+                     INSERT INTO kb_changelog (kb_id, op) VALUES (old.id, 'delete');
+                 END""")
+
+def _migration_kb_import(c):
+    # Индекс не уникальный: в уже накопленных данных дубликаты ссылок возможны
+    c.execute("CREATE INDEX IF NOT EXISTS idx_knowledge_base_link ON knowledge_base (link)")
+    c.execute('''CREATE TABLE IF NOT EXISTS kb_imports
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  source_key TEXT NOT NULL UNIQUE,
+                  source_name TEXT NOT NULL,
+                  status TEXT NOT NULL,
+                  processed INTEGER NOT NULL DEFAULT 0,
+                  inserted INTEGER NOT NULL DEFAULT 0,
+                  duplicates INTEGER NOT NULL DEFAULT 0,
+                  invalid INTEGER NOT NULL DEFAULT 0,
+                  started_at TEXT NOT NULL,
+                  updated_at TEXT NOT NULL,
+                  finished_at TEXT)''')
+
+def _migration_date_indexes(c):
+    # Фильтры по дате без пользователя в просмотре таблиц и выгрузке
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_date ON chat_history (date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_test_results_date ON test_results (date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_test_answers_date ON test_answers (date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_weekly_plans_created ON weekly_plans (created_at)")
+
+def _migration_plan_jobs(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS plan_jobs
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  idempotency_key TEXT NOT NULL,
+                  user_email TEXT NOT NULL,
+                  grade TEXT NOT NULL,
+                  interests TEXT NOT NULL,
+                  status TEXT NOT NULL,
+                  weeks_total INTEGER NOT NULL,
+                  weeks_done INTEGER NOT NULL DEFAULT 0,
+                  weeks_failed INTEGER NOT NULL DEFAULT 0,
+                  error TEXT,
+                  created_at TEXT NOT NULL,
+                  updated_at TEXT NOT NULL,
+                  finished_at TEXT)''')
+    # Не больше одной незавершённой задачи на ключ: повторный клик не запустит вторую генерацию
+    c.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_plan_jobs_active_key ON plan_jobs (idempotency_key)
+                 WHERE status IN ('queued', 'running')""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_plan_jobs_key_finished ON plan_jobs (idempotency_key, finished_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_plan_jobs_status ON plan_jobs (status)")
+    c.execute('''CREATE TABLE IF NOT EXISTS plan_job_weeks
+                 (job_id INTEGER NOT NULL,
+                  week INTEGER NOT NULL,
+                  status TEXT NOT NULL,
+                  content TEXT,
+                  updated_at TEXT NOT NULL,
+                  PRIMARY KEY (job_id, week))''')
+
+def _add_column(c, table, column, definition):
+    # У ADD COLUMN нет IF NOT EXISTS: проверяем сами, чтобы шаг можно было повторить
+    c.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in c.fetchall()}:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _migration_plan_templates(c):
+    _add_column(c, "plan_jobs", "fingerprint", "TEXT")
+    _add_column(c, "plan_jobs", "from_template", "INTEGER NOT NULL DEFAULT 0")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_plan_jobs_fingerprint_created ON plan_jobs (fingerprint, created_at)")
+    # interest_ids хранится как ",1,5,9,": так триггеры находят шаблоны интереса без json1
+    c.execute('''CREATE TABLE IF NOT EXISTS plan_templates
+                 (fingerprint TEXT PRIMARY KEY,
+                  grade TEXT NOT NULL,
+                  interest_ids TEXT NOT NULL,
+                  prompt_version TEXT NOT NULL,
+                  uses INTEGER NOT NULL DEFAULT 0,
+                  created_at TEXT NOT NULL,
+                  last_used_at TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS plan_template_weeks
+                 (fingerprint TEXT NOT NULL,
+                  week_number INTEGER NOT NULL,
+                  content TEXT NOT NULL,
+                  key_definitions TEXT,
+                  key_tags TEXT,
+                  key_knowledge TEXT,
+                  PRIMARY KEY (fingerprint, week_number))''')
+    c.execute("""CREATE TRIGGER IF NOT EXISTS plan_templates_ad AFTER DELETE ON plan_templates BEGIN
+                     DELETE FROM plan_template_weeks WHERE fingerprint = old.fingerprint;
+                 END""")
+    # Шаблон устаревает, если переименован или удалён один из его интересов либо изменён любой промпт
+    c.execute("""CREATE TRIGGER IF NOT EXISTS interests_plan_templates_au AFTER UPDATE OF title ON interests
+                 WHEN old.title IS NOT new.title BEGIN
+                     DELETE FROM plan_templates WHERE interest_ids LIKE '%,' || old.id || ',%';
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS interests_plan_templates_ad AFTER DELETE ON interests BEGIN
+                     DELETE FROM plan_templates WHERE interest_ids LIKE '%,' || old.id || ',%';
+                 END""")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS agent_prompts_plan_templates_{event[0].lower()}
+                      AFTER {event} ON agent_prompts BEGIN
+                          DELETE FROM plan_templates;
+                      END""")
+
+MIGRATIONS = [
+    (1, "initial_schema", _migration_initial_schema),
+    (2, "user_time_indexes", _migration_user_time_indexes),
+    (3, "iso_timestamps", _migration_iso_timestamps),
+    (4, "llm_cache", _migration_llm_cache),
+    (5, "knowledge_base_fts", _migration_knowledge_base_fts),
+    (6, "kb_changelog", _migration_kb_changelog),
+    (7, "kb_import", _migration_kb_import),
+    (8, "date_indexes", _migration_date_indexes),
+    (9, "plan_jobs", _migration_plan_jobs),
+    (10, "plan_templates", _migration_plan_templates),
+]
+
+def get_schema_version():
+    with read_cursor() as c:
+        c.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return c.fetchone()[0]
+
+def migrate():
+    with write_cursor() as c:
+        c.execute('''CREATE TABLE IF NOT EXISTS schema_version
+                     (version INTEGER PRIMARY KEY,
+                      name TEXT NOT NULL,
+                      applied_at TEXT NOT NULL)''')
+    for version, name, step in MIGRATIONS:
+        with write_cursor() as c:
+            # BEGIN IMMEDIATE: параллельно стартующий процесс не применит тот же шаг дважды
+            c.execute("BEGIN IMMEDIATE")
+            c.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,))
+            if c.fetchone():
+                continue
+            step(c)
+            c.execute("INSERT INTO schema_version VALUES (?, ?, ?)", (version, name, _now()))
+        print(f"[{_now()}] ✅ Миграция схемы {version} ({name}) применена")
+
+migrate()
 
 def close_db():
-    conn.close()
+    global _closed
+    with _pool_lock:
+        if _closed:
+            return
+        _closed = True
+    try:
+        flush_llm_cache_touches()
+    except Exception as e:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ❌ Не удалось сохранить обращения к кэшу LLM: {e}")
+    _write_behind.stop()
+    with _pool_lock:
+        connections = list(_all_connections)
+        _all_connections.clear()
+    for conn in connections:
+        conn.close()
     print("✅ Соединение с БД закрыто корректно")
 atexit.register(close_db)
 
 # ========== ЛОГИРОВАНИЕ ОШИБОК ==========
 def log_error(error_type, message, tb):
-    with db_lock:
-        c.execute("INSERT INTO error_logs VALUES (?, ?, ?, ?)",
-                  (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), error_type, message, tb))
-        conn.commit()
+    _insert("INSERT INTO error_logs VALUES (?, ?, ?, ?)",
+            (_now(), error_type, message, tb))
 
 def get_error_logs(limit=50):
-    with db_lock:
+    with read_cursor() as c:
         c.execute("SELECT timestamp, error_type, message, traceback FROM error_logs ORDER BY timestamp DESC LIMIT ?", (limit,))
         return c.fetchall()
 
+# ========== ПРОСМОТР ТАБЛИЦ ==========
+# Таблицы, доступные для просмотра и выгрузки. user/date — колонки фильтров; по каждой из них
+# (или по паре пользователь + дата) есть индекс, так что фильтр не превращается в полный скан.
+BROWSABLE_TABLES = {
+    "progress": {"user": "user_id", "date": "date"},
+    "agent_prompts": {},
+    "error_logs": {"date": "timestamp"},
+    "test_results": {"user": "user_id", "date": "date"},
+    "chat_history": {"user": "user_id", "date": "date"},
+    "test_answers": {"user": "user_id", "date": "date"},
+    "knowledge_base": {},
+    "interests": {},
+    "weekly_plans": {"user": "user_email", "date": "created_at"},
+    "llm_dialogues": {"user": "user_email", "date": "created_at"},
+}
+BROWSE_CELL_LIMIT = 200  # длинные тексты (промпты, ответы, планы) обрезаются на стороне БД
+
+def _check_table(table):
+    if table not in BROWSABLE_TABLES:
+        raise ValueError(f"Таблица недоступна для просмотра: {table}")
+
+def get_table_columns(table):
+    _check_table(table)
+    with read_cursor() as c:
+        c.execute(f"PRAGMA table_info({table})")
+        return [row[1] for row in c.fetchall()]
+
+def get_table_column_types(table):
+    """[(колонка, объявленный тип)] — для выбора типов в колоночных форматах выгрузки."""
+    _check_table(table)
+    with read_cursor() as c:
+        c.execute(f"PRAGMA table_info({table})")
+        return [(row[1], (row[2] or "").upper()) for row in c.fetchall()]
+
+def iter_table_chunks(table, user=None, date_from=None, date_to=None, chunk_size=5000, newest_first=False):
+    """Строки таблицы пачками по chunk_size в порядке вставки — выгрузка без загрузки таблицы в память.
+
+    newest_first — по колонке даты от новых к старым (для таблиц без даты — по rowid в обратном порядке).
+    Все пачки читаются одним курсором, то есть из одного снимка WAL.
+    """
+    columns = get_table_columns(table)
+    clauses, params = table_filter_sql(table, user, date_from, date_to)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    order = "rowid"
+    if newest_first:
+        date_column = BROWSABLE_TABLES[table].get("date")
+        order = f"{date_column} DESC, rowid DESC" if date_column else "rowid DESC"
+    with read_cursor() as c:
+        c.execute(f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY {order}", params)
+        while True:
+            rows = c.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+
+def table_filter_sql(table, user=None, date_from=None, date_to=None):
+    """Условия WHERE и параметры для фильтров таблицы; даты — 'YYYY-MM-DD', правая граница включительно."""
+    spec = BROWSABLE_TABLES[table]
+    clauses, params = [], []
+    if user and spec.get("user"):
+        clauses.append(f"{spec['user']} = ?")
+        params.append(user)
+    if date_from and spec.get("date"):
+        clauses.append(f"{spec['date']} >= ?")
+        params.append(date_from)
+    if date_to and spec.get("date"):
+        clauses.append(f"{spec['date']} < date(?, '+1 day')")
+        params.append(date_to)
+    return clauses, params
+
+def browse_table(table, columns=None, user=None, date_from=None, date_to=None,
+                 before_rowid=None, page_size=50, cell_limit=BROWSE_CELL_LIMIT):
+    """Страница таблицы от новых строк к старым с keyset-пагинацией по rowid.
+
+    Возвращает (колонки, строки, rowid для следующей страницы или None). Первая колонка — rowid.
+    """
+    all_columns = get_table_columns(table)
+    columns = [col for col in (columns or all_columns) if col in all_columns] or all_columns
+    select = ", ".join(
+        f"CASE WHEN typeof({col}) = 'text' AND length({col}) > {int(cell_limit)} "
+        f"THEN substr({col}, 1, {int(cell_limit)}) || '…' ELSE {col} END"
+        for col in columns
+    )
+    clauses, params = table_filter_sql(table, user, date_from, date_to)
+    if before_rowid is not None:
+        clauses.append("rowid < ?")
+        params.append(before_rowid)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    with read_cursor() as c:
+        c.execute(f"SELECT rowid, {select} FROM {table} {where} ORDER BY rowid DESC LIMIT ?",
+                  params + [page_size + 1])
+        rows = c.fetchall()
+    next_rowid = rows[page_size - 1][0] if len(rows) > page_size else None
+    return ["rowid"] + columns, rows[:page_size], next_rowid
+
+def get_table_cell(table, rowid, column):
+    """Полное значение ячейки — для раскрытия обрезанного текста."""
+    if column not in get_table_columns(table):
+        raise ValueError(f"Нет колонки {column} в таблице {table}")
+    with read_cursor() as c:
+        c.execute(f"SELECT {column} FROM {table} WHERE rowid = ?", (rowid,))
+        row = c.fetchone()
+        return row[0] if row else None
+
+# ========== ХРАНЕНИЕ И АРХИВАЦИЯ ==========
+def get_expired_rows(table, cutoff, limit):
+    """Строки старше cutoff по колонке даты таблицы: (колонки, [(rowid, *значения)])."""
+    date_column = BROWSABLE_TABLES[table]["date"]
+    columns = get_table_columns(table)
+    with read_cursor() as c:
+        c.execute(f"SELECT rowid, {', '.join(columns)} FROM {table} WHERE {date_column} < ? ORDER BY rowid LIMIT ?",
+                  (cutoff, limit))
+        return columns, c.fetchall()
+
+def delete_rows(table, rowids):
+    _check_table(table)
+    with write_cursor(table) as c:
+        c.executemany(f"DELETE FROM {table} WHERE rowid = ?", [(rowid,) for rowid in rowids])
+
+def get_auto_vacuum_mode():
+    # Через писателя: соединения пула запоминают режим при открытии и не видят смену после VACUUM
+    with db_lock:
+        mode = _writer.execute("PRAGMA auto_vacuum").fetchone()[0]
+    return {0: "none", 1: "full", 2: "incremental"}.get(mode, "unknown")
+
+def enable_incremental_vacuum():
+    """Переводит существующую БД в auto_vacuum=INCREMENTAL; нужен полный VACUUM, запись на это время стоит."""
+    with db_lock:
+        _writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        _writer.execute("VACUUM")
+
+def incremental_vacuum(max_pages=0):
+    """Возвращает свободные страницы файлу (0 — все) и усекает WAL. Возвращает число освобождённых страниц."""
+    with db_lock:
+        free_before = _writer.execute("PRAGMA freelist_count").fetchone()[0]
+        # execute() делает один шаг и освобождает одну страницу; executescript доводит прагму до конца
+        _writer.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+        free_after = _writer.execute("PRAGMA freelist_count").fetchone()[0]
+        _writer.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return free_before - free_after
+
+def get_storage_stats():
+    """Размер файла БД и WAL, свободные страницы, строки и байты по таблицам."""
+    with read_cursor() as c:
+        page_size = c.execute("PRAGMA page_size").fetchone()[0]
+        page_count = c.execute("PRAGMA page_count").fetchone()[0]
+        freelist = c.execute("PRAGMA freelist_count").fetchone()[0]
+        try:
+            # dbstat есть не во всех сборках SQLite; без него размер по таблицам не показываем
+            c.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")
+            sizes = dict(c.fetchall())
+            c.execute("SELECT tbl_name, name FROM sqlite_master WHERE type = 'index'")
+            for table, index in c.fetchall():
+                sizes[table] = sizes.get(table, 0) + sizes.get(index, 0)
+        except sqlite3.OperationalError:
+            sizes = {}
+        tables = {}
+        for table in BROWSABLE_TABLES:
+            c.execute(f"SELECT COUNT(*) FROM {table}")
+            tables[table] = {"rows": c.fetchone()[0], "bytes": sizes.get(table)}
+    wal_path = DB_PATH + "-wal"
+    return {
+        "file_bytes": os.path.getsize(DB_PATH) if os.path.exists(DB_PATH) else 0,
+        "wal_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        "page_size": page_size,
+        "page_count": page_count,
+        "free_pages": freelist,
+        "tables": tables,
+    }
+
 # ========== ДЕКОРАТОР ==========
 def error_logged(func):
+    if inspect.isgeneratorfunction(func):
+        @wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            try:
+                yield from func(*args, **kwargs)
+            except Exception as e:
+                tb = traceback.format_exc()
+                log_error(type(e).__name__, str(e), tb)
+                raise e
+        return gen_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         try:
@@ -90,48 +763,114 @@ DEFAULT_PROMPTS = {
     "interview_agent": "Ты технический интервьюер. Задай 3 вопроса по теме {topic} для уровня {grade}."
 }
 
+class PromptTemplate:
+    """Шаблон промпта, разобранный string.Formatter один раз при загрузке в кэш."""
+    _formatter = string.Formatter()
+
+    def __init__(self, template: str):
+        self.template = template
+        try:
+            self._parts = list(self._formatter.parse(template))
+        except ValueError:
+            self._parts = None  # некорректный шаблон: format() выдаст ту же ошибку, что и str.format
+        if self._parts and any(spec and "{" in spec for _, _, spec, _ in self._parts):
+            self._parts = None  # вложенные поля в спецификации формата отдаём str.format
+
+    def format(self, **kwargs) -> str:
+        if self._parts is None:
+            return self.template.format(**kwargs)
+        out = []
+        for literal, field, spec, conversion in self._parts:
+            out.append(literal)
+            if field is not None:
+                value, _ = self._formatter.get_field(field, (), kwargs)
+                value = self._formatter.convert_field(value, conversion)
+                out.append(self._formatter.format_field(value, spec or ""))
+        return "".join(out)
+
+    def __str__(self):
+        return self.template
+
+# Кэш промптов: заполняется в init_prompts, сбрасывается update_prompt через счётчик версий
+_prompt_cache = {}
+_prompt_cache_lock = Lock()
+_prompt_version = 0
+_prompt_cache_version = -1
+_prompt_cache_stats = {"hits": 0, "misses": 0}
+
+def _load_prompt_cache():
+    global _prompt_cache, _prompt_cache_version
+    version = _prompt_version
+    with read_cursor() as c:
+        c.execute("SELECT agent_name, prompt_template FROM agent_prompts")
+        rows = c.fetchall()
+    cache = {name: PromptTemplate(template or "") for name, template in rows}
+    with _prompt_cache_lock:
+        _prompt_cache = cache
+        _prompt_cache_version = version
+    return cache
+
+def _invalidate_prompt_cache():
+    global _prompt_version
+    with _prompt_cache_lock:
+        _prompt_version += 1
+
 def init_prompts():
-    for name, prompt in DEFAULT_PROMPTS.items():
-        c.execute("INSERT OR IGNORE INTO agent_prompts VALUES (?, ?)", (name, prompt))
-    conn.commit()
+    with write_cursor("agent_prompts") as c:
+        for name, prompt in DEFAULT_PROMPTS.items():
+            c.execute("INSERT OR IGNORE INTO agent_prompts VALUES (?, ?)", (name, prompt))
+    _invalidate_prompt_cache()
+    _load_prompt_cache()
+
+def get_prompt_template(agent_name: str) -> PromptTemplate:
+    with _prompt_cache_lock:
+        fresh = _prompt_cache_version == _prompt_version
+        cache = _prompt_cache
+        _prompt_cache_stats["hits" if fresh else "misses"] += 1
+    if not fresh:
+        cache = _load_prompt_cache()
+    return cache.get(agent_name) or PromptTemplate("")
 
 def get_prompt(agent_name: str) -> str:
-    with db_lock:
-        c.execute("SELECT prompt_template FROM agent_prompts WHERE agent_name=?", (agent_name,))
-        row = c.fetchone()
-        return row[0] if row else ""
+    return get_prompt_template(agent_name).template
 
 def update_prompt(agent_name: str, new_prompt: str):
-    with db_lock:
+    with write_cursor("agent_prompts") as c:
         c.execute("UPDATE agent_prompts SET prompt_template=? WHERE agent_name=?", (new_prompt, agent_name))
-        conn.commit()
+    _invalidate_prompt_cache()
+
+def get_prompt_cache_stats():
+    with _prompt_cache_lock:
+        stats = dict(_prompt_cache_stats)
+        stats["version"] = _prompt_version
+        stats["size"] = len(_prompt_cache)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / total if total else 0.0
+    return stats
 
 # ========== ПРОГРЕСС ==========
 def save_progress(user_id, skill, status):
-    with db_lock:
+    with write_cursor("progress") as c:
         c.execute("INSERT INTO progress VALUES (?, ?, ?, ?)",
-                  (user_id, skill, status, datetime.now().strftime("%Y-%m-%d %H:%M")))
-        conn.commit()
+                  (user_id, skill, status, _now()))
 
 def get_progress(user_id):
-    with db_lock:
+    with read_cursor() as c:
         c.execute("SELECT skill, status, date FROM progress WHERE user_id=? ORDER BY date DESC", (user_id,))
         return c.fetchall()
 
 def get_all_progress():
-    with db_lock:
+    with read_cursor() as c:
         c.execute("SELECT user_id, skill, status, date FROM progress ORDER BY date DESC")
         return c.fetchall()
 
 # ========== ИСТОРИЯ ЧАТА ==========
 def save_chat_message(user_id, role, content):
-    with db_lock:
-        c.execute("INSERT INTO chat_history VALUES (?, ?, ?, ?)",
-                  (user_id, role, content, datetime.now().strftime("%Y-%m-%d %H:%M")))
-        conn.commit()
+    _insert("INSERT INTO chat_history VALUES (?, ?, ?, ?)",
+            (user_id, role, content, _now()))
 
 def get_chat_history(user_id, limit=20):
-    with db_lock:
+    with read_cursor() as c:
         c.execute("""
             SELECT role, content, date 
             FROM chat_history 
@@ -143,16 +882,13 @@ def get_chat_history(user_id, limit=20):
 
 # ========== ТЕСТЫ ==========
 def save_test_result(user_id, topic, score, total):
-    with db_lock:
+    with write_cursor("test_results") as c:
         c.execute("INSERT INTO test_results VALUES (?, ?, ?, ?, ?)",
-                  (user_id, topic, score, total, datetime.now().strftime("%Y-%m-%d %H:%M")))
-        conn.commit()
+                  (user_id, topic, score, total, _now()))
 
 def save_test_answer(user_id, topic, question_index, selected, correct):
-    with db_lock:
-        c.execute("INSERT INTO test_answers VALUES (?, ?, ?, ?, ?, ?)",
-                  (user_id, topic, question_index, selected, correct, datetime.now().strftime("%Y-%m-%d %H:%M")))
-        conn.commit()
+    _insert("INSERT INTO test_answers VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, topic, question_index, selected, correct, _now()))
 
 # ========== БАЗА ЗНАНИЙ ==========
 DEFAULT_KNOWLEDGE_BASE = [
@@ -167,38 +903,238 @@ DEFAULT_KNOWLEDGE_BASE = [
 ]
 
 def init_knowledge_base():
-    with db_lock:
+    with write_cursor("knowledge_base") as c:
         c.execute("SELECT COUNT(*) FROM knowledge_base")
         count = c.fetchone()[0]
         if count == 0:
             for item in DEFAULT_KNOWLEDGE_BASE:
                 c.execute("INSERT INTO knowledge_base (title, link, tags) VALUES (?, ?, ?)",
                           (item["title"], item["link"], item["tags"]))
-            conn.commit()
             print("✅ Таблица knowledge_base заполнена начальными данными.")
 
 def get_all_knowledge_base():
-    with db_lock:
+    with read_cursor() as c:
         c.execute("SELECT id, title, link, tags, created_at FROM knowledge_base ORDER BY id DESC")
         return c.fetchall()
 
 def add_knowledge_item(title, link, tags):
-    with db_lock:
+    with write_cursor("knowledge_base") as c:
         c.execute("INSERT INTO knowledge_base (title, link, tags) VALUES (?, ?, ?)",
                   (title, link, tags))
-        conn.commit()
         return c.lastrowid
 
-def search_knowledge_base_simple(query: str) -> list:
+# ========== СИНХРОНИЗАЦИЯ БАЗЫ ЗНАНИЙ ==========
+def get_sync_state(name, default=None):
+    with read_cursor() as c:
+        c.execute("SELECT value FROM sync_state WHERE name = ?", (name,))
+        row = c.fetchone()
+        return row[0] if row else default
+
+def set_sync_state(name, value):
+    with write_cursor("sync_state") as c:
+        c.execute("""INSERT INTO sync_state (name, value, updated_at) VALUES (?, ?, ?)
+                     ON CONFLICT(name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at""",
+                  (name, value, _now()))
+
+def get_kb_changelog_head():
+    # Последний выданный seq берём из sqlite_sequence: он не сбрасывается, когда журнал очищен
+    with read_cursor() as c:
+        c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'kb_changelog'")
+        row = c.fetchone()
+        return row[0] if row else 0
+
+def get_kb_changelog_tail():
+    """Самый старый seq, оставшийся в журнале (None, если журнал пуст)."""
+    with read_cursor() as c:
+        c.execute("SELECT MIN(seq) FROM kb_changelog")
+        return c.fetchone()[0]
+
+def get_kb_changes(after_seq, limit):
+    """Изменения после отметки after_seq: список (seq, kb_id, op) по возрастанию seq."""
+    with read_cursor() as c:
+        c.execute("SELECT seq, kb_id, op FROM kb_changelog WHERE seq > ? ORDER BY seq LIMIT ?",
+                  (after_seq, limit))
+        return c.fetchall()
+
+def get_knowledge_items(ids):
+    if not ids:
+        return []
+    with read_cursor() as c:
+        placeholders = ",".join("?" * len(ids))
+        c.execute(f"SELECT id, title, link, tags FROM knowledge_base WHERE id IN ({placeholders})", list(ids))
+        return c.fetchall()
+
+def iter_knowledge_items(batch_size):
+    """Все ресурсы пачками по id — для полной пересинхронизации без загрузки таблицы в память."""
+    last_id = 0
+    while True:
+        with read_cursor() as c:
+            c.execute("SELECT id, title, link, tags FROM knowledge_base WHERE id > ? ORDER BY id LIMIT ?",
+                      (last_id, batch_size))
+            rows = c.fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+def commit_kb_sync(name, seq):
+    """Сдвигает отметку синхронизации и удаляет обработанные записи журнала в одной транзакции."""
+    with write_cursor("sync_state", "kb_changelog") as c:
+        c.execute("""INSERT INTO sync_state (name, value, updated_at) VALUES (?, ?, ?)
+                     ON CONFLICT(name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at""",
+                  (name, seq, _now()))
+        c.execute("DELETE FROM kb_changelog WHERE seq <= ?", (seq,))
+
+def prune_kb_changelog(state_prefix, max_rows):
+    """Чистит журнал, когда векторной синхронизации нет или она отстала.
+
+    Удаляются записи не новее отметки бэкенда, синхронизировавшегося последним (как в commit_kb_sync),
+    а если отметок нет вовсе — весь журнал: без отметки бэкенд всё равно начнёт с полной пересборки.
+    Сверх max_rows отбрасываются самые старые записи; отставший бэкенд заметит разрыв и пересоберёт индекс.
+    """
+    with write_cursor("kb_changelog") as c:
+        c.execute("SELECT MAX(value) FROM sync_state WHERE name = ? OR name LIKE ?",
+                  (state_prefix, state_prefix + "_%"))
+        hwm = c.fetchone()[0]
+        if hwm is None:
+            c.execute("DELETE FROM kb_changelog")
+        else:
+            c.execute("DELETE FROM kb_changelog WHERE seq <= ?", (hwm,))
+        removed = c.rowcount
+        c.execute("SELECT seq FROM kb_changelog ORDER BY seq DESC LIMIT 1 OFFSET ?", (max_rows,))
+        row = c.fetchone()
+        if row:
+            c.execute("DELETE FROM kb_changelog WHERE seq <= ?", (row[0],))
+            removed += c.rowcount
+        return removed
+
+# ========== МАССОВЫЙ ИМПОРТ БАЗЫ ЗНАНИЙ ==========
+KB_IMPORT_FIELDS = "id, source_key, source_name, status, processed, inserted, duplicates, invalid, started_at, updated_at, finished_at"
+SQL_PARAMS_CHUNK = 500  # запас до лимита числа параметров SQLite в старых сборках
+
+def get_kb_import(source_key):
+    with read_cursor() as c:
+        c.execute(f"SELECT {KB_IMPORT_FIELDS} FROM kb_imports WHERE source_key = ?", (source_key,))
+        row = c.fetchone()
+        return dict(zip(KB_IMPORT_FIELDS.split(", "), row)) if row else None
+
+def start_kb_import(source_key, source_name, restart=False):
+    """Создаёт запись импорта или возвращает существующую (для продолжения с контрольной точки)."""
+    with write_cursor("kb_imports") as c:
+        if restart:
+            c.execute("DELETE FROM kb_imports WHERE source_key = ?", (source_key,))
+        c.execute("""INSERT OR IGNORE INTO kb_imports (source_key, source_name, status, started_at, updated_at)
+                     VALUES (?, ?, 'running', ?, ?)""", (source_key, source_name, _now(), _now()))
+    return get_kb_import(source_key)
+
+def insert_kb_import_chunk(import_id, records, processed, invalid):
+    """Вставляет пачку (title, link, tags) без дубликатов по ссылке и сдвигает контрольную точку.
+
+    Проверка дубликатов, вставка и контрольная точка — одна транзакция: после сбоя импорт
+    продолжится ровно с первой незаписанной строки. Возвращает (вставлено, дубликатов).
+    """
+    unique = {}
+    for title, link, tags in records:
+        unique.setdefault(link, (title, link, tags))
+    with write_cursor("knowledge_base", "kb_imports") as c:
+        links = list(unique)
+        for start in range(0, len(links), SQL_PARAMS_CHUNK):
+            chunk = links[start:start + SQL_PARAMS_CHUNK]
+            c.execute(f"SELECT link FROM knowledge_base WHERE link IN ({','.join('?' * len(chunk))})", chunk)
+            for (link,) in c.fetchall():
+                unique.pop(link, None)
+        c.executemany("INSERT INTO knowledge_base (title, link, tags) VALUES (?, ?, ?)", list(unique.values()))
+        inserted = len(unique)
+        duplicates = len(records) - inserted
+        c.execute("""UPDATE kb_imports SET processed = ?, inserted = inserted + ?, duplicates = duplicates + ?,
+                            invalid = invalid + ?, updated_at = ? WHERE id = ?""",
+                  (processed, inserted, duplicates, invalid, _now(), import_id))
+    return inserted, duplicates
+
+def finish_kb_import(import_id, status):
+    with write_cursor("kb_imports") as c:
+        c.execute("UPDATE kb_imports SET status = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+                  (status, _now(), _now(), import_id))
+
+KB_SEARCH_LIMIT = int(os.getenv("SKILLFORGE_KB_SEARCH_LIMIT", "10"))
+# Служебные слова запроса вида «найди статьи по SQL» — по ним ничего искать не нужно
+KB_STOP_WORDS = {
+    "и", "в", "во", "на", "по", "о", "об", "про", "для", "с", "со", "к", "из", "или", "а",
+    "мне", "как", "какие", "что", "есть", "найди", "найти", "покажи", "подскажи", "посоветуй",
+    "ресурс", "ресурсы", "статья", "статьи", "статью", "материал", "материалы",
+}
+# Типичные окончания русских слов: отбрасываем их и ищем по префиксу основы
+_RU_ENDINGS = sorted([
+    "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ая", "яя", "ое", "ее", "ые", "ие",
+    "ый", "ий", "ой", "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев", "ей", "ую", "юю",
+    "а", "я", "ы", "и", "е", "о", "у", "ю", "ь",
+], key=len, reverse=True)
+_KB_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def _kb_stem(token: str) -> str:
+    if not re.search("[а-яё]", token):
+        return token
+    for ending in _RU_ENDINGS:
+        # Основа короче 4 букв даёт слишком широкий префикс
+        if token.endswith(ending) and len(token) - len(ending) >= 4:
+            return token[:-len(ending)]
+    return token
+
+def build_fts_query(text: str) -> str:
+    """Превращает свободный текст в запрос FTS5: префиксы основ слов через OR."""
+    terms = []
+    for token in _KB_TOKEN_RE.findall(text.lower()):
+        if len(token) < 2 or token in KB_STOP_WORDS:
+            continue
+        term = f'"{_kb_stem(token)}"*'
+        if term not in terms:
+            terms.append(term)
+    return " OR ".join(terms)
+
+_kb_fts_available = None
+
+def kb_fts_available() -> bool:
+    global _kb_fts_available
+    if _kb_fts_available is None:
+        with read_cursor() as c:
+            c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'knowledge_base_fts'")
+            _kb_fts_available = c.fetchone() is not None
+    return _kb_fts_available
+
+def search_knowledge_base_fts(query: str, limit: int = KB_SEARCH_LIMIT) -> list:
+    match = build_fts_query(query)
+    if not match:
+        return []
+    with read_cursor() as c:
+        # bm25: совпадение в заголовке весит больше, чем в тегах
+        c.execute("""
+            SELECT kb.title, kb.link FROM knowledge_base_fts
+            JOIN knowledge_base kb ON kb.id = knowledge_base_fts.rowid
+            WHERE knowledge_base_fts MATCH ?
+            ORDER BY bm25(knowledge_base_fts, 2.0, 1.0)
+            LIMIT ?
+        """, (match, limit))
+        return c.fetchall()
+
+def search_knowledge_base_like(query: str, limit: int = KB_SEARCH_LIMIT) -> list:
     query = query.lower()
-    with db_lock:
+    with read_cursor() as c:
         c.execute("""
             SELECT title, link FROM knowledge_base
             WHERE LOWER(title) LIKE ? OR LOWER(tags) LIKE ?
             ORDER BY id DESC
-        """, (f"%{query}%", f"%{query}%"))
+            LIMIT ?
+        """, (f"%{query}%", f"%{query}%", limit))
         return c.fetchall()
 
+def search_knowledge_base_simple(query: str, limit: int = KB_SEARCH_LIMIT) -> list:
+    if kb_fts_available():
+        try:
+            return search_knowledge_base_fts(query, limit)
+        except sqlite3.OperationalError as e:
+            log_error("KnowledgeBaseFTS", str(e), traceback.format_exc())
+    return search_knowledge_base_like(query, limit)
+
 # ========== ИНТЕРЕСЫ ==========
 DEFAULT_INTERESTS = [
     "Общение с заказчиками и выявление требований",
@@ -214,53 +1150,64 @@ DEFAULT_INTERESTS = [
 ]
 
 def init_interests():
-    with db_lock:
+    with write_cursor("interests") as c:
         c.execute("SELECT COUNT(*) FROM interests")
         count = c.fetchone()[0]
         if count == 0:
             for title in DEFAULT_INTERESTS:
                 c.execute("INSERT INTO interests (title, active) VALUES (?, 1)", (title,))
-            conn.commit()
             print("✅ Таблица interests заполнена начальными данными.")
 
 def get_all_interests():
-    with db_lock:
+    with read_cursor() as c:
         c.execute("SELECT id, title, active, created_at FROM interests ORDER BY id DESC")
         return c.fetchall()
 
 def get_active_interests():
-    with db_lock:
+    with read_cursor() as c:
         c.execute("SELECT title FROM interests WHERE active = 1 ORDER BY id")
         return [row[0] for row in c.fetchall()]
 
 def add_interest(title, active=True):
-    with db_lock:
+    with write_cursor("interests") as c:
         c.execute("INSERT INTO interests (title, active) VALUES (?, ?)", (title, active))
-        conn.commit()
         return c.lastrowid
 
 def update_interest_active(interest_id, active):
-    with db_lock:
+    with write_cursor("interests") as c:
         c.execute("UPDATE interests SET active = ? WHERE id = ?", (active, interest_id))
-        conn.commit()
 
 def delete_interest(interest_id):
-    with db_lock:
+    with write_cursor("interests") as c:
         c.execute("DELETE FROM interests WHERE id = ?", (interest_id,))
-        conn.commit()
 
 # ========== НОВЫЕ ФУНКЦИИ ДЛЯ НЕДЕЛЬНЫХ ПЛАНОВ ==========
 def save_weekly_plan(user_email, grade, week_number, content, key_defs="", key_tags="", key_knowledge=""):
-    with db_lock:
+    with write_cursor("weekly_plans") as c:
         c.execute("""
             INSERT INTO weekly_plans (user_email, grade, week_number, content, key_definitions, key_tags, key_knowledge)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         """, (user_email, grade, week_number, content, key_defs, key_tags, key_knowledge))
-        conn.commit()
         return c.lastrowid
 
+def save_weekly_plans_batch(user_email, grade, plans, dialogues=()):
+    """Сохраняет недели плана и диалоги с LLM одной транзакцией.
+
+    plans — кортежи (week_number, content, key_defs, key_tags, key_knowledge),
+    dialogues — кортежи (prompt, response).
+    """
+    with write_cursor("weekly_plans", "llm_dialogues") as c:
+        c.executemany("""
+            INSERT INTO llm_dialogues (user_email, prompt, response)
+            VALUES (?, ?, ?)
+        """, [(user_email, prompt, response) for prompt, response in dialogues])
+        c.executemany("""
+            INSERT INTO weekly_plans (user_email, grade, week_number, content, key_definitions, key_tags, key_knowledge)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(user_email, grade, *plan) for plan in plans])
+
 def get_weekly_plans(user_email):
-    with db_lock:
+    with read_cursor() as c:
         c.execute("""
             SELECT week_number, content, key_definitions, key_tags, key_knowledge, created_at
             FROM weekly_plans
@@ -269,17 +1216,197 @@ def get_weekly_plans(user_email):
         """, (user_email,))
         return c.fetchall()
 
+# ========== ЗАДАЧИ ГЕНЕРАЦИИ ПЛАНОВ ==========
+PLAN_JOB_FIELDS = ("id, idempotency_key, user_email, grade, interests, status, weeks_total, weeks_done, weeks_failed, "
+                   "error, created_at, updated_at, finished_at, fingerprint, from_template")
+
+def _plan_job_row(c, where, params):
+    c.execute(f"SELECT {PLAN_JOB_FIELDS} FROM plan_jobs WHERE {where} ORDER BY id DESC LIMIT 1", params)
+    row = c.fetchone()
+    return dict(zip(PLAN_JOB_FIELDS.split(", "), row)) if row else None
+
+def submit_plan_job(idempotency_key, user_email, grade, interests_json, weeks_total, reuse_since, fingerprint=None):
+    """Ставит задачу в очередь или возвращает уже существующую с тем же ключом.
+
+    Переиспользуется незавершённая задача или успешная, завершённая не раньше reuse_since
+    (reuse_since=None — только незавершённая).
+    Последняя неудачная задача возвращается в очередь: догенерируются только её недостающие недели.
+    Возвращает (задача, нужно ли поставить её в очередь обработчиков).
+    """
+    with write_cursor("plan_jobs") as c:
+        job = _plan_job_row(c, "idempotency_key = ? AND (status IN ('queued', 'running') "
+                               "OR (status = 'done' AND finished_at >= ?))", (idempotency_key, reuse_since or "~"))
+        if job:
+            return job, False
+        job = _plan_job_row(c, "idempotency_key = ?", (idempotency_key,))
+        if job and job["status"] == "failed":
+            c.execute("""UPDATE plan_jobs SET status = 'queued', error = NULL, updated_at = ?, finished_at = NULL
+                         WHERE id = ?""", (_now(), job["id"]))
+            return _plan_job_row(c, "id = ?", (job["id"],)), True
+        c.execute("""INSERT INTO plan_jobs (idempotency_key, user_email, grade, interests, status, weeks_total,
+                                            created_at, updated_at, fingerprint)
+                     VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)""",
+                  (idempotency_key, user_email, grade, interests_json, weeks_total, _now(), _now(), fingerprint))
+        return _plan_job_row(c, "id = ?", (c.lastrowid,)), True
+
+def get_plan_job(job_id):
+    """Задача с результатами по неделям: {"weeks": {неделя: (статус, текст)}, ...}."""
+    with read_cursor() as c:
+        job = _plan_job_row(c, "id = ?", (job_id,))
+        if job:
+            c.execute("SELECT week, status, content FROM plan_job_weeks WHERE job_id = ? ORDER BY week", (job_id,))
+            job["weeks"] = {week: (status, content) for week, status, content in c.fetchall()}
+        return job
+
+def claim_plan_job(job_id):
+    """Переводит задачу из очереди в работу; False — её уже взял другой обработчик или она завершена."""
+    with write_cursor("plan_jobs") as c:
+        c.execute("UPDATE plan_jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+                  (_now(), job_id))
+        return c.rowcount == 1
+
+def requeue_running_plan_jobs():
+    """После перезапуска возвращает в очередь задачи, прерванные на середине. Возвращает id всех задач в очереди."""
+    with write_cursor("plan_jobs") as c:
+        c.execute("UPDATE plan_jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (_now(),))
+        c.execute("SELECT id FROM plan_jobs WHERE status = 'queued' ORDER BY id")
+        return [row[0] for row in c.fetchall()]
+
+def save_plan_job_week(job_id, user_email, grade, week, prompt, response, plan=None):
+    """Фиксирует результат недели одной транзакцией: диалог, строку weekly_plans и отметку в задаче.
+
+    plan — (content, key_defs, key_tags, key_knowledge) для успешной недели, None — для неудачной.
+    response — сырой ответ модели (в диалог); пользователю показывается content.
+    Неделя, отмеченная done, при продолжении задачи не генерируется заново, поэтому дублей в
+    weekly_plans не бывает.
+    """
+    with write_cursor("weekly_plans", "llm_dialogues", "plan_jobs", "plan_job_weeks") as c:
+        c.execute("INSERT INTO llm_dialogues (user_email, prompt, response) VALUES (?, ?, ?)",
+                  (user_email, prompt, response))
+        if plan is not None:
+            c.execute("""
+                INSERT INTO weekly_plans (user_email, grade, week_number, content, key_definitions, key_tags, key_knowledge)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (user_email, grade, week, *plan))
+        c.execute("""INSERT INTO plan_job_weeks (job_id, week, status, content, updated_at) VALUES (?, ?, ?, ?, ?)
+                     ON CONFLICT(job_id, week) DO UPDATE SET status = excluded.status, content = excluded.content,
+                                                             updated_at = excluded.updated_at""",
+                  (job_id, week, "done" if plan is not None else "failed", plan[0] if plan is not None else response, _now()))
+        c.execute("""UPDATE plan_jobs SET
+                         weeks_done = (SELECT COUNT(*) FROM plan_job_weeks WHERE job_id = ? AND status = 'done'),
+                         weeks_failed = (SELECT COUNT(*) FROM plan_job_weeks WHERE job_id = ? AND status = 'failed'),
+                         updated_at = ?
+                     WHERE id = ?""", (job_id, job_id, _now(), job_id))
+
+def finish_plan_job(job_id, status, error=None):
+    with write_cursor("plan_jobs") as c:
+        c.execute("UPDATE plan_jobs SET status = ?, error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+                  (status, error, _now(), _now(), job_id))
+
+def get_interest_ids(titles):
+    """{название: id} для известных интересов из titles."""
+    titles = list(titles)
+    with read_cursor() as c:
+        c.execute(f"SELECT title, id FROM interests WHERE title IN ({','.join('?' * len(titles))})", titles)
+        return dict(c.fetchall())
+
+def get_plan_template(fingerprint):
+    with read_cursor() as c:
+        c.execute("""SELECT week_number, content, key_definitions, key_tags, key_knowledge
+                     FROM plan_template_weeks WHERE fingerprint = ? ORDER BY week_number""", (fingerprint,))
+        return c.fetchall()
+
+def save_plan_template(fingerprint, grade, interest_ids, prompt_version, plans, versions):
+    """Сохраняет шаблон плана: plans — кортежи (week_number, content, key_defs, key_tags, key_knowledge).
+
+    versions — версии interests и agent_prompts на момент начала генерации; если за время
+    генерации они изменились, шаблон уже устарел и не сохраняется. Возвращает, сохранён ли он.
+    """
+    with write_cursor("plan_templates", "plan_template_weeks") as c:
+        if versions != (get_table_version("interests"), get_table_version("agent_prompts")):
+            return False
+        c.execute("DELETE FROM plan_templates WHERE fingerprint = ?", (fingerprint,))
+        c.execute("""INSERT INTO plan_templates (fingerprint, grade, interest_ids, prompt_version, created_at)
+                     VALUES (?, ?, ?, ?, ?)""",
+                  (fingerprint, grade, "," + ",".join(map(str, interest_ids)) + ",", prompt_version, _now()))
+        c.executemany("""INSERT INTO plan_template_weeks
+                             (fingerprint, week_number, content, key_definitions, key_tags, key_knowledge)
+                         VALUES (?, ?, ?, ?, ?, ?)""", [(fingerprint, *plan) for plan in plans])
+        return True
+
+def apply_plan_template(job_id, fingerprint, user_email, grade, weeks_total):
+    """Копирует готовый шаблон в weekly_plans пользователя и завершает задачу одной транзакцией.
+
+    Возвращает False, если полного шаблона нет (например, его только что сбросил триггер).
+    """
+    with write_cursor("weekly_plans", "plan_jobs", "plan_job_weeks", "plan_templates") as c:
+        c.execute("""SELECT week_number, content, key_definitions, key_tags, key_knowledge
+                     FROM plan_template_weeks WHERE fingerprint = ? ORDER BY week_number""", (fingerprint,))
+        plans = c.fetchall()
+        if len(plans) != weeks_total:
+            return False
+        c.executemany("""
+            INSERT INTO weekly_plans (user_email, grade, week_number, content, key_definitions, key_tags, key_knowledge)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(user_email, grade, *plan) for plan in plans])
+        c.executemany("INSERT OR REPLACE INTO plan_job_weeks (job_id, week, status, content, updated_at) VALUES (?, ?, 'done', ?, ?)",
+                      [(job_id, week, content, _now()) for week, content, *_ in plans])
+        c.execute("""UPDATE plan_jobs SET status = 'done', weeks_done = ?, from_template = 1, updated_at = ?, finished_at = ?
+                     WHERE id = ?""", (len(plans), _now(), _now(), job_id))
+        c.execute("UPDATE plan_templates SET uses = uses + 1, last_used_at = ? WHERE fingerprint = ?",
+                  (_now(), fingerprint))
+        return True
+
+def get_popular_plan_combinations(since, limit):
+    """Самые частые (fingerprint, grade, interests) среди задач с since, для которых ещё нет шаблона."""
+    with read_cursor() as c:
+        c.execute("""SELECT fingerprint, grade, interests, COUNT(*) AS n FROM plan_jobs
+                     WHERE created_at >= ? AND fingerprint IS NOT NULL
+                       AND fingerprint NOT IN (SELECT fingerprint FROM plan_templates)
+                     GROUP BY fingerprint ORDER BY n DESC LIMIT ?""", (since, limit))
+        return [row[:3] for row in c.fetchall()]
+
+def get_plan_template_summary():
+    with read_cursor() as c:
+        c.execute("SELECT COUNT(*), COALESCE(SUM(uses), 0) FROM plan_templates")
+        templates, uses = c.fetchone()
+        return {"templates": templates, "template_uses": uses}
+
+def get_plan_job_counts():
+    with read_cursor() as c:
+        c.execute("SELECT status, COUNT(*) FROM plan_jobs GROUP BY status")
+        return dict(c.fetchall())
+
 # ========== НОВЫЕ ФУНКЦИИ ДЛЯ ДИАЛОГОВ С LLM ==========
 def save_llm_dialogue(user_email, prompt, response):
-    with db_lock:
-        c.execute("""
-            INSERT INTO llm_dialogues (user_email, prompt, response)
-            VALUES (?, ?, ?)
-        """, (user_email, prompt, response))
-        conn.commit()
+    _insert("""
+        INSERT INTO llm_dialogues (user_email, prompt, response)
+        VALUES (?, ?, ?)
+    """, (user_email, prompt, response))
+
+def get_llm_dialogues_since(after_id, user_email=None, limit=50):
+    """Новые диалоги с id > after_id (свежие первыми); первая колонка — id."""
+    with read_cursor() as c:
+        if user_email:
+            c.execute("""
+                SELECT id, prompt, response, created_at
+                FROM llm_dialogues
+                WHERE user_email=? AND id > ?
+                ORDER BY id DESC
+                LIMIT ?
+            """, (user_email, after_id, limit))
+        else:
+            c.execute("""
+                SELECT id, user_email, prompt, response, created_at
+                FROM llm_dialogues
+                WHERE id > ?
+                ORDER BY id DESC
+                LIMIT ?
+            """, (after_id, limit))
+        return c.fetchall()
 
 def get_llm_dialogues(user_email=None, limit=50):
-    with db_lock:
+    with read_cursor() as c:
         if user_email:
             c.execute("""
                 SELECT prompt, response, created_at
@@ -295,4 +1422,78 @@ def get_llm_dialogues(user_email=None, limit=50):
                 ORDER BY created_at DESC
                 LIMIT ?
             """, (limit,))
-        return c.fetchall()
\ No newline at end of file
+        return c.fetchall()
+
+# ========== КЭШ ОТВЕТОВ LLM ==========
+# Попадания в кэш не пишут в БД сразу: last_access/hits копятся в памяти и сбрасываются
+# одной транзакцией раз в LLM_CACHE_TOUCH_FLUSH_S, перед очисткой по LRU и при закрытии БД.
+LLM_CACHE_TOUCH_FLUSH_S = float(os.getenv("LLM_CACHE_TOUCH_FLUSH_S", "5"))
+_cache_touch_lock = Lock()
+_cache_touches = {}  # cache_key -> [last_access, hits]
+_cache_touch_flushed_at = time.monotonic()
+
+def flush_llm_cache_touches():
+    global _cache_touch_flushed_at
+    with _cache_touch_lock:
+        touches = list(_cache_touches.items())
+        _cache_touches.clear()
+        _cache_touch_flushed_at = time.monotonic()
+    if touches:
+        with write_cursor("llm_cache") as c:
+            c.executemany("UPDATE llm_cache SET last_access=MAX(last_access, ?), hits=hits+? WHERE cache_key=?",
+                          [(last_access, hits, key) for key, (last_access, hits) in touches])
+
+def llm_cache_get(cache_key, ttl_seconds):
+    with read_cursor() as c:
+        c.execute("SELECT response, created_at FROM llm_cache WHERE cache_key=?", (cache_key,))
+        row = c.fetchone()
+    if not row or time.time() - row[1] > ttl_seconds:
+        return None
+    with _cache_touch_lock:
+        touch = _cache_touches.setdefault(cache_key, [0.0, 0])
+        touch[0] = time.time()
+        touch[1] += 1
+        due = time.monotonic() - _cache_touch_flushed_at >= LLM_CACHE_TOUCH_FLUSH_S
+    if due:
+        flush_llm_cache_touches()
+    return row[0]
+
+def llm_cache_put(cache_key, model, response):
+    now = time.time()
+    with write_cursor("llm_cache") as c:
+        c.execute("""
+            INSERT OR REPLACE INTO llm_cache (cache_key, model, response, size_bytes, created_at, last_access, hits)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+        """, (cache_key, model, response, len(response.encode("utf-8")), now, now))
+
+def prune_llm_cache(ttl_seconds, max_entries, max_bytes):
+    """Удаляет просроченные записи, затем самые давно использованные сверх лимитов (LRU)."""
+    flush_llm_cache_touches()
+    with write_cursor("llm_cache") as c:
+        c.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - ttl_seconds,))
+        removed = c.rowcount
+        c.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM llm_cache")
+        count, total_bytes = c.fetchone()
+        if count <= max_entries and total_bytes <= max_bytes:
+            return removed
+        c.execute("SELECT cache_key, size_bytes FROM llm_cache ORDER BY last_access")
+        evict = []
+        for cache_key, size_bytes in c.fetchall():
+            if count <= max_entries and total_bytes <= max_bytes:
+                break
+            evict.append((cache_key,))
+            count -= 1
+            total_bytes -= size_bytes
+        c.executemany("DELETE FROM llm_cache WHERE cache_key=?", evict)
+        return removed + len(evict)
+
+def clear_llm_cache():
+    with write_cursor("llm_cache") as c:
+        c.execute("DELETE FROM llm_cache")
+
+def get_llm_cache_summary():
+    flush_llm_cache_touches()
+    with read_cursor() as c:
+        c.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(SUM(hits), 0) FROM llm_cache")
+        entries, total_bytes, total_hits = c.fetchone()
+    return {"entries": entries, "bytes": total_bytes, "stored_hits": total_hits}
\ No newline at end of file
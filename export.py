@@ -0,0 +1,133 @@
+import os
+import csv
+import time
+import tempfile
+import threading
+import traceback
+from datetime import datetime
+from database import BROWSABLE_TABLES, get_table_column_types, iter_table_chunks, log_error
+
+# pyarrow необязателен: без него доступна только выгрузка в CSV
+pa = None
+pq = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pass
+
+EXPORT_DIR = os.getenv("SKILLFORGE_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "skillforge_exports"))
+EXPORT_CHUNK_ROWS = int(os.getenv("SKILLFORGE_EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_MAX_AGE_S = int(os.getenv("SKILLFORGE_EXPORT_MAX_AGE_S", "3600"))
+EXPORT_REAPER_INTERVAL_S = 300
+EXPORT_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+def available_formats():
+    return ["csv", "parquet", "arrow"] if pa is not None else ["csv"]
+
+# ========== ФОРМАТЫ ==========
+def _write_csv(path, columns, chunks, headers):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(headers or columns)
+        for rows in chunks:
+            writer.writerows(rows)
+
+def _arrow_type(declared):
+    # Типы SQLite по правилам type affinity; BOOLEAN хранится как 0/1
+    if "INT" in declared or declared == "BOOLEAN":
+        return pa.int64()
+    if any(t in declared for t in ("REAL", "FLOA", "DOUB")):
+        return pa.float64()
+    return pa.string()
+
+def _arrow_batches(column_types, chunks, schema):
+    for rows in chunks:
+        # Колонки собираются из пачки построчных кортежей; в памяти одна пачка
+        arrays = [pa.array([row[i] for row in rows], type=schema.field(i).type) for i in range(len(column_types))]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _write_columnar(path, column_types, chunks, fmt):
+    schema = pa.schema([(name, _arrow_type(declared)) for name, declared in column_types])
+    if fmt == "parquet":
+        with pq.ParquetWriter(path, schema) as writer:
+            for batch in _arrow_batches(column_types, chunks, schema):
+                writer.write_batch(batch)
+    else:
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            for batch in _arrow_batches(column_types, chunks, schema):
+                writer.write_batch(batch)
+
+# ========== ВЫГРУЗКА ==========
+def export_table(table, fmt="csv", user=None, date_from=None, date_to=None, headers=None, newest_first=False):
+    """Выгружает таблицу во временный файл и возвращает путь к нему.
+
+    Строки читаются пачками по EXPORT_CHUNK_ROWS, поэтому память не растёт с размером таблицы.
+    newest_first — порядок по колонке даты от новых к старым вместо порядка вставки.
+    Файл пишется как .part и переименовывается только целиком.
+    """
+    if table not in BROWSABLE_TABLES:
+        raise ValueError(f"Таблица недоступна для выгрузки: {table}")
+    if fmt not in available_formats():
+        raise ValueError(f"Формат {fmt} недоступен (для parquet/arrow нужен pyarrow)")
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    start_reaper()
+    column_types = get_table_column_types(table)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    fd, part_path = tempfile.mkstemp(prefix=f"{table}_{stamp}_", suffix=EXPORT_EXTENSIONS[fmt] + ".part", dir=EXPORT_DIR)
+    os.close(fd)
+    started = time.perf_counter()
+    chunks = iter_table_chunks(table, user, date_from, date_to, EXPORT_CHUNK_ROWS, newest_first)
+    try:
+        if fmt == "csv":
+            _write_csv(part_path, [name for name, _ in column_types], chunks, headers)
+        else:
+            _write_columnar(part_path, column_types, chunks, fmt)
+        path = part_path[:-len(".part")]
+        os.replace(part_path, path)
+    except Exception:
+        chunks.close()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Выгрузка {table} ({fmt}) за {time.perf_counter() - started:.1f} с: "
+          f"{os.path.getsize(path) / 1024:.0f} КБ")
+    return path
+
+# ========== ОЧИСТКА ==========
+def reap_exports(max_age=EXPORT_MAX_AGE_S):
+    """Удаляет выгрузки старше max_age и брошенные .part файлы."""
+    if not os.path.isdir(EXPORT_DIR):
+        return 0
+    now = time.time()
+    removed = 0
+    with os.scandir(EXPORT_DIR) as it:
+        for entry in it:
+            try:
+                if entry.is_file() and now - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+def _reaper_loop():
+    while True:
+        time.sleep(EXPORT_REAPER_INTERVAL_S)
+        try:
+            reap_exports()
+        except Exception as e:
+            log_error("ExportReaper", str(e), traceback.format_exc())
+
+def start_reaper():
+    global _reaper
+    if _reaper is not None:
+        return
+    with _reaper_lock:
+        if _reaper is None:
+            reap_exports()
+            _reaper = threading.Thread(target=_reaper_loop, name="export-reaper", daemon=True)
+            _reaper.start()
\ No newline at end of file
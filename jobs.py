@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+import traceback
+from datetime import datetime, timedelta
+from database import (TIMESTAMP_FORMAT, submit_plan_job, get_plan_job, claim_plan_job, requeue_running_plan_jobs,
+                      save_plan_job_week, finish_plan_job, get_plan_job_counts, log_error,
+                      get_interest_ids, save_plan_template, apply_plan_template, get_popular_plan_combinations,
+                      get_plan_template_summary, get_table_version, get_sync_state, set_sync_state)
+from agents import PLAN_WEEKS, PLAN_PROMPT_VERSION, generate_plan_weeks
+
+PLAN_JOB_WORKERS = int(os.getenv("PLAN_JOB_WORKERS", "2"))
+# Повторная отправка тех же email, уровня и интересов в этом окне вернёт готовый план, а не запустит новый
+PLAN_JOB_REUSE_S = int(os.getenv("PLAN_JOB_REUSE_S", "300"))
+TERMINAL_STATUSES = {"done", "failed"}
+# Прогрев шаблонов популярных сочетаний: окно часов по местному времени ("2-5"; пусто — выключен)
+PLAN_PRECOMPUTE_HOURS = os.getenv("PLAN_PRECOMPUTE_HOURS", "2-5")
+PLAN_PRECOMPUTE_TOP = int(os.getenv("PLAN_PRECOMPUTE_TOP", "10"))
+PLAN_PRECOMPUTE_DAYS = int(os.getenv("PLAN_PRECOMPUTE_DAYS", "30"))
+PLAN_PRECOMPUTE_CHECK_S = 900
+PRECOMPUTE_STATE = "plan_precompute_last_run"
+
+def idempotency_key(user_email, grade, interests):
+    canonical = json.dumps([user_email.strip().lower(), grade, sorted(set(interests))], ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+# ========== ШАБЛОНЫ ПЛАНОВ ==========
+def plan_fingerprint(grade, interests):
+    """Отпечаток (уровень, отсортированные id интересов, версия промпта) и сами id.
+
+    (None, None), если какого-то интереса нет в БД: такой план в шаблоны не попадает.
+    """
+    titles = set(interests)
+    ids = get_interest_ids(titles) if titles else {}
+    if not titles or len(ids) != len(titles):
+        return None, None
+    interest_ids = sorted(ids.values())
+    canonical = json.dumps([grade, interest_ids, PLAN_PROMPT_VERSION])
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest(), interest_ids
+
+def _plan_versions():
+    # Версии таблиц, от которых зависит шаблон: изменение во время генерации делает его устаревшим
+    return get_table_version("interests"), get_table_version("agent_prompts")
+
+def _store_template(grade, generated, versions, fingerprint, interest_ids):
+    if fingerprint is None or len(generated) != PLAN_WEEKS or any(plan is None for *_, plan in generated):
+        return False
+    plans = sorted((week, *plan) for week, _, _, plan in generated)
+    return save_plan_template(fingerprint, grade, interest_ids, PLAN_PROMPT_VERSION, plans, versions)
+
+class PlanJobQueue:
+    """Очередь генерации планов: задачи хранятся в plan_jobs, выполняются пулом потоков.
+
+    Готовые недели пишутся в БД сразу, текущие токены — только в память (для опроса из UI).
+    После перезапуска незавершённые задачи продолжаются с первой неготовой недели.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._threads = []
+        self._live = {}
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "deduplicated": 0, "resumed": 0, "from_template": 0}
+
+    def start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            resumed = requeue_running_plan_jobs()
+            for job_id in resumed:
+                self._queue.put(job_id)
+            self._stats["resumed"] += len(resumed)
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._loop, name=f"plan-job-{i + 1}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        if resumed:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Возобновлено задач генерации планов: {len(resumed)}")
+
+    def submit(self, user_email, grade, interests, fresh=False):
+        """Возвращает id задачи; для тех же email, уровня и интересов — id уже идущей задачи.
+
+        Если для уровня и набора интересов есть готовый шаблон, план копируется сразу и задача
+        завершается без обращения к LLM; fresh=True всегда генерирует план заново.
+        """
+        self.start()
+        fingerprint, _ = plan_fingerprint(grade, interests)
+        reuse_since = None if fresh else (datetime.now() - timedelta(seconds=PLAN_JOB_REUSE_S)).strftime(TIMESTAMP_FORMAT)
+        job, enqueue = submit_plan_job(idempotency_key(user_email, grade, interests), user_email, grade,
+                                       json.dumps(list(interests), ensure_ascii=False), PLAN_WEEKS, reuse_since,
+                                       fingerprint)
+        with self._lock:
+            self._stats["submitted" if enqueue else "deduplicated"] += 1
+        if not enqueue:
+            return job["id"]
+        # Шаблон — только для задачи без готовых недель, иначе в weekly_plans появились бы дубли
+        if (not fresh and fingerprint and job["weeks_done"] == 0
+                and apply_plan_template(job["id"], fingerprint, user_email, grade, PLAN_WEEKS)):
+            with self._lock:
+                self._stats["from_template"] += 1
+            return job["id"]
+        self._queue.put(job["id"])
+        return job["id"]
+
+    def status(self, job_id):
+        """Состояние задачи и текст по неделям: готовые — из БД, идущие — накопленные токены."""
+        job = get_plan_job(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            live = dict(self._live.get(job_id, {}))
+        job["texts"] = {week: job["weeks"].get(week, (None, live.get(week, "")))[1]
+                        for week in range(1, job["weeks_total"] + 1)}
+        return job
+
+    def _loop(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                if claim_plan_job(job_id):
+                    self._run(job_id)
+            except Exception as e:
+                # Учёт ошибки сам может упасть (БД заблокирована или закрыта при остановке): поток не должен
+                # умереть вместе с очередью. Задача останется running и вернётся в очередь при перезапуске
+                try:
+                    log_error("PlanJob", str(e), traceback.format_exc())
+                    finish_plan_job(job_id, "failed", str(e))
+                except Exception as bookkeeping_error:
+                    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ❌ Задача плана #{job_id}: "
+                          f"не удалось записать ошибку ({e}): {bookkeeping_error}")
+
+    def _run(self, job_id):
+        job = get_plan_job(job_id)
+        versions = _plan_versions()
+        fingerprint, interest_ids = plan_fingerprint(job["grade"], json.loads(job["interests"]))
+        pending = [week for week in range(1, job["weeks_total"] + 1)
+                   if job["weeks"].get(week, (None,))[0] != "done"]
+        with self._lock:
+            self._live[job_id] = {}
+
+        def on_chunk(week, chunk):
+            with self._lock:
+                live = self._live[job_id]
+                live[week] = live.get(week, "") + chunk
+
+        def on_week(week, prompt, response, plan):
+            save_plan_job_week(job_id, job["user_email"], job["grade"], week, prompt, response, plan)
+
+        started = time.perf_counter()
+        try:
+            generated = generate_plan_weeks(json.loads(job["interests"]), job["grade"], pending, on_chunk, on_week,
+                                            user=job["user_email"])
+        finally:
+            with self._lock:
+                self._live.pop(job_id, None)
+        failed = [week for week, _, _, plan in generated if plan is None]
+        # Шаблон сохраняется только из задачи, сгенерированной целиком за один проход
+        if fingerprint == job["fingerprint"]:
+            _store_template(job["grade"], generated, versions, fingerprint, interest_ids)
+        if failed:
+            finish_plan_job(job_id, "failed", f"Не удалось сгенерировать недели: {', '.join(map(str, failed))}")
+        else:
+            finish_plan_job(job_id, "done")
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Задача плана #{job_id} ({job['user_email']}) "
+              f"за {time.perf_counter() - started:.1f} с, недель: {len(pending) - len(failed)}/{len(pending)}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_progress"] = len(self._live)
+        stats["queue_size"] = self._queue.qsize()
+        stats["by_status"] = get_plan_job_counts()
+        stats.update(get_plan_template_summary())
+        return stats
+
+plan_jobs = PlanJobQueue(PLAN_JOB_WORKERS)
+
+# ========== ПРОГРЕВ ШАБЛОНОВ ==========
+def precompute_templates(limit=PLAN_PRECOMPUTE_TOP):
+    """Генерирует шаблоны для самых частых сочетаний без шаблона. Возвращает число сохранённых."""
+    since = (datetime.now() - timedelta(days=PLAN_PRECOMPUTE_DAYS)).strftime(TIMESTAMP_FORMAT)
+    stored = 0
+    for fingerprint, grade, interests_json in get_popular_plan_combinations(since, limit):
+        interests = json.loads(interests_json)
+        versions = _plan_versions()
+        current, interest_ids = plan_fingerprint(grade, interests)
+        if current != fingerprint:
+            # Интерес переименован или удалён, либо сменилась версия промпта
+            continue
+        generated = generate_plan_weeks(interests, grade, list(range(1, PLAN_WEEKS + 1)),
+                                        lambda *_: None, lambda *_: None, user="plan-precompute")
+        stored += _store_template(grade, generated, versions, fingerprint, interest_ids)
+    set_sync_state(PRECOMPUTE_STATE, int(time.time()))
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Прогрев шаблонов планов: сохранено {stored}")
+    return stored
+
+def _in_precompute_window(hour):
+    start, end = (int(h) for h in PLAN_PRECOMPUTE_HOURS.split("-"))
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+def _precompute_loop():
+    while True:
+        time.sleep(PLAN_PRECOMPUTE_CHECK_S)
+        try:
+            # Не чаще раза за ночь, в том числе после перезапуска внутри окна
+            if (_in_precompute_window(datetime.now().hour)
+                    and time.time() - (get_sync_state(PRECOMPUTE_STATE) or 0) > 12 * 3600):
+                precompute_templates()
+        except Exception as e:
+            log_error("PlanPrecompute", str(e), traceback.format_exc())
+
+_precompute_thread = None
+
+def start_plan_jobs():
+    global _precompute_thread
+    plan_jobs.start()
+    if PLAN_PRECOMPUTE_HOURS and _precompute_thread is None:
+        _precompute_thread = threading.Thread(target=_precompute_loop, name="plan-precompute", daemon=True)
+        _precompute_thread.start()
+
+def submit_plan(user_email, grade, interests, fresh=False):
+    return plan_jobs.submit(user_email, grade, interests, fresh)
+
+def get_plan_job_status(job_id):
+    return plan_jobs.status(job_id)
+
+def get_plan_job_stats():
+    return plan_jobs.stats()
\ No newline at end of file
@@ -0,0 +1,156 @@
+"""Массовый импорт ресурсов в базу знаний из CSV или JSONL.
+
+Запуск из консоли: python kb_import.py catalogue.csv [--format csv|jsonl] [--chunk 1000] [--restart]
+"""
+import os
+import csv
+import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+from datetime import datetime
+from database import start_kb_import, insert_kb_import_chunk, finish_kb_import
+
+KB_IMPORT_CHUNK = int(os.getenv("KB_IMPORT_CHUNK", "1000"))
+KB_IMPORT_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+# Допустимые названия колонок: каталоги курсов редко называют их одинаково
+KB_IMPORT_COLUMNS = {
+    "title": ("title", "name", "название"),
+    "link": ("link", "url", "ссылка"),
+    "tags": ("tags", "теги"),
+}
+
+def _source_key(path):
+    """Один и тот же файл — тот же ключ: по нему импорт продолжается после обрыва."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        digest.update(f.read(1024 * 1024))
+    return f"{os.path.basename(path)}:{os.path.getsize(path)}:{digest.hexdigest()}"
+
+def _field(record, name):
+    for column in KB_IMPORT_COLUMNS[name]:
+        value = record.get(column)
+        if value is not None:
+            return value
+    return None
+
+def _normalize(record):
+    """(title, link, tags) или None, если строка непригодна."""
+    if not isinstance(record, dict):
+        return None
+    record = {str(k).strip().lower(): v for k, v in record.items() if k is not None}
+    title = str(_field(record, "title") or "").strip()
+    link = str(_field(record, "link") or "").strip()
+    tags = _field(record, "tags") or ""
+    if isinstance(tags, (list, tuple)):
+        tags = ",".join(str(tag).strip() for tag in tags)
+    if not title or not link:
+        return None
+    return title, link, str(tags).strip()
+
+def iter_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(64 * 1024)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        for row in csv.DictReader(f, dialect=dialect):
+            yield row
+
+def iter_jsonl(path):
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield None
+
+def detect_format(path):
+    return KB_IMPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+
+def iter_import(path, fmt=None, chunk_size=KB_IMPORT_CHUNK, restart=False):
+    """Импортирует файл пачками и после каждой пачки отдаёт словарь с прогрессом."""
+    fmt = fmt or detect_format(path)
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Неизвестный формат файла: {os.path.basename(path)} (ожидается .csv или .jsonl)")
+    job = start_kb_import(_source_key(path), os.path.basename(path), restart=restart)
+    progress = {
+        "file": job["source_name"],
+        "status": job["status"],
+        "processed": job["processed"],
+        "inserted": job["inserted"],
+        "duplicates": job["duplicates"],
+        "invalid": job["invalid"],
+        "resumed_from": job["processed"],
+        "rows_per_s": 0.0,
+    }
+    if job["status"] == "done":
+        yield progress
+        return
+
+    # Уже обработанные строки только разбираются и пропускаются: вставка — самая дорогая часть
+    records = iter_csv(path) if fmt == "csv" else iter_jsonl(path)
+    records = itertools.islice(records, job["processed"], None)
+    started = time.perf_counter()
+    processed_now = 0
+    try:
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+            rows = [row for row in map(_normalize, chunk) if row is not None]
+            invalid = len(chunk) - len(rows)
+            processed_now += len(chunk)
+            progress["processed"] += len(chunk)
+            inserted, duplicates = insert_kb_import_chunk(job["id"], rows, progress["processed"], invalid)
+            progress["inserted"] += inserted
+            progress["duplicates"] += duplicates
+            progress["invalid"] += invalid
+            progress["rows_per_s"] = processed_now / max(time.perf_counter() - started, 1e-9)
+            if inserted:
+                _request_embedding()
+            yield progress
+    except Exception:
+        finish_kb_import(job["id"], "failed")
+        progress["status"] = "failed"
+        raise
+    finish_kb_import(job["id"], "done")
+    progress["status"] = "done"
+    yield progress
+
+def _request_embedding():
+    # Эмбеддинг новых строк делает фоновая синхронизация по журналу kb_changelog, пачками
+    from search import request_kb_sync
+    request_kb_sync()
+
+def format_progress(progress):
+    resumed = f", продолжено со строки {progress['resumed_from']}" if progress["resumed_from"] else ""
+    return (f"{progress['file']}: обработано {progress['processed']}, добавлено {progress['inserted']}, "
+            f"дубликатов {progress['duplicates']}, некорректных {progress['invalid']}, "
+            f"{progress['rows_per_s']:.0f} строк/с{resumed}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Массовый импорт ресурсов в базу знаний SkillForge")
+    parser.add_argument("path", help="CSV или JSONL с полями title, link, tags")
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    parser.add_argument("--chunk", type=int, default=KB_IMPORT_CHUNK, help="строк в одной транзакции")
+    parser.add_argument("--restart", action="store_true", help="начать заново, забыв контрольную точку")
+    args = parser.parse_args(argv)
+
+    progress = None
+    for progress in iter_import(args.path, args.format, args.chunk, args.restart):
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {format_progress(progress)}")
+    if progress and progress["status"] == "done":
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Импорт завершён. "
+              "Векторный индекс догонит новые ресурсы при следующей синхронизации приложения.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -1,21 +1,120 @@
 import os
+import json
+import asyncio
+import hashlib
+import threading
+import time
 import requests
 import traceback
 from datetime import datetime
-from database import log_error
+from database import log_error, llm_cache_get, llm_cache_put, prune_llm_cache, get_llm_cache_summary
+import llm_client
+from llm_client import CircuitOpenError
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+# Для нагрузочных тестов можно указать мок-сервер (mock_openrouter.py)
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
 # Можно попробовать другую бесплатную модель, например:
 # "google/gemini-2.0-flash-exp:free" (большой контекст)
 DEFAULT_MODEL = "stepfun/step-3.5-flash:free"
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_MAX_TOKENS = 1000
+CIRCUIT_OPEN_MESSAGE = "⚠️ AI-помощник временно недоступен: слишком много ошибок подряд, повторите позже."
 
-def call_llm(prompt: str, system_prompt: str = None) -> str:
-    if not OPENROUTER_API_KEY:
-        msg = "⚠️ Внешний AI-помощник недоступен: не задан ключ API OpenRouter."
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}")
-        return msg
+# ========== КЭШ ОТВЕТОВ ==========
+# Ключ — хэш от модели, системного промпта, промпта и параметров сэмплирования.
+# Ошибки и заглушки ("⚠️"/"❌" и т.п.) в кэш не попадают.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL_S = int(os.getenv("LLM_CACHE_TTL_S", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+LLM_CACHE_PRUNE_EVERY = 50  # чистим по TTL/LRU раз в N записей
+LLM_ERROR_PREFIXES = (
+    "⚠️", "❌",
+    "Ошибка внешнего API",
+    "Превышено время ожидания",
+    "Не удалось подключиться",
+)
+
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "bytes_saved": 0}
+# Расход токенов по полю usage ответов API (потоковые ответы его обычно не присылают)
+_usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+def is_llm_error(text: str) -> bool:
+    return not text or text.startswith(LLM_ERROR_PREFIXES)
+
+def llm_cache_key(model, system_prompt, prompt, temperature, max_tokens, response_format=None) -> str:
+    key = {
+        "model": model,
+        "system": system_prompt or "",
+        "prompt": prompt,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    if response_format is not None:
+        # Только при наличии: ключи обычных запросов остаются прежними
+        key["response_format"] = response_format
+    raw = json.dumps(key, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _cache_lookup(cache_key):
+    cached = llm_cache_get(cache_key, LLM_CACHE_TTL_S)
+    with _cache_lock:
+        if cached is None:
+            _cache_stats["misses"] += 1
+        else:
+            _cache_stats["hits"] += 1
+            _cache_stats["bytes_saved"] += len(cached.encode("utf-8"))
+    return cached
+
+def _cache_store(cache_key, model, answer):
+    if is_llm_error(answer):
+        return
+    llm_cache_put(cache_key, model, answer)
+    with _cache_lock:
+        _cache_stats["stored"] += 1
+        need_prune = _cache_stats["stored"] % LLM_CACHE_PRUNE_EVERY == 0
+    if need_prune:
+        prune_llm_cache(LLM_CACHE_TTL_S, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_BYTES)
+
+def get_llm_cache_stats():
+    with _cache_lock:
+        stats = dict(_cache_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["enabled"] = LLM_CACHE_ENABLED
+    stats.update(get_llm_cache_summary())
+    return stats
+
+def _record_usage(usage):
+    with _cache_lock:
+        _usage["calls"] += 1
+        _usage["prompt_tokens"] += (usage or {}).get("prompt_tokens", 0)
+        _usage["completion_tokens"] += (usage or {}).get("completion_tokens", 0)
+
+def get_llm_usage():
+    with _cache_lock:
+        return dict(_usage)
 
+def _ts():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _cache_prepare(prompt, system_prompt, use_cache, max_tokens=DEFAULT_MAX_TOKENS, response_format=None):
+    """Возвращает (cache_key, cached_answer); cache_key=None, если кэш не используется."""
+    if not LLM_CACHE_ENABLED:
+        return None, None
+    if not use_cache:
+        with _cache_lock:
+            _cache_stats["bypassed"] += 1
+        return None, None
+    cache_key = llm_cache_key(DEFAULT_MODEL, system_prompt, prompt, DEFAULT_TEMPERATURE, max_tokens, response_format)
+    cached = _cache_lookup(cache_key)
+    if cached is not None:
+        print(f"[{_ts()}] 💾 LLM ответ взят из кэша: {prompt[:200]}...")
+    return cache_key, cached
+
+def _build_request(prompt, system_prompt, stream=False, max_tokens=DEFAULT_MAX_TOKENS, response_format=None):
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
@@ -32,48 +131,225 @@ def call_llm(prompt: str, system_prompt: str = None) -> str:
     payload = {
         "model": DEFAULT_MODEL,
         "messages": messages,
-        "temperature": 0.7,
-        "max_tokens": 1000  # Увеличено с 1000, но не слишком большое значение
+        "temperature": DEFAULT_TEMPERATURE,
+        "max_tokens": max_tokens
     }
+    if response_format is not None:
+        payload["response_format"] = response_format
+    if stream:
+        payload["stream"] = True
+    return headers, payload
 
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] LLM запрос: {prompt[:200]}...")
+def _log_finish_reason(finish_reason):
+    if finish_reason == 'length':
+        print(f"[{_ts()}] ⚠️ Ответ обрезан из-за достижения лимита токенов (finish_reason=length)")
+    elif finish_reason == 'stop':
+        print(f"[{_ts()}] ✅ Ответ завершён штатно (finish_reason=stop)")
+    else:
+        print(f"[{_ts()}] 🔍 Ответ завершён с причиной: {finish_reason}")
 
-    try:
-        response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload, timeout=60)
-
-        if response.status_code != 200:
-            error_body = response.text
-            error_msg = f"❌ HTTP {response.status_code}: {error_body[:200]}"
-            log_error("LLM_API_HTTP", error_msg, traceback.format_exc())
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {error_msg}")
-            return f"Ошибка внешнего API: {response.status_code}"
-
-        data = response.json()
-        answer = data['choices'][0]['message']['content']
-        finish_reason = data['choices'][0].get('finish_reason')
-
-        # Логируем причину завершения
-        if finish_reason == 'length':
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ⚠️ Ответ обрезан из-за достижения лимита токенов (finish_reason=length)")
-        elif finish_reason == 'stop':
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Ответ завершён штатно (finish_reason=stop)")
-        else:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 🔍 Ответ завершён с причиной: {finish_reason}")
+def _parse_response(response, cache_key, validate=None) -> str:
+    if response.status_code != 200:
+        error_body = response.text
+        error_msg = f"❌ HTTP {response.status_code}: {error_body[:200]}"
+        log_error("LLM_API_HTTP", error_msg, traceback.format_exc())
+        print(f"[{_ts()}] {error_msg}")
+        return f"Ошибка внешнего API: {response.status_code}"
+
+    data = response.json()
+    answer = data['choices'][0]['message']['content']
+    finish_reason = data['choices'][0].get('finish_reason')
+    _record_usage(data.get('usage'))
+
+    # Логируем причину завершения
+    _log_finish_reason(finish_reason)
 
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] LLM ответ (первые 200 символов): {answer[:200]}...")
-        return answer
+    print(f"[{_ts()}] LLM ответ (первые 200 символов): {answer[:200]}...")
+    if cache_key and finish_reason != 'length':
+        if validate is None or validate(answer):
+            _cache_store(cache_key, DEFAULT_MODEL, answer)
+        else:
+            print(f"[{_ts()}] ⚠️ Ответ не прошёл проверку формата и не кэшируется")
+    return answer
 
-    except requests.exceptions.Timeout:
+def _error_reply(e: Exception) -> str:
+    if isinstance(e, CircuitOpenError):
+        # Не пишем в лог ошибок каждый отклонённый запрос — только в консоль
+        print(f"[{_ts()}] ⚡ Запрос к LLM отклонён: circuit breaker открыт")
+        return CIRCUIT_OPEN_MESSAGE
+    if isinstance(e, requests.exceptions.Timeout):
         log_error("LLM_API_TIMEOUT", "Request timeout", traceback.format_exc())
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ❌ Тайм-аут при обращении к API")
+        print(f"[{_ts()}] ❌ Тайм-аут при обращении к API")
         return "Превышено время ожидания ответа от AI-помощника."
-
-    except requests.exceptions.ConnectionError:
+    if isinstance(e, requests.exceptions.ConnectionError):
         log_error("LLM_API_CONNECTION", "Connection error", traceback.format_exc())
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ❌ Ошибка соединения с API")
+        print(f"[{_ts()}] ❌ Ошибка соединения с API")
         return "Не удалось подключиться к AI-помощнику."
+    log_error("LLM_API", str(e), traceback.format_exc())
+    print(f"[{_ts()}] ❌ Неизвестная ошибка: {e}")
+    return f"❌ Ошибка при обращении к AI-помощнику: {e}"
+
+def _flight_key(kind, prompt, system_prompt, max_tokens=DEFAULT_MAX_TOKENS, response_format=None):
+    return kind + ":" + llm_cache_key(DEFAULT_MODEL, system_prompt, prompt, DEFAULT_TEMPERATURE, max_tokens, response_format)
 
+def call_llm(prompt: str, system_prompt: str = None, use_cache: bool = True,
+             max_tokens: int = DEFAULT_MAX_TOKENS, response_format: dict = None, user: str = None,
+             validate=None) -> str:
+    """Обычный запрос к LLM. response_format — например, JSON-схема ответа (structured outputs).
+
+    user — email пользователя для справедливой очереди в llm_client. Одновременные одинаковые
+    запросы с use_cache=True уходят в API один раз; use_cache=False — всегда отдельный запрос.
+    validate(answer) -> bool: ответ, не прошедший проверку, возвращается, но в кэш не попадает.
+    """
+    cache_key, cached = _cache_prepare(prompt, system_prompt, use_cache, max_tokens, response_format)
+    if cached is not None:
+        return cached
+
+    if not OPENROUTER_API_KEY:
+        msg = "⚠️ Внешний AI-помощник недоступен: не задан ключ API OpenRouter."
+        print(f"[{_ts()}] {msg}")
+        return msg
+
+    headers, payload = _build_request(prompt, system_prompt, max_tokens=max_tokens, response_format=response_format)
+
+    def send():
+        print(f"[{_ts()}] LLM запрос: {prompt[:200]}...")
+        try:
+            # Пул соединений, очередь, повторы с backoff и circuit breaker — в llm_client
+            response = llm_client.post(OPENROUTER_API_URL, headers, payload, user=user)
+            return _parse_response(response, cache_key, validate)
+        except Exception as e:
+            return _error_reply(e)
+
+    if not use_cache:
+        return send()
+    return llm_client.singleflight.do(_flight_key("call", prompt, system_prompt, max_tokens, response_format), send)
+
+async def acall_llm(prompt: str, system_prompt: str = None, use_cache: bool = True, user: str = None) -> str:
+    """Асинхронный вариант call_llm для кода на asyncio (aiohttp, если установлен)."""
+    cache_key, cached = await asyncio.to_thread(_cache_prepare, prompt, system_prompt, use_cache)
+    if cached is not None:
+        return cached
+
+    if not OPENROUTER_API_KEY:
+        msg = "⚠️ Внешний AI-помощник недоступен: не задан ключ API OpenRouter."
+        print(f"[{_ts()}] {msg}")
+        return msg
+
+    headers, payload = _build_request(prompt, system_prompt)
+    print(f"[{_ts()}] LLM запрос (async): {prompt[:200]}...")
+    try:
+        response = await llm_client.apost(OPENROUTER_API_URL, headers, payload, user=user)
+        return await asyncio.to_thread(_parse_response, response, cache_key)
     except Exception as e:
-        log_error("LLM_API", str(e), traceback.format_exc())
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ❌ Неизвестная ошибка: {e}")
-        return f"❌ Ошибка при обращении к AI-помощнику: {e}"
\ No newline at end of file
+        return await asyncio.to_thread(_error_reply, e)
+
+# ========== ПОТОКОВЫЙ РЕЖИМ (SSE) ==========
+class LLMStream:
+    """Потоковый ответ LLM: итерация отдаёт фрагменты текста по мере генерации.
+
+    После окончания итерации доступны text (весь показанный текст), ok (ответ получен
+    полностью и без ошибок) и finish_reason. Ошибки не бросаются, а отдаются как текст,
+    так же как в call_llm.
+    """
+
+    def __init__(self, prompt: str, system_prompt: str = None, use_cache: bool = True, user: str = None):
+        self.prompt = prompt
+        self.system_prompt = system_prompt
+        self.use_cache = use_cache
+        self.user = user
+        self.text = ""
+        self.ok = False
+        self.finish_reason = None
+        self.ttft = None
+
+    def __iter__(self):
+        if not self.use_cache:
+            source, owner = self._chunks(), self
+        else:
+            # Одинаковый поток, уже идущий для другого пользователя, читаем вместе с ним
+            source, owner = llm_client.singleflight.share(_flight_key("stream", self.prompt, self.system_prompt),
+                                                          self._chunks, self)
+        for chunk in source:
+            self.text += chunk
+            yield chunk
+        if owner is not self:
+            self.ok, self.finish_reason, self.ttft = owner.ok, owner.finish_reason, owner.ttft
+
+    def _chunks(self):
+        cache_key, cached = _cache_prepare(self.prompt, self.system_prompt, self.use_cache)
+        if cached is not None:
+            self.ok = True
+            yield cached
+            return
+
+        if not OPENROUTER_API_KEY:
+            msg = "⚠️ Внешний AI-помощник недоступен: не задан ключ API OpenRouter."
+            print(f"[{_ts()}] {msg}")
+            yield msg
+            return
+
+        headers, payload = _build_request(self.prompt, self.system_prompt, stream=True)
+        print(f"[{_ts()}] LLM запрос (stream): {self.prompt[:200]}...")
+        started = time.perf_counter()
+        parts = []
+        try:
+            with llm_client.stream(OPENROUTER_API_URL, headers, payload, user=self.user) as response:
+                if response.status_code != 200:
+                    error_msg = f"❌ HTTP {response.status_code}: {response.text[:200]}"
+                    log_error("LLM_API_HTTP", error_msg, traceback.format_exc())
+                    print(f"[{_ts()}] {error_msg}")
+                    yield f"Ошибка внешнего API: {response.status_code}"
+                    return
+                for delta in self._iter_sse(response):
+                    if self.ttft is None:
+                        self.ttft = time.perf_counter() - started
+                        print(f"[{_ts()}] ⏱️ LLM первый токен через {self.ttft:.2f} с")
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            yield self._interrupted(_error_reply(e), parts)
+            return
+
+        total = time.perf_counter() - started
+        answer = "".join(parts)
+        _log_finish_reason(self.finish_reason)
+        ttft = f"{self.ttft:.2f} с" if self.ttft is not None else "—"
+        print(f"[{_ts()}] ⏱️ LLM поток завершён: первый токен {ttft}, всего {total:.2f} с")
+        print(f"[{_ts()}] LLM ответ (первые 200 символов): {answer[:200]}...")
+        self.ok = bool(answer)
+        if cache_key and self.ok and self.finish_reason != 'length':
+            _cache_store(cache_key, DEFAULT_MODEL, answer)
+
+    def _iter_sse(self, response):
+        # Читаем байты и декодируем сами: у text/event-stream часто нет charset
+        for raw in response.iter_lines():
+            line = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+            if not line or line.startswith(":"):
+                continue  # keep-alive комментарии вида ": OPENROUTER PROCESSING"
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            chunk = json.loads(data)
+            if "error" in chunk:
+                raise RuntimeError(chunk["error"].get("message", chunk["error"]))
+            if chunk.get("usage"):
+                # OpenRouter присылает расход токенов последним чанком, иногда без choices
+                _record_usage(chunk["usage"])
+            if not chunk.get("choices"):
+                continue
+            choice = chunk["choices"][0]
+            if choice.get("finish_reason"):
+                self.finish_reason = choice["finish_reason"]
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
+    @staticmethod
+    def _interrupted(message, parts):
+        return f"\n\n{message}" if parts else message
+
+def call_llm_stream(prompt: str, system_prompt: str = None, use_cache: bool = True, user: str = None) -> LLMStream:
+    return LLMStream(prompt, system_prompt, use_cache, user)
@@ -0,0 +1,463 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+
+# aiohttp необязателен: без него асинхронный вариант работает через пул потоков
+aiohttp = None
+try:
+    import aiohttp
+except ImportError:
+    pass
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_RETRY_AFTER_MAX = float(os.getenv("LLM_RETRY_AFTER_MAX", "30"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Глобальный лимит одновременных запросов к OpenRouter (на весь процесс)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# Ограничение частоты запросов (token bucket): в среднем LLM_RATE_PER_S в секунду, пачкой до LLM_RATE_BURST.
+# По умолчанию 0 — без ограничения; включается явно, например под лимиты бесплатного тарифа
+LLM_RATE_PER_S = float(os.getenv("LLM_RATE_PER_S", "0"))
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "5"))
+QUEUE_WAIT_SAMPLES = 1000
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: после серии ошибок API временно считается недоступным."""
+
+# ========== CIRCUIT BREAKER ==========
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                # Пропускаем один пробный запрос; остальные ждут его результата
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ LLM circuit breaker закрыт")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ⚠️ LLM circuit breaker открыт на {self.cooldown:.0f} с")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = 0.0
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "retry_in_s": round(retry_in, 1),
+            }
+
+breaker = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "attempts": 0,
+    "retries": 0,
+    "short_circuited": 0,
+    "failures": 0,
+    "coalesced": 0,
+    "queued": 0,
+    "retry_reasons": {},
+}
+
+# ========== ОЧЕРЕДЬ И ОГРАНИЧЕНИЕ ЧАСТОТЫ ==========
+class FairLimiter:
+    """Не больше capacity запросов одновременно; ожидающие обслуживаются по кругу между пользователями.
+
+    Пользователь, поставивший в очередь десяток запросов (например, генерацию плана), получает
+    следующий слот только после того, как свою очередь пройдут остальные ожидающие.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_flight = 0
+        self._queues = OrderedDict()  # пользователь -> очередь ожидающих (Event)
+        self._lock = threading.Lock()
+
+    def acquire(self, user=None) -> float:
+        """Занимает слот; возвращает время ожидания в секундах."""
+        with self._lock:
+            if self.in_flight < self.capacity and not self._queues:
+                self.in_flight += 1
+                return 0.0
+            waiter = threading.Event()
+            self._queues.setdefault(user or "", deque()).append(waiter)
+        started = time.monotonic()
+        waiter.wait()
+        return time.monotonic() - started
+
+    def release(self):
+        with self._lock:
+            if not self._queues:
+                self.in_flight -= 1
+                return
+            # Слот переходит ожидающему напрямую: первому в круге, а его пользователь уходит в конец круга
+            user, waiters = next(iter(self._queues.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            waiter.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": sum(len(waiters) for waiters in self._queues.values()),
+                "waiting_users": len(self._queues),
+            }
+
+class TokenBucket:
+    """Ограничение частоты: запрос ждёт, пока в ведре не накопится токен (rate в секунду, не больше burst)."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Берёт токен, при необходимости ожидая; возвращает время ожидания в секундах."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Токен резервируется сразу (баланс может уйти в минус): ожидающие идут в порядке прихода
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+        return delay
+
+limiter = FairLimiter(LLM_MAX_CONCURRENCY)
+rate_limiter = TokenBucket(LLM_RATE_PER_S, LLM_RATE_BURST)
+_queue_waits = deque(maxlen=QUEUE_WAIT_SAMPLES)
+
+def _acquire_slot(user):
+    """Токен частоты, затем слот конкурентности; время в очереди пишется отдельной метрикой.
+
+    Токен берётся первым: ожидание лимита частоты не должно занимать слот, иначе
+    уже готовые к отправке запросы других пользователей стоят за спящим.
+    """
+    wait = rate_limiter.acquire()
+    wait += limiter.acquire(user)
+    with _stats_lock:
+        _queue_waits.append(wait)
+        _stats["queued"] += wait > 0
+
+# ========== ОБЪЕДИНЕНИЕ ОДИНАКОВЫХ ЗАПРОСОВ ==========
+class _Flight:
+    def __init__(self, owner):
+        self.owner = owner
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.chunks = []
+        self.cond = threading.Condition()
+        self.finished = False
+
+class SingleFlight:
+    """Одновременные одинаковые запросы (по ключу) выполняются один раз, результат получают все."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key, owner):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                _count("coalesced")
+                return flight, False
+            flight = self._flights[key] = _Flight(owner)
+            return flight, True
+
+    def _leave(self, key):
+        with self._lock:
+            self._flights.pop(key, None)
+
+    def do(self, key, fn):
+        flight, leader = self._join(key, None)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._leave(key)
+            flight.done.set()
+
+    def share(self, key, produce, owner):
+        """Потоковый вариант: (итератор фрагментов, владелец). Ведущий вызов выполняет produce(),
+        остальные получают те же фрагменты по мере поступления; owner ведущего доступен всем."""
+        flight, leader = self._join(key, owner)
+        return (self._lead(key, flight, produce) if leader else self._follow(flight)), flight.owner
+
+    def _lead(self, key, flight, produce):
+        try:
+            for chunk in produce():
+                with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+                yield chunk
+        finally:
+            self._leave(key)
+            with flight.cond:
+                flight.finished = True
+                flight.cond.notify_all()
+
+    @staticmethod
+    def _follow(flight):
+        sent = 0
+        while True:
+            with flight.cond:
+                while sent == len(flight.chunks) and not flight.finished:
+                    flight.cond.wait()
+                chunks = flight.chunks[sent:]
+                finished = flight.finished
+            sent += len(chunks)
+            yield from chunks
+            if finished and sent == len(flight.chunks):
+                return
+
+singleflight = SingleFlight()
+
+# ========== ПУЛ СОЕДИНЕНИЙ ==========
+# Одна сессия на процесс: keep-alive и повторное использование TLS-соединений
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=LLM_POOL_SIZE))
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=LLM_POOL_SIZE))
+
+def _count(key, reason=None):
+    with _stats_lock:
+        _stats[key] += 1
+        if reason:
+            _stats["retry_reasons"][reason] = _stats["retry_reasons"].get(reason, 0) + 1
+
+def _backoff_delay(attempt: int) -> float:
+    # Экспоненциальная задержка с полным джиттером
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+def _retry_after_delay(headers, attempt: int) -> float:
+    value = (headers or {}).get("Retry-After")
+    if value:
+        try:
+            return min(LLM_RETRY_AFTER_MAX, max(0.0, float(value)))
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+                return min(LLM_RETRY_AFTER_MAX, max(0.0, delay))
+            except (TypeError, ValueError):
+                pass
+    return _backoff_delay(attempt)
+
+def _check_breaker():
+    _count("requests")
+    if not breaker.allow():
+        _count("short_circuited")
+        raise CircuitOpenError("LLM API временно недоступен (circuit breaker открыт)")
+
+def _record_status(status_code: int):
+    if status_code in RETRYABLE_STATUSES:
+        _count("failures")
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+def _send(url, headers, payload, timeout, stream, user):
+    """Отправляет запрос с повторами. Возвращает ответ, удерживая слот limiter — его освобождает вызывающий."""
+    _check_breaker()
+    attempt = 0
+    while True:
+        _acquire_slot(user)
+        _count("attempts")
+        try:
+            response = _session.post(url, headers=headers, json=payload, timeout=timeout, stream=stream)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            limiter.release()
+            reason = "timeout" if isinstance(e, requests.exceptions.Timeout) else "connection"
+            if attempt >= LLM_MAX_RETRIES:
+                _count("failures")
+                breaker.record_failure()
+                raise
+            _count("retries", reason)
+            time.sleep(_backoff_delay(attempt))
+            attempt += 1
+            continue
+        except Exception:
+            limiter.release()
+            breaker.record_failure()
+            raise
+        if response.status_code in RETRYABLE_STATUSES and attempt < LLM_MAX_RETRIES:
+            delay = _retry_after_delay(response.headers, attempt)
+            response.close()
+            limiter.release()
+            _count("retries", str(response.status_code))
+            time.sleep(delay)
+            attempt += 1
+            continue
+        _record_status(response.status_code)
+        return response
+
+def post(url, headers, payload, timeout=LLM_TIMEOUT, user=None):
+    """user — email пользователя для справедливой очереди; None — общая очередь анонимных запросов."""
+    response = _send(url, headers, payload, timeout, stream=False, user=user)
+    limiter.release()
+    return response
+
+@contextmanager
+def stream(url, headers, payload, timeout=LLM_TIMEOUT, user=None):
+    """Потоковый запрос: слот конкурентности занят, пока вызывающий читает тело ответа."""
+    response = _send(url, headers, payload, timeout, stream=True, user=user)
+    try:
+        yield response
+    finally:
+        response.close()
+        limiter.release()
+
+# ========== АСИНХРОННЫЙ ВАРИАНТ ==========
+class AsyncResponse:
+    """Минимальная совместимая с requests.Response обёртка над ответом aiohttp."""
+
+    def __init__(self, status_code, text, headers):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+
+    def json(self):
+        return json.loads(self.text)
+
+_async_sessions = {}
+
+def _get_async_session():
+    # Сессия aiohttp привязана к event loop, поэтому храним по одной на цикл
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=LLM_POOL_SIZE, keepalive_timeout=30)
+        session = aiohttp.ClientSession(connector=connector)
+        _async_sessions[loop] = session
+    return session
+
+async def apost(url, headers, payload, timeout=LLM_TIMEOUT, user=None):
+    if aiohttp is None:
+        return await asyncio.to_thread(post, url, headers, payload, timeout, user)
+    _check_breaker()
+    session = _get_async_session()
+    attempt = 0
+    while True:
+        await asyncio.to_thread(_acquire_slot, user)
+        _count("attempts")
+        try:
+            async with session.post(url, headers=headers, json=payload,
+                                    timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                response = AsyncResponse(resp.status, await resp.text(), dict(resp.headers))
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
+            is_timeout = isinstance(e, asyncio.TimeoutError)
+            if attempt >= LLM_MAX_RETRIES:
+                _count("failures")
+                breaker.record_failure()
+                # Приводим к исключениям requests, чтобы обработка в llm.py была общей
+                if is_timeout:
+                    raise requests.exceptions.Timeout(str(e)) from e
+                raise requests.exceptions.ConnectionError(str(e)) from e
+            _count("retries", "timeout" if is_timeout else "connection")
+            delay = _backoff_delay(attempt)
+        except Exception:
+            breaker.record_failure()
+            raise
+        else:
+            if response.status_code not in RETRYABLE_STATUSES or attempt >= LLM_MAX_RETRIES:
+                _record_status(response.status_code)
+                return response
+            _count("retries", str(response.status_code))
+            delay = _retry_after_delay(response.headers, attempt)
+        finally:
+            limiter.release()
+        await asyncio.sleep(delay)
+        attempt += 1
+
+async def aclose():
+    for session in list(_async_sessions.values()):
+        if not session.closed:
+            await session.close()
+    _async_sessions.clear()
+
+# ========== МОНИТОРИНГ ==========
+def get_llm_client_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+        stats["retry_reasons"] = dict(_stats["retry_reasons"])
+        waits = sorted(_queue_waits)
+    stats["queue_wait_ms"] = {
+        "p50": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+        "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+        "max": round(waits[-1] * 1000, 1) if waits else 0.0,
+    }
+    stats["limiter"] = limiter.snapshot()
+    stats["rate_per_s"] = LLM_RATE_PER_S
+    stats["breaker"] = breaker.snapshot()
+    stats["async_backend"] = "aiohttp" if aiohttp is not None else "threads"
+    return stats
@@ -0,0 +1,233 @@
+"""Сквозной нагрузочный тест: N пользователей одновременно вызывают обработчики интерфейса.
+
+Запуск: python loadtest.py --users 20 --duration 60 --mix chat=4,plan=1,search=3,test=2
+По умолчанию поднимается встроенный мок OpenRouter (mock_openrouter.py) и временная БД;
+--url направляет запросы на внешний сервер.
+"""
+import os
+import sys
+import time
+import random
+import inspect
+import shutil
+import argparse
+import tempfile
+import threading
+import contextlib
+from datetime import datetime
+from mock_openrouter import add_mock_arguments, mock_from_args
+
+SCENARIOS = ("chat", "plan", "search", "test")
+CHAT_MESSAGES = [
+    "Составь план развития для junior аналитика",
+    "Нужен план подготовки middle аналитика к собеседованию",
+    "Какой план обучения выбрать для перехода в системные аналитики?",
+]
+SEARCH_QUERIES = ["BPMN", "SQL JOIN", "REST API", "Kafka", "требования", "UML диаграммы"]
+GRADES = ["Junior", "Middle", "Expert"]
+
+def _ts():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Неизвестный сценарий: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+class LoadTest:
+    """Пользователь — поток: выбирает сценарий по весам, вызывает обработчик, «думает» и повторяет."""
+
+    def __init__(self, main, search_agent, args):
+        self.main = main
+        self.search_agent = search_agent
+        self.args = args
+        self.results = []  # (сценарий, задержка мс, первый ответ мс, ok, ошибка)
+        self._lock = threading.Lock()
+        self._interests = main.get_active_interests()
+        self._counter = 0
+
+    def _unique(self):
+        # Уникальный суффикс, чтобы одинаковые запросы не схлопывались кэшем и singleflight
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    # ========== СЦЕНАРИИ ==========
+    # Потоковые сценарии — генераторы: первый yield отмечает первый ответ, return — (ok, ошибка).
+    # Остальные сразу возвращают (ok, ошибка).
+    def _chat(self, rng, email):
+        message = rng.choice(CHAT_MESSAGES)
+        if not self.args.repeat_prompts:
+            message += f" (запрос {self._unique()})"
+        chat_history = []
+        for _, chat_history, _ in self.main.respond(message, [], email):
+            yield
+        answer = chat_history[-1]["content"] if chat_history else ""
+        if "Ошибка" in answer or "статический план" in answer or "\n\n⚠️" in answer or "\n\n❌" in answer:
+            return False, answer.strip().splitlines()[-1][:80]
+        return True, None
+
+    def _plan(self, rng, email):
+        selected = rng.sample(self._interests, min(len(self._interests), rng.randint(1, 3)))
+        # Как в интерфейсе: кнопка ставит задачу, затем таймер опрашивает её, пока не завершится
+        output, plan_view, _ = self.main.generate_full_plan(selected, email, rng.choice(GRADES), self.args.fresh_plans)
+        yield
+        while plan_view:
+            time.sleep(self.args.poll_s)
+            value, plan_view, _ = self.main.poll_plan_job(plan_view)
+            if isinstance(value, str):
+                output = value
+        if "завершено с ошибками" in output:
+            return False, "план: завершено с ошибками"
+        if output.startswith(("❌", "⚠️")):
+            return False, output.splitlines()[0][:80]
+        return True, None
+
+    def _search(self, rng, email):
+        result = self.search_agent(rng.choice(SEARCH_QUERIES))
+        return bool(result), None if result else "пустой ответ"
+
+    def _test(self, rng, email):
+        topic = rng.choice(list(self.main.test_questions))
+        idx = rng.randrange(len(self.main.test_questions[topic]))
+        option = rng.choice(self.main.test_questions[topic][idx]["options"])
+        feedback = self.main.check_answer(topic, idx, option, 0, email)[0]
+        if feedback.startswith("Ошибка"):
+            return False, feedback[:80]
+        return True, None
+
+    def _run_once(self, scenario, rng, email):
+        started = time.perf_counter()
+        first_ms = None
+        ok, error = False, None
+        try:
+            steps = getattr(self, "_" + scenario)(rng, email)
+            if not inspect.isgenerator(steps):
+                ok, error = steps
+            else:
+                while True:
+                    next(steps)
+                    if first_ms is None:
+                        first_ms = (time.perf_counter() - started) * 1000
+        except StopIteration as done:
+            ok, error = done.value
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:80]
+        latency_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.results.append((scenario, latency_ms, first_ms, ok, error))
+
+    def _user(self, number, deadline):
+        rng = random.Random(None if self.args.seed is None else self.args.seed + number)
+        email = f"load{number}@example.com"
+        names, weights = zip(*self.args.mix.items())
+        # Разносим старт, чтобы пользователи не приходили одной волной
+        time.sleep(rng.uniform(0, self.args.think_ms / 1000))
+        while time.monotonic() < deadline:
+            self._run_once(rng.choices(names, weights)[0], rng, email)
+            if self.args.think_ms:
+                time.sleep(rng.expovariate(1000 / self.args.think_ms))
+
+    def run(self):
+        deadline = time.monotonic() + self.args.duration
+        users = [threading.Thread(target=self._user, args=(n, deadline), daemon=True) for n in range(self.args.users)]
+        started = time.perf_counter()
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        return time.perf_counter() - started
+
+    # ========== ОТЧЁТ ==========
+    def report(self, elapsed_s):
+        print(f"\n[{_ts()}] Пользователей: {self.args.users}, длительность {elapsed_s:.1f} с, "
+              f"смесь: {', '.join(f'{k}={v:g}' for k, v in self.args.mix.items())}")
+        print(f"  {'сценарий':<10} {'запросов':>8} {'ошибок':>7} {'rps':>7} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} "
+              f"{'первый ответ p50':>17}")
+        groups = [(name, [r for r in self.results if r[0] == name]) for name in self.args.mix]
+        groups.append(("всего", self.results))
+        for name, rows in groups:
+            if not rows:
+                continue
+            latencies = [r[1] for r in rows]
+            firsts = [r[2] for r in rows if r[2] is not None]
+            errors = sum(1 for r in rows if not r[3])
+            first = f"{_percentile(firsts, 0.5):.1f}" if firsts else "—"
+            print(f"  {name:<10} {len(rows):>8} {errors / len(rows):>7.1%} {len(rows) / elapsed_s:>7.2f} "
+                  f"{_percentile(latencies, 0.5):>9.1f} {_percentile(latencies, 0.95):>9.1f} "
+                  f"{_percentile(latencies, 0.99):>9.1f} {first:>17}")
+        samples = {}
+        for row in self.results:
+            if row[4]:
+                samples[row[4]] = samples.get(row[4], 0) + 1
+        for error, count in sorted(samples.items(), key=lambda item: -item[1])[:5]:
+            print(f"  ⚠️ {count}× {error}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест SkillForge через обработчики интерфейса")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="секунд")
+    parser.add_argument("--mix", type=_parse_mix, default=_parse_mix("chat=4,plan=1,search=3,test=2"))
+    parser.add_argument("--think-ms", type=float, default=500, help="средняя пауза пользователя между запросами")
+    parser.add_argument("--fresh-plans", action="store_true", help="не переиспользовать готовые планы")
+    parser.add_argument("--repeat-prompts", action="store_true",
+                        help="одинаковые тексты чата (проверка кэша и объединения запросов)")
+    parser.add_argument("--poll-s", type=float, default=0.2, help="интервал опроса фоновой задачи плана")
+    parser.add_argument("--url", help="внешний OpenRouter-совместимый сервер вместо встроенного мока")
+    parser.add_argument("--verbose", action="store_true", help="не скрывать логи приложения во время нагрузки")
+    add_mock_arguments(parser)
+    args = parser.parse_args(argv)
+
+    mock = None
+    if args.url:
+        os.environ["OPENROUTER_API_URL"] = args.url
+    else:
+        mock = mock_from_args(args).start()
+        os.environ["OPENROUTER_API_URL"] = mock.url
+        os.environ.setdefault("OPENROUTER_API_KEY", "loadtest")
+        print(f"[{_ts()}] Мок OpenRouter: {mock.url}, задержка {args.latency_dist} {args.latency_ms:g} мс, "
+              f"429: {args.error_429_rate:.0%}, 5xx: {args.error_5xx_rate:.0%}, length: {args.length_rate:.0%}")
+    # Временные БД и индекс, чтобы не засорять рабочие; кэш ответов — только для повторяющихся промптов
+    directory = tempfile.mkdtemp(prefix="skillforge-load-")
+    os.environ["SKILLFORGE_DB"] = os.path.join(directory, "load.db")
+    os.environ["SKILLFORGE_VECTOR_INDEX_DIR"] = os.path.join(directory, "vector_index")
+    os.environ.setdefault("LLM_CACHE_ENABLED", "1" if args.repeat_prompts else "0")
+
+    devnull = open(os.devnull, "w")
+    quiet = (lambda: contextlib.nullcontext()) if args.verbose else (lambda: contextlib.redirect_stdout(devnull))
+    try:
+        with quiet():
+            import main as app
+            from agents import search_agent
+            from llm_client import get_llm_client_stats
+            app.start_plan_jobs()
+        print(f"[{_ts()}] Нагрузка: {args.users} пользователей на {args.duration:g} с...")
+        load = LoadTest(app, search_agent, args)
+        with quiet():
+            elapsed = load.run()
+        load.report(elapsed)
+        stats = get_llm_client_stats()
+        print(f"\n  LLM-клиент: запросов {stats['requests']}, попыток {stats['attempts']}, повторов {stats['retries']} "
+              f"{stats['retry_reasons']}, отказов {stats['failures']}, отклонено breaker {stats['short_circuited']}, "
+              f"объединено {stats['coalesced']}, ожидание слота p95 {stats['queue_wait_ms']['p95']} мс")
+        if mock:
+            print(f"  Мок: {mock.stats()}")
+    finally:
+        if mock:
+            mock.stop()
+        with contextlib.redirect_stdout(devnull):
+            from database import close_db
+            close_db()
+        devnull.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -1,33 +1,49 @@
-import gradio as gr
+import os
+import time
+from startup import STARTUP_MODE, timed, record, report, run_warm_up, warm_up_in_background
+with timed("gradio"):
+    import gradio as gr
 import traceback
-from database import (
-    init_prompts, init_knowledge_base, init_interests,
-    log_error,
-    save_chat_message, get_chat_history, get_all_progress, get_error_logs,
-    get_all_knowledge_base, c, db_lock,
-    get_active_interests, get_all_interests,
-    get_weekly_plans, get_llm_dialogues
-)
+with timed("database"):
+    from database import (
+        init_prompts, init_knowledge_base, init_interests,
+        log_error,
+        save_chat_message, get_chat_history, get_all_progress, get_error_logs,
+        get_all_knowledge_base, BROWSABLE_TABLES, get_table_columns, browse_table, get_table_cell,
+        get_active_interests, get_all_interests,
+        get_llm_dialogues_since, get_table_version
+    )
 print("database loaded")
-from agents import chat_respond, validate_file, generate_weekly_plans
-from voice import transcribe_audio, text_to_speech, add_chat_message
-from tests import (
-    test_questions, start_test, load_question, reset_test, check_answer
-)
-from progress import (
-    show_progress, add_progress_ui, export_progress_csv, get_test_details
-)
-from admin import (
-    load_prompt, save_prompt_ui, shutdown_server, add_kb_item_ui,
-    get_all_interests_ui, add_interest_ui, toggle_interest_active_ui, delete_interest_ui
-)
+with timed("agents (llm, search)"):
+    from agents import chat_respond, chat_respond_stream, validate_file
+    from jobs import submit_plan, get_plan_job_status, start_plan_jobs, TERMINAL_STATUSES
+    from search import warm_up_vector_store
+with timed("voice"):
+    from voice import transcribe_audio, text_to_speech, add_chat_message, warm_up_voice
+with timed("tests, progress, admin"):
+    from export import export_table, available_formats
+    from tests import (
+        test_questions, start_test, load_question, reset_test, check_answer
+    )
+    from progress import (
+        show_progress, add_progress_ui, export_progress_csv, get_test_details
+    )
+    from admin import (
+        load_prompt, save_prompt_ui, shutdown_server, add_kb_item_ui, import_kb_file_ui,
+        get_all_interests_ui, add_interest_ui, toggle_interest_active_ui, delete_interest_ui,
+        get_llm_cache_stats_ui, clear_llm_cache_ui, get_llm_client_stats_ui,
+        get_transcription_stats_ui, get_tts_cache_stats_ui, get_search_cache_stats_ui,
+        get_storage_stats_ui, run_retention_ui, enable_incremental_vacuum_ui
+    )
+    from retention import start_retention
 
 print(f"✅ Используется Gradio версии: {gr.__version__}")
 
 # Инициализация БД
-init_prompts()
-init_knowledge_base()
-init_interests()
+with timed("database seed", "init"):
+    init_prompts()
+    init_knowledge_base()
+    init_interests()
 
 # ========== CSS ==========
 custom_css = """
@@ -45,6 +61,10 @@ custom_css = """
     padding: 10px;
     border-radius: 5px;
 }
+#llm-dialogues td {
+    white-space: pre-wrap;
+    vertical-align: top;
+}
 """
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
@@ -58,22 +78,188 @@ def file_verification(file, task_desc):
         log_error("FileVerification", str(e), traceback.format_exc())
         return f"Ошибка чтения файла: {e}"
 
-def get_table_data(table_name):
-    with db_lock:
-        c.execute(f"SELECT * FROM {table_name} ORDER BY rowid DESC LIMIT 100")
-        rows = c.fetchall()
-        c.execute(f"PRAGMA table_info({table_name})")
-        columns = [col[1] for col in c.fetchall()]
-        return rows, columns
-
-def show_table(table_name):
-    data, headers = get_table_data(table_name)
-    if data:
-        return gr.update(value=data, headers=headers)
-    else:
-        return gr.update(value=[["Нет данных"]], headers=["Сообщение"])
+# ========== ОБНОВЛЕНИЕ ТАБЛИЦ ПО ВЕРСИЯМ ==========
+# Таймер спрашивает только версию таблицы; данные перечитываются, когда она изменилась
+def versioned_poll(table, fetch):
+    def poll(seen_version):
+        version = get_table_version(table)
+        if version == seen_version:
+            return gr.update(), seen_version
+        return fetch(), version
+    return poll
+
+DIALOGUES_LIMIT = 50
+# Таблица диалогов дописывается в браузере: сервер отдаёт только новые строки, а в состоянии
+# сессии хранит лишь фильтр, версию и последний показанный id
+DIALOGUES_APPEND_JS = """(delta) => {
+    const table = document.querySelector('#llm-dialogues table');
+    if (!delta || !table || table.dataset.seq === String(delta.seq)) return;
+    table.dataset.seq = String(delta.seq);
+    const body = table.tBodies[0];
+    if (delta.reset) {
+        table.tHead.innerHTML = '';
+        const head = table.tHead.insertRow();
+        delta.headers.forEach((title) => { head.appendChild(document.createElement('th')).textContent = title; });
+        body.innerHTML = '';
+    }
+    delta.rows.slice().reverse().forEach((row) => {
+        const tr = body.insertRow(0);
+        row.forEach((value) => { tr.insertCell().textContent = value ?? ''; });
+    });
+    while (body.rows.length > delta.limit) body.deleteRow(-1);
+}"""
+
+def poll_llm_dialogues(email, view):
+    """Дельта для таблицы диалогов: строки с id больше последнего показанного; view — состояние сессии."""
+    email = (email or "").strip()
+    version = get_table_version("llm_dialogues")
+    same_filter = bool(view) and view["email"] == email
+    if same_filter and view["version"] == version:
+        return gr.update(), view
+    rows = get_llm_dialogues_since(view["last_id"] if same_filter else 0, email or None, DIALOGUES_LIMIT)
+    last_id = rows[0][0] if rows else (view["last_id"] if same_filter else 0)
+    view = {"email": email, "version": version, "last_id": last_id}
+    if same_filter and not rows:
+        return gr.update(), view
+    headers = ["Запрос", "Ответ", "Дата"] if email else ["Email", "Запрос", "Ответ", "Дата"]
+    # seq отличает новую дельту от уже применённой: JS-шаг выполняется после каждого опроса
+    delta = {"seq": time.time_ns(), "reset": not same_filter, "headers": headers,
+             "rows": [list(row[1:]) for row in rows], "limit": DIALOGUES_LIMIT}
+    return delta, view
+
+# ========== ПРОСМОТР ТАБЛИЦ ==========
+def select_table(table_name):
+    if table_name not in BROWSABLE_TABLES:
+        return gr.update(choices=[], value=[]), gr.update(visible=False), gr.update(visible=False), gr.update(choices=[])
+    columns = get_table_columns(table_name)
+    spec = BROWSABLE_TABLES[table_name]
+    return (gr.update(choices=columns, value=columns),
+            gr.update(visible="user" in spec, label=f"Фильтр: {spec.get('user', '')}"),
+            gr.update(visible="date" in spec),
+            gr.update(choices=columns, value=None))
+
+def load_table_page(table_name, columns, user, date_from, date_to, page_size, cursors):
+    """cursors — стек rowid, с которых начинаются показанные страницы (None — первая страница)."""
+    if table_name not in BROWSABLE_TABLES:
+        return gr.update(value=[["Выберите таблицу"]], headers=["Сообщение"]), cursors, None, ""
+    try:
+        headers, rows, next_rowid = browse_table(
+            table_name, columns, (user or "").strip() or None, (date_from or "").strip() or None,
+            (date_to or "").strip() or None, cursors[-1], int(page_size or 50)
+        )
+    except Exception as e:
+        log_error("TableBrowser", str(e), traceback.format_exc())
+        return gr.update(value=[[f"Ошибка: {e}"]], headers=["Сообщение"]), cursors, None, ""
+    info = f"Страница {len(cursors)}" + ("" if next_rowid else " (последняя)")
+    if not rows:
+        return gr.update(value=[["Нет данных"]], headers=["Сообщение"]), cursors, None, info
+    return gr.update(value=rows, headers=headers), cursors, next_rowid, info
+
+def first_table_page(table_name, columns, user, date_from, date_to, page_size):
+    return load_table_page(table_name, columns, user, date_from, date_to, page_size, [None])
+
+def next_table_page(table_name, columns, user, date_from, date_to, page_size, cursors, next_rowid):
+    if next_rowid is None:
+        return gr.update(), cursors, next_rowid, "Это последняя страница"
+    return load_table_page(table_name, columns, user, date_from, date_to, page_size, cursors + [next_rowid])
+
+def prev_table_page(table_name, columns, user, date_from, date_to, page_size, cursors):
+    return load_table_page(table_name, columns, user, date_from, date_to, page_size, cursors[:-1] or [None])
+
+def export_table_ui(table_name, fmt, user, date_from, date_to):
+    if table_name not in BROWSABLE_TABLES:
+        return None, "⚠️ Выберите таблицу"
+    try:
+        path = export_table(table_name, fmt, (user or "").strip() or None,
+                            (date_from or "").strip() or None, (date_to or "").strip() or None)
+        return path, f"✅ Готово: {os.path.basename(path)}"
+    except Exception as e:
+        log_error("Export", str(e), traceback.format_exc())
+        return None, f"❌ Ошибка выгрузки: {e}"
+
+def expand_table_cell(table_name, rowid, column):
+    if table_name not in BROWSABLE_TABLES or not column or rowid is None:
+        return "Укажите таблицу, rowid и колонку"
+    value = get_table_cell(table_name, int(rowid), column)
+    return "Строка не найдена" if value is None else str(value)
+
+PLAN_POLL_INTERVAL_S = 1.0
+PLAN_JOB_STATUS_TEXT = {
+    "queued": "⏳ в очереди",
+    "running": "⚙️ генерируется",
+    "done": "✅ готово",
+    "failed": "⚠️ завершено с ошибками",
+}
+
+def render_plan_job(job):
+    output = (f"**Задача #{job['id']}:** {PLAN_JOB_STATUS_TEXT.get(job['status'], job['status'])}, "
+              f"готово недель: {job['weeks_done']} из {job['weeks_total']}\n\n")
+    if job["from_template"]:
+        output += "Это готовый план для того же уровня и направлений. Нужен новый — отметьте «Сгенерировать заново».\n\n"
+    if job["error"]:
+        output += f"{job['error']}. Нажмите кнопку ещё раз, чтобы догенерировать недостающие недели.\n\n"
+    for week, content in job["texts"].items():
+        output += f"## Неделя {week}\n\n{content or '⏳ Генерация...'}\n\n---\n"
+    return output
+
+def generate_full_plan(selected, email, grade_value, fresh):
+    """Ставит план в очередь фоновых задач и сразу возвращается; дальше статус опрашивает таймер.
+
+    Возвращает (текст, состояние опроса, обновление таймера): worker Gradio не занят, пока идёт генерация,
+    закрытая вкладка задачу не прерывает, а повторное нажатие с теми же данными подключается к ней же.
+    """
+    if not selected:
+        return "⚠️ Пожалуйста, выберите хотя бы одно направление.", None, gr.Timer(active=False)
+    if not email:
+        return "⚠️ Укажите ваш email для сохранения плана.", None, gr.Timer(active=False)
+    try:
+        job_id = submit_plan(email, grade_value, selected, fresh)
+    except Exception as e:
+        log_error("GeneratePlan", str(e), traceback.format_exc())
+        return f"❌ Ошибка при генерации плана: {e}", None, gr.Timer(active=False)
+    return poll_plan_job({"job_id": job_id, "digest": None})
+
+def poll_plan_job(plan_view):
+    """Один шаг опроса: текст плана отправляется, только если изменился; после завершения таймер гасится."""
+    if not plan_view:
+        return gr.update(), None, gr.Timer(active=False)
+    try:
+        job = get_plan_job_status(plan_view["job_id"])
+        output = render_plan_job(job)
+    except Exception as e:
+        log_error("GeneratePlan", str(e), traceback.format_exc())
+        return f"❌ Ошибка при генерации плана: {e}", None, gr.Timer(active=False)
+    digest = hash(output)
+    value = gr.update() if digest == plan_view["digest"] else output
+    if job["status"] in TERMINAL_STATUSES:
+        return value, None, gr.Timer(active=False)
+    return value, {"job_id": plan_view["job_id"], "digest": digest}, gr.Timer(active=True)
+
+# ========== ЧАТ ==========
+def respond(message, chat_history, user_email):
+    history_before = list(chat_history)
+    try:
+        chat_history.append({"role": "user", "content": message})
+        chat_history.append({"role": "assistant", "content": ""})
+        bot_msg = ""
+        # Ответ выводится по мере генерации; в БД сохраняется один раз, целиком
+        for bot_msg in chat_respond_stream(message, history_before):
+            chat_history[-1]["content"] = bot_msg
+            yield "", chat_history, user_email
+        if user_email:
+            save_chat_message(user_email, "user", message)
+            save_chat_message(user_email, "assistant", bot_msg)
+        yield "", chat_history, user_email
+    except Exception as e:
+        tb = traceback.format_exc()
+        log_error(type(e).__name__, str(e), tb)
+        chat_history = history_before
+        chat_history.append({"role": "user", "content": message})
+        chat_history.append({"role": "assistant", "content": "Ошибка. Администратор уведомлён."})
+        yield "", chat_history, user_email
 
 # ========== ИНТЕРФЕЙС ==========
+_ui_started = time.perf_counter()
 with gr.Blocks(title="SkillForge Analyst") as demo:
     gr.Markdown("# 🤖 SkillForge Analyst — AI-наставник системных аналитиков")
     gr.Markdown("Векторный поиск, голосовое общение, тесты, админ-панель с логом ошибок.")
@@ -87,7 +273,9 @@ with gr.Blocks(title="SkillForge Analyst") as demo:
         with gr.Row():
             user_email = gr.Textbox(label="Ваш Email", placeholder="analyst@company.ru", scale=2)
             grade = gr.Radio(choices=["Junior", "Middle", "Expert"], label="Уровень", value="Junior", scale=1)
-        generate_btn = gr.Button("🎯 Сгенерировать 4-недельный план", variant="primary")
+        with gr.Row():
+            generate_btn = gr.Button("🎯 Сгенерировать 4-недельный план", variant="primary", scale=3)
+            fresh_plan = gr.Checkbox(label="Сгенерировать заново", value=False, scale=1)
         output_plan = gr.Markdown(label="Ваш план развития", elem_id="plan-output")
         
         def refresh_interests():
@@ -95,21 +283,11 @@ with gr.Blocks(title="SkillForge Analyst") as demo:
             return gr.update(choices=new_list), new_list
         refresh_btn.click(refresh_interests, outputs=[interests, questions_state])
         
-        def generate_full_plan(selected, email, grade_value):
-            if not selected:
-                return "⚠️ Пожалуйста, выберите хотя бы одно направление."
-            if not email:
-                return "⚠️ Укажите ваш email для сохранения плана."
-            try:
-                weeks = generate_weekly_plans(selected, grade_value, email)
-                output = ""
-                for week, content, defs, tags, knowledge in weeks:
-                    output += f"## Неделя {week}\n\n{content}\n\n---\n"
-                return output
-            except Exception as e:
-                log_error("GeneratePlan", str(e), traceback.format_exc())
-                return f"❌ Ошибка при генерации плана: {e}"
-        generate_btn.click(generate_full_plan, inputs=[interests, user_email, grade], outputs=output_plan)
+        plan_view = gr.State(None)
+        plan_timer = gr.Timer(PLAN_POLL_INTERVAL_S, active=False)
+        generate_btn.click(generate_full_plan, inputs=[interests, user_email, grade, fresh_plan],
+                           outputs=[output_plan, plan_view, plan_timer])
+        plan_timer.tick(poll_plan_job, plan_view, [output_plan, plan_view, plan_timer])
     
     # ----- Вкладка 2: Диалоги с LLM -----
     with gr.Tab("📜 Диалоги с LLM"):
@@ -117,21 +295,20 @@ with gr.Blocks(title="SkillForge Analyst") as demo:
         with gr.Row():
             filter_email = gr.Textbox(label="Фильтр по email (оставьте пустым для всех)", placeholder="analyst@company.ru")
             refresh_dialogues_btn = gr.Button("🔄 Обновить")
-        dialogues_table = gr.Dataframe(
-            headers=["Email", "Запрос", "Ответ", "Дата"] if not filter_email else ["Запрос", "Ответ", "Дата"],
-            value=get_llm_dialogues,
-            every=5,
-            elem_id="llm-dialogues"
-        )
+        gr.HTML("<table><thead></thead><tbody></tbody></table>", elem_id="llm-dialogues")
+        # "hidden": компонент остаётся в DOM, и его значение доступно JS-шагу
+        dialogues_delta = gr.JSON(visible="hidden")
+        dialogues_view = gr.State(None)
         def refresh_dialogues(email):
-            if email:
-                data = get_llm_dialogues(email)
-                headers = ["Запрос", "Ответ", "Дата"]
-            else:
-                data = get_llm_dialogues()
-                headers = ["Email", "Запрос", "Ответ", "Дата"]
-            return gr.update(value=data, headers=headers)
-        refresh_dialogues_btn.click(refresh_dialogues, inputs=[filter_email], outputs=dialogues_table)
+            # Ручное обновление — полная перечитка, без дельты
+            return poll_llm_dialogues(email, None)
+        dialogues_timer = gr.Timer(5)
+        for dialogues_event in (
+            refresh_dialogues_btn.click(refresh_dialogues, inputs=[filter_email], outputs=[dialogues_delta, dialogues_view]),
+            dialogues_timer.tick(poll_llm_dialogues, [filter_email, dialogues_view], [dialogues_delta, dialogues_view]),
+            demo.load(poll_llm_dialogues, [filter_email, dialogues_view], [dialogues_delta, dialogues_view]),
+        ):
+            dialogues_event.then(None, [dialogues_delta], None, js=DIALOGUES_APPEND_JS)
     
     # ----- Вкладка 3: Чат-тьютор -----
     with gr.Tab("💬 Чат-тьютор"):
@@ -140,21 +317,6 @@ with gr.Blocks(title="SkillForge Analyst") as demo:
             user_email_chat = gr.Textbox(label="Ваш Email", placeholder="analyst@company.ru", scale=3)
             msg = gr.Textbox(placeholder="Напишите сообщение...", scale=5)
         clear = gr.Button("Очистить")
-        def respond(message, chat_history, user_email):
-            try:
-                bot_msg = chat_respond(message, chat_history)
-                chat_history.append({"role": "user", "content": message})
-                chat_history.append({"role": "assistant", "content": bot_msg})
-                if user_email:
-                    save_chat_message(user_email, "user", message)
-                    save_chat_message(user_email, "assistant", bot_msg)
-                return "", chat_history, user_email
-            except Exception as e:
-                tb = traceback.format_exc()
-                log_error(type(e).__name__, str(e), tb)
-                chat_history.append({"role": "user", "content": message})
-                chat_history.append({"role": "assistant", "content": "Ошибка. Администратор уведомлён."})
-                return "", chat_history, user_email
         msg.submit(respond, [msg, chatbot, user_email_chat], [msg, chatbot, user_email_chat])
         def clear_all():
             return [], "", None
@@ -288,12 +450,22 @@ with gr.Blocks(title="SkillForge Analyst") as demo:
         kb_status = gr.Textbox(label="", visible=False)
         kb_table = gr.Dataframe(
             headers=["ID", "Название", "Ссылка", "Теги", "Дата создания"],
-            value=get_all_knowledge_base,
-            every=10
+            value=get_all_knowledge_base
         )
+        kb_version = gr.State(get_table_version("knowledge_base"))
+        gr.Timer(10).tick(versioned_poll("knowledge_base", get_all_knowledge_base), kb_version, [kb_table, kb_version])
         refresh_kb_btn = gr.Button("🔄 Обновить список")
         kb_add_btn.click(add_kb_item_ui, [kb_title, kb_link, kb_tags], [kb_status, kb_table])
         refresh_kb_btn.click(get_all_knowledge_base, [], kb_table)
+        with gr.Accordion("📥 Массовый импорт (CSV / JSONL)", open=False):
+            gr.Markdown("Колонки: title, link, tags. Дубликаты по ссылке пропускаются; "
+                        "прерванный импорт продолжается при повторной загрузке того же файла.")
+            with gr.Row():
+                kb_import_file = gr.File(label="Файл каталога", file_types=[".csv", ".jsonl", ".ndjson"])
+                kb_import_restart = gr.Checkbox(label="Начать заново", value=False)
+            kb_import_btn = gr.Button("📥 Импортировать")
+            kb_import_status = gr.Textbox(label="Ход импорта", interactive=False)
+            kb_import_btn.click(import_kb_file_ui, [kb_import_file, kb_import_restart], kb_import_status)
 
         gr.Markdown("---")
         gr.Markdown("### 🎯 Управление направлениями для подбора плана")
@@ -309,9 +481,10 @@ with gr.Blocks(title="SkillForge Analyst") as demo:
         int_status = gr.Textbox(label="", visible=False)
         int_table = gr.Dataframe(
             headers=["ID", "Название", "Активно", "Дата создания"],
-            value=get_all_interests_ui,
-            every=10
+            value=get_all_interests_ui
         )
+        int_version = gr.State(get_table_version("interests"))
+        gr.Timer(10).tick(versioned_poll("interests", get_all_interests_ui), int_version, [int_table, int_version])
         with gr.Row():
             interest_selector = gr.Dropdown(choices=[], label="Выберите направление для редактирования", scale=3)
             edit_active = gr.Checkbox(label="Активно", value=True, scale=1)
@@ -394,7 +567,9 @@ with gr.Blocks(title="SkillForge Analyst") as demo:
         gr.Markdown("---")
         gr.Markdown("### 🚨 Лог ошибок приложения")
         error_table = gr.Dataframe(headers=["Время", "Тип", "Сообщение", "Traceback"],
-                                    value=get_error_logs, every=10)
+                                    value=get_error_logs)
+        error_version = gr.State(get_table_version("error_logs"))
+        gr.Timer(10).tick(versioned_poll("error_logs", get_error_logs), error_version, [error_table, error_version])
         refresh_btn = gr.Button("🔄 Обновить лог")
         refresh_btn.click(get_error_logs, [], error_table)
         error_text_to_copy = gr.Textbox(label="Текст ошибки для копирования", lines=2)
@@ -402,6 +577,45 @@ with gr.Blocks(title="SkillForge Analyst") as demo:
         copy_status = gr.Textbox(label="Статус")
         copy_btn.click(None, [error_text_to_copy], copy_status,
                        js="(text) => { navigator.clipboard.writeText(text); return 'Скопировано!'; }")
+        gr.Markdown("### 🔎 Кэш поиска по базе знаний")
+        search_cache_table = gr.Dataframe(headers=["Показатель", "Значение"], value=get_search_cache_stats_ui)
+        refresh_search_cache_btn = gr.Button("🔄 Обновить статистику поиска")
+        refresh_search_cache_btn.click(get_search_cache_stats_ui, [], search_cache_table)
+        gr.Markdown("---")
+        gr.Markdown("### 💾 Кэш ответов LLM")
+        llm_cache_table = gr.Dataframe(headers=["Показатель", "Значение"], value=get_llm_cache_stats_ui)
+        with gr.Row():
+            refresh_llm_cache_btn = gr.Button("🔄 Обновить статистику")
+            clear_llm_cache_btn = gr.Button("🗑️ Очистить кэш", variant="stop")
+        refresh_llm_cache_btn.click(get_llm_cache_stats_ui, [], llm_cache_table)
+        clear_llm_cache_btn.click(clear_llm_cache_ui, [], llm_cache_table)
+
+        gr.Markdown("### 🔌 Клиент LLM: повторы и circuit breaker")
+        llm_client_table = gr.Dataframe(headers=["Показатель", "Значение"], value=get_llm_client_stats_ui)
+        refresh_llm_client_btn = gr.Button("🔄 Обновить состояние")
+        refresh_llm_client_btn.click(get_llm_client_stats_ui, [], llm_client_table)
+
+        gr.Markdown("### 🎤 Распознавание и синтез речи")
+        transcription_table = gr.Dataframe(headers=["Показатель", "Значение"], value=get_transcription_stats_ui)
+        refresh_transcription_btn = gr.Button("🔄 Обновить статистику голоса")
+        tts_cache_table = gr.Dataframe(headers=["Показатель", "Значение"], value=get_tts_cache_stats_ui)
+        refresh_transcription_btn.click(get_transcription_stats_ui, [], transcription_table).then(
+            fn=get_tts_cache_stats_ui, outputs=tts_cache_table)
+
+        gr.Markdown("### 🗄️ Хранение и архивация")
+        storage_table = gr.Dataframe(headers=["Показатель", "Значение"], value=lambda: get_storage_stats_ui()[0])
+        storage_tables_table = gr.Dataframe(headers=["Таблица", "Строк", "Размер", "Хранение"],
+                                            value=lambda: get_storage_stats_ui()[1])
+        with gr.Row():
+            refresh_storage_btn = gr.Button("🔄 Обновить")
+            run_retention_btn = gr.Button("🗜️ Архивировать сейчас")
+            vacuum_btn = gr.Button("🧹 Включить инкрементальный VACUUM", variant="secondary")
+        gr.Markdown("Включение auto_vacuum перестраивает файл БД целиком; запись на это время останавливается.")
+        retention_status = gr.Markdown()
+        refresh_storage_btn.click(get_storage_stats_ui, [], [storage_table, storage_tables_table])
+        run_retention_btn.click(run_retention_ui, [], [retention_status, storage_table, storage_tables_table])
+        vacuum_btn.click(enable_incremental_vacuum_ui, [], [retention_status, storage_table, storage_tables_table],
+                         js="() => { if(!confirm('Запись в БД остановится на время VACUUM. Продолжить?')) throw new Error('Отменено'); }")
         gr.Markdown("---")
         gr.Markdown("### 🛑 Управление сервером")
         gr.Markdown("При нажатии приложение будет остановлено.")
@@ -412,17 +626,59 @@ with gr.Blocks(title="SkillForge Analyst") as demo:
     # ----- Вкладка 9: Просмотр БД -----
     with gr.Tab("📊 База данных"):
         gr.Markdown("### Просмотр содержимого таблиц")
-        table_selector = gr.Dropdown(
-            choices=[
-                "progress", "agent_prompts", "error_logs", "test_results",
-                "chat_history", "test_answers", "knowledge_base", "interests",
-                "weekly_plans", "llm_dialogues"
-            ],
-            label="Выберите таблицу"
-        )
-        view_btn = gr.Button("Показать")
+        table_selector = gr.Dropdown(choices=list(BROWSABLE_TABLES), label="Выберите таблицу")
+        table_columns = gr.CheckboxGroup(choices=[], label="Колонки")
+        with gr.Row():
+            table_user = gr.Textbox(label="Фильтр по пользователю", visible=False)
+            with gr.Row(visible=False) as table_dates:
+                table_date_from = gr.Textbox(label="С даты", placeholder="YYYY-MM-DD")
+                table_date_to = gr.Textbox(label="По дату", placeholder="YYYY-MM-DD")
+            table_page_size = gr.Dropdown(choices=[20, 50, 100], value=50, label="Строк на странице")
+        with gr.Row():
+            view_btn = gr.Button("Показать")
+            prev_page_btn = gr.Button("← Назад")
+            next_page_btn = gr.Button("Вперёд →")
+        table_page_info = gr.Markdown()
         table_display = gr.Dataframe()
-        view_btn.click(show_table, table_selector, table_display)
+        table_cursors = gr.State([None])
+        table_next_rowid = gr.State(None)
+        gr.Markdown("Длинные тексты обрезаны. Чтобы увидеть значение целиком, укажите rowid и колонку.")
+        with gr.Row():
+            expand_rowid = gr.Number(label="rowid", precision=0)
+            expand_column = gr.Dropdown(choices=[], label="Колонка")
+            expand_btn = gr.Button("Показать полностью")
+        expanded_cell = gr.Textbox(label="Значение", lines=10, interactive=False)
+
+        table_filters = [table_selector, table_columns, table_user, table_date_from, table_date_to, table_page_size]
+        table_outputs = [table_display, table_cursors, table_next_rowid, table_page_info]
+        table_selector.change(select_table, table_selector, [table_columns, table_user, table_dates, expand_column])
+        view_btn.click(first_table_page, table_filters, table_outputs)
+        next_page_btn.click(next_table_page, table_filters + [table_cursors, table_next_rowid], table_outputs)
+        prev_page_btn.click(prev_table_page, table_filters + [table_cursors], table_outputs)
+        expand_btn.click(expand_table_cell, [table_selector, expand_rowid, expand_column], expanded_cell)
+
+        gr.Markdown("---")
+        gr.Markdown("### 📤 Выгрузка таблицы (учитывает фильтры по пользователю и датам)")
+        with gr.Row():
+            export_format = gr.Radio(choices=available_formats(), value="csv", label="Формат")
+            export_table_btn = gr.Button("📤 Выгрузить")
+        export_status = gr.Markdown()
+        export_table_file = gr.File(label="Файл выгрузки")
+        export_table_btn.click(export_table_ui, [table_selector, export_format, table_user, table_date_from, table_date_to],
+                               [export_table_file, export_status])
+
+record("gradio ui", "init", time.perf_counter() - _ui_started)
 
 if __name__ == "__main__":
-    demo.launch(theme=gr.themes.Soft(), css=custom_css)
\ No newline at end of file
+    warm_up_tasks = [("vector store", warm_up_vector_store), ("whisper, gTTS", warm_up_voice),
+                     ("retention", start_retention), ("plan jobs", start_plan_jobs)]
+    if STARTUP_MODE == "eager":
+        run_warm_up(warm_up_tasks)
+    # UI поднимается сразу; векторный поиск и голос догружаются в фоне,
+    # а до тех пор запросы идут по FTS/LIKE-поиску и ленивой загрузке whisper
+    with timed("gradio launch", "init"):
+        demo.launch(theme=gr.themes.Soft(), css=custom_css, prevent_thread_lock=True)
+    report()
+    if STARTUP_MODE != "eager":
+        warm_up_in_background(warm_up_tasks)
+    demo.block_thread()
\ No newline at end of file
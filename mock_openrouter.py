@@ -0,0 +1,240 @@
+"""Мок OpenRouter /chat/completions для бенчмарков и нагрузочных тестов без сети.
+
+Запуск: python mock_openrouter.py --port 8089 --latency-dist lognormal --latency-ms 400 --error-429-rate 0.05
+и затем OPENROUTER_API_URL=http://127.0.0.1:8089/api/v1/chat/completions OPENROUTER_API_KEY=mock python main.py
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+SSE_CHUNK_CHARS = 40
+
+MOCK_WEEK = {
+    "goals": "Освоить базовые понятия направления и научиться применять их на учебных задачах проекта.",
+    "definitions": ["нормализация", "идемпотентность", "BPMN-шлюз", "контракт API", "SLA"],
+    "tags": ["sql", "api", "bpmn"],
+    "knowledge": "Уметь описать требования, спроектировать схему данных и согласовать контракт интеграции.",
+}
+MOCK_ANSWER = (
+    "1. Повторите основы SQL: SELECT, JOIN, агрегации и индексы.\n"
+    "2. Освойте нотацию BPMN 2.0 и смоделируйте один процесс своего проекта.\n"
+    "3. Разберите REST API: методы, статус-коды, идемпотентность, OpenAPI.\n"
+    "4. Потренируйтесь выявлять требования на интервью с заказчиком.\n"
+)
+
+def _ts():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def estimate_tokens(text):
+    # Грубая оценка: ~3 символа кириллицы на токен
+    return max(1, len(text) // 3)
+
+class MockOpenRouter:
+    """Сервер в отдельном потоке; параметры можно менять на лету, статистика — в stats()."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_dist="fixed", latency_ms=300.0, latency_spread=0.5,
+                 ms_per_token=2.0, error_429_rate=0.0, error_5xx_rate=0.0, length_rate=0.0, drop_week_rate=0.0,
+                 retry_after_s=1, seed=None):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Неизвестное распределение задержки: {latency_dist}")
+        self.latency_dist = latency_dist
+        self.latency_ms = latency_ms
+        # uniform: ±доля от latency_ms; lognormal: sigma (latency_ms — медиана)
+        self.latency_spread = latency_spread
+        self.ms_per_token = ms_per_token
+        self.error_429_rate = error_429_rate
+        self.error_5xx_rate = error_5xx_rate
+        self.length_rate = length_rate
+        self.drop_week_rate = drop_week_rate
+        self.retry_after_s = retry_after_s
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "streamed": 0, "ok": 0, "truncated": 0, "status": {}, "completion_tokens": 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/v1/chat/completions"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openrouter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["status"] = dict(self._stats["status"])
+        return stats
+
+    # ========== МОДЕЛЬ ПОВЕДЕНИЯ ==========
+    def _random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _latency_s(self):
+        with self._lock:
+            ms = self.latency_ms
+            if self.latency_dist == "uniform":
+                ms = self._rng.uniform(ms * (1 - self.latency_spread), ms * (1 + self.latency_spread))
+            elif self.latency_dist == "exponential":
+                ms = self._rng.expovariate(1 / ms) if ms > 0 else 0
+            elif self.latency_dist == "lognormal":
+                ms = self._rng.lognormvariate(0, self.latency_spread) * ms
+        return max(0.0, ms) / 1000
+
+    def _answer(self, request, prompt_text):
+        if request.get("response_format"):
+            match = re.search(r"для недель: ([\d, ]+)", prompt_text)
+            weeks = [int(n) for n in match.group(1).split(",")] if match else [1, 2, 3, 4]
+            # Часть недель «теряется», чтобы проверить повтор только недостающих
+            items = [dict(MOCK_WEEK, week=week) for week in weeks if self._random() >= self.drop_week_rate]
+            return json.dumps({"weeks": items}, ensure_ascii=False)
+        match = re.search(r"\*\*неделю (\d+)\*\*", prompt_text)
+        if match:
+            week = match.group(1)
+            return (f"**Неделя {week}**\n**Цели:** {MOCK_WEEK['goals']}\n"
+                    f"**Определения:** {', '.join(MOCK_WEEK['definitions'])}\n"
+                    f"**Теги:** {', '.join('#' + t for t in MOCK_WEEK['tags'])}\n**Знания:** {MOCK_WEEK['knowledge']}\n")
+        return MOCK_ANSWER
+
+    def _count(self, status, streamed=False, truncated=False, completion_tokens=0):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["streamed"] += streamed
+            self._stats["truncated"] += truncated
+            self._stats["ok"] += status == 200
+            self._stats["completion_tokens"] += completion_tokens
+            self._stats["status"][status] = self._stats["status"].get(status, 0) + 1
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _sse(self, payload):
+                data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+                line = f"data: {data}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                prompt_text = "".join(message.get("content", "") for message in request.get("messages", []))
+                latency = mock._latency_s()
+                roll = mock._random()
+                if roll < mock.error_429_rate:
+                    time.sleep(latency / 4)
+                    mock._count(429)
+                    self._send_json(429, {"error": {"code": 429, "message": "Rate limit exceeded (mock)"}},
+                                    {"Retry-After": str(mock.retry_after_s)})
+                    return
+                if roll < mock.error_429_rate + mock.error_5xx_rate:
+                    status = mock._rng.choice([500, 502, 503])
+                    time.sleep(latency)
+                    mock._count(status)
+                    self._send_json(status, {"error": {"code": status, "message": "Upstream error (mock)"}})
+                    return
+
+                answer = mock._answer(request, prompt_text)
+                finish_reason = "stop"
+                if mock._random() < mock.length_rate:
+                    answer = answer[:len(answer) // 2]
+                    finish_reason = "length"
+                usage = {"prompt_tokens": estimate_tokens(prompt_text), "completion_tokens": estimate_tokens(answer)}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                generation_s = usage["completion_tokens"] * mock.ms_per_token / 1000
+                streamed = bool(request.get("stream"))
+                mock._count(200, streamed, finish_reason == "length", usage["completion_tokens"])
+
+                if not streamed:
+                    time.sleep(latency + generation_s)
+                    self._send_json(200, {
+                        "id": "mock", "object": "chat.completion", "model": request.get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                                     "finish_reason": finish_reason}],
+                        "usage": usage,
+                    })
+                    return
+
+                # Поток: задержка до первого токена, затем фрагменты с темпом генерации
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(latency)
+                comment = b": OPENROUTER PROCESSING\n\n"
+                self.wfile.write(f"{len(comment):x}\r\n".encode() + comment + b"\r\n")
+                parts = [answer[i:i + SSE_CHUNK_CHARS] for i in range(0, len(answer), SSE_CHUNK_CHARS)]
+                for part in parts:
+                    time.sleep(generation_s / len(parts))
+                    self._sse({"choices": [{"index": 0, "delta": {"content": part}}]})
+                self._sse({"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}], "usage": usage})
+                self._sse("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+def add_mock_arguments(parser):
+    """Параметры мок-сервера; общие для этого скрипта, bench.py и loadtest.py."""
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=400, help="задержка до первого токена (для lognormal — медиана)")
+    parser.add_argument("--latency-spread", type=float, default=0.5, help="uniform: ±доля; lognormal: sigma")
+    parser.add_argument("--ms-per-token", type=float, default=2)
+    parser.add_argument("--error-429-rate", type=float, default=0.0)
+    parser.add_argument("--error-5xx-rate", type=float, default=0.0)
+    parser.add_argument("--length-rate", type=float, default=0.0, help="доля ответов, обрезанных с finish_reason=length")
+    parser.add_argument("--drop-week-rate", type=float, default=0.0, help="доля недель, пропущенных в JSON-плане")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+
+def mock_from_args(args, host="127.0.0.1", port=0):
+    return MockOpenRouter(host, port, args.latency_dist, args.latency_ms, args.latency_spread, args.ms_per_token,
+                          args.error_429_rate, args.error_5xx_rate, args.length_rate, args.drop_week_rate,
+                          args.retry_after, args.seed)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Мок OpenRouter chat completions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_mock_arguments(parser)
+    args = parser.parse_args(argv)
+    mock = mock_from_args(args, args.host, args.port).start()
+    print(f"[{_ts()}] ✅ Мок OpenRouter: {mock.url}")
+    print(f"    OPENROUTER_API_URL={mock.url} OPENROUTER_API_KEY=mock python main.py")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"[{_ts()}] {mock.stats()}")
+    except KeyboardInterrupt:
+        mock.stop()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
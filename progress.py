@@ -1,10 +1,9 @@
 from database import (
-    save_progress, get_progress, get_all_progress,
+    save_progress, get_progress,
     save_chat_message, get_chat_history,
-    save_test_result, save_test_answer, c, db_lock
+    save_test_result, save_test_answer, read_cursor
 )
-import csv
-from io import StringIO
+from export import export_table
 
 def show_progress(user_id):
     data = get_progress(user_id)
@@ -17,15 +16,11 @@ def add_progress_ui(user_id, skill, status):
     return f"Достижение '{skill}' добавлено!"
 
 def export_progress_csv():
-    data = get_all_progress()
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Email", "Навык", "Статус", "Дата"])
-    writer.writerows(data)
-    return output.getvalue()
+    # Путь к файлу для gr.File; строки пишутся потоково, а не собираются в памяти
+    return export_table("progress", "csv", headers=["Email", "Навык", "Статус", "Дата"], newest_first=True)
 
 def get_test_details(user_id, test_questions, limit=20):
-    with db_lock:
+    with read_cursor() as c:
         c.execute("""
             SELECT topic, question_index, selected, correct, date 
             FROM test_answers 
@@ -34,12 +29,12 @@ def get_test_details(user_id, test_questions, limit=20):
             LIMIT ?
         """, (user_id, limit))
         rows = c.fetchall()
-        result = []
-        for row in rows:
-            topic, q_idx, selected, correct, date = row
-            try:
-                q_text = test_questions[topic][q_idx]["question"]
-            except:
-                q_text = f"Вопрос {q_idx+1}"
-            result.append([topic, q_text, selected, "✅" if correct else "❌", date])
-        return result
\ No newline at end of file
+    result = []
+    for row in rows:
+        topic, q_idx, selected, correct, date = row
+        try:
+            q_text = test_questions[topic][q_idx]["question"]
+        except:
+            q_text = f"Вопрос {q_idx+1}"
+        result.append([topic, q_text, selected, "✅" if correct else "❌", date])
+    return result
\ No newline at end of file
@@ -0,0 +1,154 @@
+import os
+import gzip
+import json
+import time
+import threading
+import traceback
+import argparse
+from datetime import datetime, timedelta, timezone
+from database import (BROWSABLE_TABLES, TIMESTAMP_FORMAT, delete_rows, enable_incremental_vacuum,
+                      get_auto_vacuum_mode, get_expired_rows, get_sync_state, incremental_vacuum,
+                      log_error, prune_kb_changelog, set_sync_state)
+from search import KB_SYNC_STATE
+
+# Сколько дней хранить строки в основной БД; 0 — хранить всегда
+RETENTION_POLICIES = {
+    "error_logs": int(os.getenv("RETENTION_ERROR_LOGS_DAYS", "30")),
+    "chat_history": int(os.getenv("RETENTION_CHAT_HISTORY_DAYS", "180")),
+    "llm_dialogues": int(os.getenv("RETENTION_LLM_DIALOGUES_DAYS", "90")),
+}
+# Даты этих таблиц заполняет DEFAULT CURRENT_TIMESTAMP (UTC); остальные пишутся через _now() в локальном времени
+UTC_DATE_TABLES = {"llm_dialogues"}
+ARCHIVE_DIR = os.getenv("SKILLFORGE_ARCHIVE_DIR", "archive")
+RETENTION_BATCH_ROWS = int(os.getenv("RETENTION_BATCH_ROWS", "2000"))
+RETENTION_INTERVAL_S = int(os.getenv("RETENTION_INTERVAL_S", str(6 * 3600)))
+LAST_RUN_STATE = "retention_last_run"
+# Журнал изменений базы знаний нужен только векторной синхронизации; без неё он бы рос бесконечно
+KB_CHANGELOG_MAX_ROWS = int(os.getenv("KB_CHANGELOG_MAX_ROWS", "50000"))
+
+_run_lock = threading.Lock()
+_worker = None
+_worker_lock = threading.Lock()
+
+# ========== АРХИВ ==========
+def archive_path(table, month):
+    return os.path.join(ARCHIVE_DIR, table, f"{table}_{month}.jsonl.gz")
+
+def _append_archive(table, month, records):
+    """Дописывает строки отдельным gzip-членом и сбрасывает на диск до удаления из БД.
+
+    Если процесс упадёт между записью и удалением, при следующем запуске строки попадут
+    в архив повторно — потерять их нельзя, дубль допустим.
+    """
+    path = archive_path(table, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            for record in records:
+                gz.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+def _archive_batch(table, columns, rows):
+    date_index = columns.index(BROWSABLE_TABLES[table]["date"])
+    months = {}
+    for _rowid, *values in rows:
+        date_value = values[date_index]
+        month = str(date_value)[:7] if date_value else "unknown"
+        months.setdefault(month, []).append(dict(zip(columns, values)))
+    for month, records in months.items():
+        _append_archive(table, month, records)
+    delete_rows(table, [row[0] for row in rows])
+
+def read_archive(table, month):
+    """Строки из месячного архива (для разбора инцидентов и проверки)."""
+    with gzip.open(archive_path(table, month), "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+# ========== ОЧИСТКА ==========
+def apply_policy(table, days):
+    """Переносит в архив строки старше days дней. Возвращает число перенесённых строк."""
+    if days <= 0:
+        return 0
+    now = datetime.now(timezone.utc).replace(tzinfo=None) if table in UTC_DATE_TABLES else datetime.now()
+    cutoff = (now - timedelta(days=days)).strftime(TIMESTAMP_FORMAT)
+    moved = 0
+    while True:
+        # Короткие пачки: писатель не держит блокировку долго, чат и логи продолжают писаться
+        columns, rows = get_expired_rows(table, cutoff, RETENTION_BATCH_ROWS)
+        if not rows:
+            return moved
+        _archive_batch(table, columns, rows)
+        moved += len(rows)
+
+def run_retention():
+    """Применяет все политики хранения и возвращает освобождённое место файлу БД."""
+    if not _run_lock.acquire(blocking=False):
+        return None
+    try:
+        started = time.perf_counter()
+        moved = {table: apply_policy(table, days) for table, days in RETENTION_POLICIES.items()}
+        pruned_changelog = prune_kb_changelog(KB_SYNC_STATE, KB_CHANGELOG_MAX_ROWS)
+        # БД, созданные до включения auto_vacuum, переводятся отдельно (convert_to_incremental_vacuum):
+        # полный VACUUM останавливает запись, его нельзя запускать из фоновой задачи
+        freed_pages = incremental_vacuum() if get_auto_vacuum_mode() == "incremental" else 0
+        set_sync_state(LAST_RUN_STATE, int(time.time()))
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Архивация за {time.perf_counter() - started:.1f} с: "
+              f"{', '.join(f'{table} {count}' for table, count in moved.items())}; из журнала БЗ удалено {pruned_changelog}; "
+              f"освобождено страниц: {freed_pages}")
+        return {"moved": moved, "pruned_changelog": pruned_changelog, "freed_pages": freed_pages}
+    finally:
+        _run_lock.release()
+
+def convert_to_incremental_vacuum():
+    """Однократно переводит БД в auto_vacuum=INCREMENTAL полным VACUUM. Запись стоит всё время перестройки:
+    запускать в окно обслуживания из админ-панели или командой python retention.py enable-incremental-vacuum."""
+    if get_auto_vacuum_mode() == "incremental":
+        return False
+    with _run_lock:
+        started = time.perf_counter()
+        enable_incremental_vacuum()
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ auto_vacuum=INCREMENTAL включён, VACUUM за {time.perf_counter() - started:.1f} с")
+    return True
+
+def get_last_run():
+    value = get_sync_state(LAST_RUN_STATE)
+    return datetime.fromtimestamp(value).strftime(TIMESTAMP_FORMAT) if value else None
+
+# ========== ФОНОВАЯ ЗАДАЧА ==========
+def _retention_loop():
+    while True:
+        try:
+            last_run = get_sync_state(LAST_RUN_STATE) or 0
+            # После перезапуска не чистим заново, если интервал ещё не прошёл
+            wait = last_run + RETENTION_INTERVAL_S - time.time()
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            run_retention()
+        except Exception as e:
+            log_error("Retention", str(e), traceback.format_exc())
+        time.sleep(RETENTION_INTERVAL_S)
+
+def start_retention():
+    global _worker
+    if _worker is not None:
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_retention_loop, name="retention", daemon=True)
+            _worker.start()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Архивация и обслуживание БД SkillForge")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("run", help="применить политики хранения сейчас")
+    commands.add_parser("enable-incremental-vacuum", help="перевести БД в auto_vacuum=INCREMENTAL (полный VACUUM)")
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run_retention()
+    elif not convert_to_incremental_vacuum():
+        print("auto_vacuum=INCREMENTAL уже включён")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,59 +1,204 @@
+import os
+import time
+import threading
 import traceback
+from collections import OrderedDict
 from datetime import datetime  # <-- добавлено для временных меток
-from database import db_lock, c, conn, log_error, get_all_knowledge_base, add_knowledge_item, search_knowledge_base_simple, init_knowledge_base
+from database import (log_error, search_knowledge_base_simple, init_knowledge_base, get_sync_state,
+                      get_kb_changelog_head, get_kb_changelog_tail, get_kb_changes, get_knowledge_items,
+                      iter_knowledge_items, commit_kb_sync)
 
 # Ensure knowledge base is initialized
 init_knowledge_base()
 
+KB_SYNC_STATE = "kb_vector_hwm"
+KB_SYNC_BATCH = int(os.getenv("KB_SYNC_BATCH", "64"))
+KB_SYNC_INTERVAL_S = float(os.getenv("KB_SYNC_INTERVAL_S", "60"))
+SEARCH_TOP_K = 5
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("SKILLFORGE_QUERY_EMBED_CACHE", "512"))
+SEARCH_RESULT_CACHE_SIZE = int(os.getenv("SKILLFORGE_SEARCH_RESULT_CACHE", "256"))
+SEARCH_RESULT_TTL_S = float(os.getenv("SKILLFORGE_SEARCH_RESULT_TTL_S", "60"))
+
+EMBEDDING_MODEL = "intfloat/multilingual-e5-small"
+# chroma — ChromaDB; numpy — встроенный vector_index.NumpyVectorIndex; auto — numpy, если есть numpy
+# и sentence-transformers, иначе chroma
+VECTOR_BACKEND = os.getenv("SKILLFORGE_VECTOR_BACKEND", "auto")
+
 # Vector DB setup
-chromadb_available = False
-try:
+# Векторное хранилище и модель эмбеддингов тяжёлые: загружаются при прогреве, а не при импорте модуля.
+# Пока прогрев не завершён, поиск идёт по FTS/LIKE.
+_vector_collection = None
+_vector_backend = None
+_embedding_function = None
+_vector_unavailable = False
+_vector_lock = threading.Lock()
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
+
+def _open_numpy_index():
+    from vector_index import NumpyVectorIndex, SentenceTransformerEmbedding, VECTOR_INDEX_DIR, VECTOR_INDEX_QUANTIZE
+    ef = SentenceTransformerEmbedding(EMBEDDING_MODEL)
+    ef(["прогрев"])  # первый вызов загружает веса модели
+    return NumpyVectorIndex(VECTOR_INDEX_DIR, ef, quantize=VECTOR_INDEX_QUANTIZE), ef
+
+def _open_chroma_collection():
     import chromadb
     from chromadb.utils import embedding_functions
-    chromadb_available = True
-except ImportError:
-    chromadb_available = False
-
-vector_collection = None
-if chromadb_available:
-    try:
-        client = chromadb.PersistentClient(path="./chroma_db")
-        ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name="intfloat/multilingual-e5-small"
-        )
-        try:
-            vector_collection = client.get_collection("analyst_skills", embedding_function=ef)
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ ChromaDB коллекция загружена")
-        except:
-            vector_collection = client.create_collection("analyst_skills", embedding_function=ef)
-            # Load from knowledge_base
-            with db_lock:
-                c.execute("SELECT title, link, tags FROM knowledge_base")
-                rows = c.fetchall()
-            documents = []
-            metadatas = []
-            ids = []
-            for i, (title, link, tags) in enumerate(rows):
-                documents.append(f"{title} {tags}")
-                metadatas.append({"link": link, "title": title})
-                ids.append(f"doc_{i}")
-            if documents:
-                vector_collection.add(documents=documents, metadatas=metadatas, ids=ids)
-                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ ChromaDB коллекция создана и заполнена {len(rows)} ресурсами")
-    except Exception as e:
-        log_error("VectorDBInit", str(e), traceback.format_exc())
-        vector_collection = None
+    client = chromadb.PersistentClient(path="./chroma_db")
+    ef = embedding_functions.SentenceTransformerEmbeddingFunction(
+        model_name=EMBEDDING_MODEL
+    )
+    ef(["прогрев"])  # первый вызов загружает веса модели
+    # Наполнение коллекции — забота KnowledgeBaseSync, здесь только открываем её
+    return client.get_or_create_collection("analyst_skills", embedding_function=ef), ef
+
+VECTOR_BACKENDS = {"numpy": _open_numpy_index, "chroma": _open_chroma_collection}
+
+def warm_up_vector_store():
+    """Открывает векторное хранилище выбранного бэкенда и загружает модель эмбеддингов."""
+    global _vector_collection, _vector_backend, _embedding_function, _vector_unavailable
+    with _vector_lock:
+        if _vector_collection is not None or _vector_unavailable:
+            return
+        backends = ["numpy", "chroma"] if VECTOR_BACKEND == "auto" else [VECTOR_BACKEND]
+        for backend in backends:
+            try:
+                collection, ef = VECTOR_BACKENDS[backend]()
+            except ImportError:
+                continue
+            except Exception as e:
+                log_error("VectorDBInit", f"{backend}: {e}", traceback.format_exc())
+                continue
+            _vector_collection, _vector_backend, _embedding_function = collection, backend, ef
+            break
+        else:
+            _vector_unavailable = True
+            return
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Векторный поиск готов (бэкенд: {_vector_backend})")
+    # У каждого бэкенда своя отметка синхронизации: при смене бэкенда новый индекс строится с нуля
+    kb_sync.state_name = KB_SYNC_STATE if _vector_backend == "chroma" else f"{KB_SYNC_STATE}_{_vector_backend}"
+    kb_sync.start()
+
+def get_vector_collection():
+    """Коллекция, если векторный поиск уже прогрет; иначе None (и прогрев запускается в фоне)."""
+    global _warm_up_thread
+    if _vector_collection is None and not _vector_unavailable and _warm_up_thread is None:
+        with _warm_up_lock:
+            if _warm_up_thread is None:
+                _warm_up_thread = threading.Thread(target=warm_up_vector_store, name="vector-warmup", daemon=True)
+                _warm_up_thread.start()
+    return _vector_collection
+
+# ========== КЭШ ПОИСКА ==========
+class SearchCache:
+    """LRU эмбеддингов запросов и короткоживущий кэш результатов векторного поиска.
+
+    Результаты помечены отметкой синхронизации базы знаний: как только индекс догнал новые
+    правки, все они становятся недействительными. Эмбеддинг запроса от базы знаний не зависит,
+    поэтому он привязан только к бэкенду, которым был посчитан.
+    """
+
+    def __init__(self, embed_size, result_size, result_ttl):
+        self.embed_size = embed_size
+        self.result_size = result_size
+        self.result_ttl = result_ttl
+        self._embeddings = OrderedDict()
+        self._results = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        self._stats = {"embed_hits": 0, "embed_misses": 0, "result_hits": 0, "result_misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.lower().split())
+
+    def get_embedding(self, key):
+        with self._lock:
+            embedding = self._embeddings.get(key)
+            if embedding is None:
+                self._stats["embed_misses"] += 1
+                return None
+            self._embeddings.move_to_end(key)
+            self._stats["embed_hits"] += 1
+            return embedding
+
+    def put_embedding(self, key, embedding):
+        with self._lock:
+            self._embeddings[key] = embedding
+            self._embeddings.move_to_end(key)
+            while len(self._embeddings) > self.embed_size:
+                self._embeddings.popitem(last=False)
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            if self._results:
+                self._stats["invalidations"] += 1
+            self._results.clear()
+            self._generation = generation
+
+    def get_result(self, key, generation):
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._results.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._stats["result_misses"] += 1
+                return None
+            self._results.move_to_end(key)
+            self._stats["result_hits"] += 1
+            return entry[1]
+
+    def put_result(self, key, generation, result):
+        with self._lock:
+            self._check_generation(generation)
+            self._results[key] = (time.monotonic() + self.result_ttl, result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.result_size:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._embeddings.clear()
+            self._results.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["embeddings"] = len(self._embeddings)
+            stats["results"] = len(self._results)
+        embed_lookups = stats["embed_hits"] + stats["embed_misses"]
+        result_lookups = stats["result_hits"] + stats["result_misses"]
+        stats["embed_hit_rate"] = stats["embed_hits"] / embed_lookups if embed_lookups else 0.0
+        stats["result_hit_rate"] = stats["result_hits"] / result_lookups if result_lookups else 0.0
+        return stats
+
+search_cache = SearchCache(QUERY_EMBED_CACHE_SIZE, SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_TTL_S)
+
+def _query_embedding(key, query):
+    # Нормализованная строка — только ключ кэша; модель получает запрос как есть (регистр аббревиатур важен)
+    embedding = search_cache.get_embedding((_vector_backend, key))
+    if embedding is None:
+        embedding = [float(x) for x in _embedding_function([query])[0]]
+        search_cache.put_embedding((_vector_backend, key), embedding)
+    return embedding
 
 def search_resources(query: str) -> str:
+    vector_collection = get_vector_collection()
     if vector_collection is not None:
+        key = SearchCache.normalize(query)
+        generation = kb_sync.high_water_mark
+        cached = search_cache.get_result(key, generation)
+        if cached is not None:
+            return cached
         try:
-            results = vector_collection.query(query_texts=[query], n_results=5) # <-- n_results количество записей в результате поиска
+            results = vector_collection.query(query_embeddings=[_query_embedding(key, query)], n_results=SEARCH_TOP_K)
             output = []
             for i in range(len(results['documents'][0])):
                 title = results['metadatas'][0][i]['title']
                 link = results['metadatas'][0][i]['link']
                 output.append(f"- [{title}]({link})")
-            return "\n".join(output) if output else "Ничего не найдено."
+            result = "\n".join(output) if output else "Ничего не найдено."
+            search_cache.put_result(key, generation, result)
+            return result
         except Exception as e:
             log_error("VectorSearch", str(e), traceback.format_exc())
             # fallback to simple search
@@ -64,17 +209,150 @@ def search_resources(query: str) -> str:
     else:
         return "Ничего не найдено. Попробуйте изменить запрос."
 
-def add_resource_to_vector_db(title, link, tags):
-    if vector_collection is None:
-        return
-    try:
-        import time
-        doc_id = f"doc_{int(time.time()*1000)}"
-        vector_collection.add(
-            documents=[f"{title} {tags}"],
-            metadatas=[{"link": link, "title": title}],
-            ids=[doc_id]
-        )
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Ресурс '{title}' добавлен в векторную БД")
-    except Exception as e:
-        log_error("VectorDBAdd", str(e), traceback.format_exc())
\ No newline at end of file
+def get_search_cache_stats():
+    stats = search_cache.stats()
+    stats["high_water_mark"] = kb_sync.high_water_mark
+    return stats
+
+# ========== СИНХРОНИЗАЦИЯ ВЕКТОРНОГО ИНДЕКСА ==========
+class KnowledgeBaseSync:
+    """Догоняет векторный индекс по журналу kb_changelog. Id вектора — knowledge_base.id.
+
+    Отметка последней обработанной записи журнала хранится в sync_state, поэтому после
+    перезапуска эмбеддятся только новые и изменённые строки.
+    """
+
+    def __init__(self, batch_size, interval, state_name=KB_SYNC_STATE):
+        self.state_name = state_name
+        self.high_water_mark = None  # последняя применённая к индексу отметка; по ней сбрасывается кэш поиска
+        self.batch_size = batch_size
+        self.interval = interval
+        self._sync_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = {"runs": 0, "upserted": 0, "deleted": 0, "full_resyncs": 0, "errors": 0, "last_run": None}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _upsert(self, collection, rows):
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            collection.upsert(
+                ids=[str(kb_id) for kb_id, _, _, _ in batch],
+                documents=[f"{title} {tags}" for _, title, _, tags in batch],
+                metadatas=[{"link": link, "title": title} for _, title, link, _ in batch]
+            )
+        self._count("upserted", len(rows))
+
+    def _delete(self, collection, ids):
+        for start in range(0, len(ids), self.batch_size):
+            collection.delete(ids=ids[start:start + self.batch_size])
+        self._count("deleted", len(ids))
+
+    def _needs_full_resync(self, collection):
+        hwm = get_sync_state(self.state_name)
+        if hwm is None:
+            return True
+        # Журнал чистит тот бэкенд, что синхронизировался последним; если нужных нам записей
+        # в нём уже нет, догнать изменения по журналу нельзя
+        head, tail = get_kb_changelog_head(), get_kb_changelog_tail()
+        if hwm < head and (tail is None or tail > hwm + 1):
+            return True
+        # Индекс удалили с диска, а отметка осталась
+        if collection.count() == 0 and next(iter_knowledge_items(1), None):
+            return True
+        # Коллекция, заполненная старой версией (id вида doc_N), с knowledge_base никак не связана
+        sample = collection.get(limit=1, include=[])["ids"]
+        return bool(sample) and sample[0].startswith("doc_")
+
+    def full_resync(self, collection):
+        # Отметку берём до чтения таблицы: правки, сделанные во время прохода, догонит журнал
+        head = get_kb_changelog_head()
+        kept = set()
+        for rows in iter_knowledge_items(self.batch_size):
+            self._upsert(collection, rows)
+            kept.update(str(row[0]) for row in rows)
+        stale = [doc_id for doc_id in collection.get(include=[])["ids"] if doc_id not in kept]
+        self._delete(collection, stale)
+        commit_kb_sync(self.state_name, head)
+        self.high_water_mark = head
+        self._count("full_resyncs")
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Векторный индекс пересобран: {len(kept)} ресурсов, удалено {len(stale)}")
+
+    def _apply_changes(self, collection):
+        hwm = get_sync_state(self.state_name, 0)
+        self.high_water_mark = hwm
+        while True:
+            changes = get_kb_changes(hwm, self.batch_size * 4)
+            if not changes:
+                return
+            # Несколько правок одной строки схлопываются: сверяемся с её текущим состоянием
+            kb_ids = list({kb_id for _, kb_id, _ in changes})
+            rows = get_knowledge_items(kb_ids)
+            present = {row[0] for row in rows}
+            if rows:
+                self._upsert(collection, rows)
+            removed = [str(kb_id) for kb_id in kb_ids if kb_id not in present]
+            if removed:
+                self._delete(collection, removed)
+            hwm = changes[-1][0]
+            commit_kb_sync(self.state_name, hwm)
+            self.high_water_mark = hwm
+
+    def sync_once(self):
+        collection = _vector_collection
+        if collection is None:
+            return
+        with self._sync_lock:
+            try:
+                if self._needs_full_resync(collection):
+                    self.full_resync(collection)
+                self._apply_changes(collection)
+            except Exception as e:
+                self._count("errors")
+                log_error("KBSync", str(e), traceback.format_exc())
+            finally:
+                with self._lock:
+                    self._stats["runs"] += 1
+                    self._stats["last_run"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def _loop(self):
+        while True:
+            # Просыпаемся по запросу или раз в interval — на случай правок в обход приложения
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.sync_once()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="kb-sync", daemon=True)
+                self._thread.start()
+                self._wakeup.set()
+
+    def request(self):
+        self.start()
+        self._wakeup.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["high_water_mark"] = get_sync_state(self.state_name, 0)
+        stats["pending_changes"] = max(0, get_kb_changelog_head() - stats["high_water_mark"])
+        return stats
+
+kb_sync = KnowledgeBaseSync(KB_SYNC_BATCH, KB_SYNC_INTERVAL_S)
+
+def request_kb_sync():
+    """Будит фоновую синхронизацию после изменения базы знаний."""
+    # До прогрева будить некого: правки останутся в журнале и синхронизируются после него
+    if _vector_collection is not None:
+        kb_sync.request()
+
+def get_kb_sync_stats():
+    return kb_sync.stats()
\ No newline at end of file
@@ -0,0 +1,56 @@
+import os
+import time
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+
+# background — тяжёлые подсистемы прогреваются в фоне после запуска UI; eager — до запуска, как раньше
+STARTUP_MODE = os.getenv("SKILLFORGE_STARTUP_MODE", "background")
+
+_process_started = time.perf_counter()
+_lock = threading.Lock()
+_timings = []  # (этап, подсистема, секунды, успешно)
+
+def record(subsystem, phase, seconds, ok=True):
+    with _lock:
+        _timings.append((phase, subsystem, seconds, ok))
+
+@contextmanager
+def timed(subsystem, phase="import"):
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        record(subsystem, phase, time.perf_counter() - started, ok)
+
+def get_startup_timings():
+    with _lock:
+        return [(phase, subsystem, round(seconds, 3), ok) for phase, subsystem, seconds, ok in _timings]
+
+def report(title="Время запуска по подсистемам"):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ⏱ {title} "
+          f"(с начала запуска {time.perf_counter() - _process_started:.2f} с):")
+    for phase, subsystem, seconds, ok in get_startup_timings():
+        print(f"    {phase:<8} {subsystem:<24} {seconds:8.3f} с{'' if ok else '  ❌'}")
+
+def run_warm_up(tasks):
+    """Прогревает подсистемы по очереди: tasks — список (название, функция)."""
+    for subsystem, fn in tasks:
+        try:
+            with timed(subsystem, "warmup"):
+                fn()
+        except Exception as e:
+            from database import log_error
+            log_error("Warmup", f"{subsystem}: {e}", traceback.format_exc())
+
+def warm_up_in_background(tasks):
+    def run():
+        run_warm_up(tasks)
+        report("Фоновый прогрев завершён")
+
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread
\ No newline at end of file
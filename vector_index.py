@@ -0,0 +1,327 @@
+import os
+import json
+import threading
+from datetime import datetime
+import numpy as np
+
+VECTOR_INDEX_DIR = os.getenv("SKILLFORGE_VECTOR_INDEX_DIR", "./vector_index")
+VECTOR_INDEX_QUANTIZE = os.getenv("SKILLFORGE_VECTOR_QUANTIZE", "0") == "1"
+VECTOR_INDEX_MIN_CAPACITY = 1024
+VECTOR_INDEX_SCORE_BLOCK = 1024  # строк int8-матрицы, переводимых во float32 за шаг: блок остаётся в кэше CPU
+META_FORMAT = 2
+
+class SentenceTransformerEmbedding:
+    """Эмбеддинги sentence-transformers без клиента chromadb; модель загружается при первом вызове."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def __call__(self, texts):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True)
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class NumpyVectorIndex:
+    """Векторный индекс для небольшой базы знаний: все векторы в одной непрерывной матрице.
+
+    Векторы нормализованы, поэтому косинусная близость — это скалярное произведение, и top-k
+    для пачки запросов считается одним умножением матриц и argpartition. Матрица лежит в
+    vectors.npy и открывается через memmap; при quantize=True хранится в int8 с масштабом на строку
+    (scales.npy). int8 экономит память и диск в 4 раза, но не время: при поиске строки переводятся
+    во float32 блоками по VECTOR_INDEX_SCORE_BLOCK, и запрос идёт примерно так же, как по float32.
+    Идентификаторы, документы и метаданные — в журнале meta.jsonl: каждая операция дописывает только
+    свои строки, а при открытии журнал воспроизводится и, если в нём есть устаревшие записи, сжимается.
+    Интерфейс повторяет используемую часть коллекции Chroma: upsert/add, delete, get, query, count.
+    """
+
+    def __init__(self, directory, embedding_function=None, quantize=False):
+        self.directory = directory
+        self.embedding_function = embedding_function
+        self.quantize = quantize
+        self._lock = threading.RLock()
+        self._ids = []
+        self._positions = {}
+        self._documents = []
+        self._metadatas = []
+        self._matrix = None
+        self._scales = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # ---------- хранение ----------
+    @property
+    def _meta_path(self):
+        return os.path.join(self.directory, "meta.jsonl")
+
+    @property
+    def _legacy_meta_path(self):
+        return os.path.join(self.directory, "meta.json")
+
+    @property
+    def _matrix_path(self):
+        return os.path.join(self.directory, "vectors.npy")
+
+    @property
+    def _scales_path(self):
+        return os.path.join(self.directory, "scales.npy")
+
+    def _read_meta(self):
+        """Заголовок и записи журнала; оборванная при сбое последняя строка пропускается."""
+        if not os.path.exists(self._meta_path):
+            if not os.path.exists(self._legacy_meta_path):
+                return None, []
+            # Индекс прежнего формата (один meta.json) переводим в журнал
+            with open(self._legacy_meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            records = [{"op": "upsert", "id": doc_id, "document": document, "metadata": metadata}
+                       for doc_id, document, metadata in zip(meta["ids"], meta["documents"], meta["metadatas"])]
+            return {"format": META_FORMAT, "quantize": meta.get("quantize", False)}, records
+        header, records = None, []
+        with open(self._meta_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if header is None:
+                    header = record
+                else:
+                    records.append(record)
+        return header, records
+
+    def _load(self):
+        header, records = self._read_meta()
+        if header is None:
+            self._compact()  # новый индекс: пустой журнал с заголовком
+            return
+        if header.get("quantize", False) != self.quantize:
+            # Формат хранения сменился — индекс строится заново синхронизацией
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ⚠️ Формат векторного индекса изменился, индекс будет пересобран")
+            self._compact()
+            return
+        for record in records:
+            if record["op"] == "upsert":
+                self._set_meta(record["id"], record["document"], record["metadata"])
+            else:
+                self._remove_meta(record["id"])
+        if self._ids:
+            self._matrix = np.load(self._matrix_path, mmap_mode="r+")
+            if self.quantize:
+                self._scales = np.load(self._scales_path, mmap_mode="r+")
+        if len(records) > len(self._ids) or os.path.exists(self._legacy_meta_path):
+            self._compact()
+
+    def _compact(self):
+        # Снимок текущего состояния: по одной записи upsert на строку в порядке позиций матрицы
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"format": META_FORMAT, "quantize": self.quantize}) + "\n")
+            for doc_id, document, metadata in zip(self._ids, self._documents, self._metadatas):
+                f.write(json.dumps({"op": "upsert", "id": doc_id, "document": document, "metadata": metadata},
+                                   ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self._meta_path)
+        if os.path.exists(self._legacy_meta_path):
+            os.remove(self._legacy_meta_path)
+
+    def _append_meta(self, records):
+        with open(self._meta_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+
+    def _set_meta(self, doc_id, document, metadata):
+        position = self._positions.get(doc_id)
+        if position is None:
+            position = self._positions[doc_id] = len(self._ids)
+            self._ids.append(doc_id)
+            self._documents.append(document)
+            self._metadatas.append(metadata)
+        else:
+            self._documents[position] = document
+            self._metadatas[position] = metadata
+        return position
+
+    def _remove_meta(self, doc_id):
+        """Убирает id из метаданных; возвращает (позиция, последняя позиция) или None.
+
+        Последняя строка переезжает на место удалённой — матрица остаётся без дыр. При воспроизведении
+        журнала переставляются только метаданные: матрица на диске уже в итоговом состоянии.
+        """
+        position = self._positions.pop(doc_id, None)
+        if position is None:
+            return None
+        last = len(self._ids) - 1
+        if position != last:
+            moved_id = self._ids[last]
+            self._ids[position] = moved_id
+            self._documents[position] = self._documents[last]
+            self._metadatas[position] = self._metadatas[last]
+            self._positions[moved_id] = position
+        self._ids.pop()
+        self._documents.pop()
+        self._metadatas.pop()
+        return position, last
+
+    def _grow(self, name, path, shape, dtype):
+        """Подменяет memmap из атрибута name файлом большей ёмкости, записанным рядом.
+
+        Старый memmap закрывается до os.replace (на него не остаётся ссылок): на Windows
+        отображённый в память файл заменить нельзя.
+        """
+        old = getattr(self, name)
+        setattr(self, name, None)
+        existed = old is not None
+        tmp_path = path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+        if existed:
+            grown[:len(self._ids)] = old[:len(self._ids)]
+            old.flush()
+        grown.flush()
+        del grown, old
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            os.remove(tmp_path)
+            if existed:
+                setattr(self, name, np.load(path, mmap_mode="r+"))
+            raise
+        setattr(self, name, np.load(path, mmap_mode="r+"))
+
+    def _ensure_capacity(self, rows, dim):
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if self._matrix is not None and self._matrix.shape[1] != dim:
+            raise ValueError(f"Размерность эмбеддингов {dim} не совпадает с индексом ({self._matrix.shape[1]})")
+        if rows <= capacity:
+            return
+        capacity = max(VECTOR_INDEX_MIN_CAPACITY, capacity)
+        while capacity < rows:
+            capacity *= 2
+        self._grow("_matrix", self._matrix_path, (capacity, dim), np.int8 if self.quantize else np.float32)
+        if self.quantize:
+            self._grow("_scales", self._scales_path, (capacity,), np.float32)
+
+    def _write_rows(self, positions, vectors):
+        if self.quantize:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self._matrix[positions] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self._scales[positions] = scales
+        else:
+            self._matrix[positions] = vectors
+
+    def _flush(self, records):
+        # Сначала векторы, затем журнал: строка метаданных не должна ссылаться на незаписанный вектор
+        if self._matrix is not None:
+            self._matrix.flush()
+        if self._scales is not None:
+            self._scales.flush()
+        self._append_meta(records)
+
+    def _embed(self, documents):
+        if self.embedding_function is None:
+            raise ValueError("Не задана функция эмбеддингов: передайте embeddings явно")
+        return self.embedding_function(list(documents))
+
+    # ---------- интерфейс коллекции ----------
+    def count(self):
+        return len(self._ids)
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None):
+        if not ids:
+            return
+        vectors = _normalize(embeddings if embeddings is not None else self._embed(documents))
+        documents = documents if documents is not None else [None] * len(ids)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+        with self._lock:
+            new_ids = [doc_id for doc_id in dict.fromkeys(ids) if doc_id not in self._positions]
+            self._ensure_capacity(len(self._ids) + len(new_ids), vectors.shape[1])
+            positions = [self._set_meta(doc_id, document, metadata)
+                         for doc_id, document, metadata in zip(ids, documents, metadatas)]
+            self._write_rows(np.array(positions), vectors)
+            self._flush([{"op": "upsert", "id": doc_id, "document": document, "metadata": metadata}
+                         for doc_id, document, metadata in zip(ids, documents, metadatas)])
+
+    add = upsert
+
+    def delete(self, ids):
+        with self._lock:
+            removed = []
+            for doc_id in ids:
+                moved = self._remove_meta(doc_id)
+                if moved is None:
+                    continue
+                position, last = moved
+                if position != last:
+                    self._matrix[position] = self._matrix[last]
+                    if self._scales is not None:
+                        self._scales[position] = self._scales[last]
+                removed.append({"op": "delete", "id": doc_id})
+            if removed:
+                self._flush(removed)
+
+    def get(self, ids=None, limit=None, include=("documents", "metadatas")):
+        include = include or ()
+        with self._lock:
+            if ids is None:
+                positions = list(range(len(self._ids)))
+            else:
+                positions = [self._positions[doc_id] for doc_id in ids if doc_id in self._positions]
+            if limit is not None:
+                positions = positions[:limit]
+            result = {"ids": [self._ids[p] for p in positions]}
+            if "documents" in include:
+                result["documents"] = [self._documents[p] for p in positions]
+            if "metadatas" in include:
+                result["metadatas"] = [self._metadatas[p] for p in positions]
+            return result
+
+    def search(self, query_vectors, k):
+        """Top-k для пачки запросов: (позиции, сходства), оба формы (число запросов, k)."""
+        queries = _normalize(query_vectors)
+        with self._lock:
+            n = len(self._ids)
+            if n == 0:
+                empty = np.empty((len(queries), 0))
+                return empty.astype(np.int64), empty.astype(np.float32)
+            k = min(k, n)
+            if self.quantize:
+                # Блоками: временная float32-копия не больше VECTOR_INDEX_SCORE_BLOCK строк
+                scores = np.empty((n, len(queries)), dtype=np.float32)
+                for start in range(0, n, VECTOR_INDEX_SCORE_BLOCK):
+                    stop = min(n, start + VECTOR_INDEX_SCORE_BLOCK)
+                    block = self._matrix[start:stop].astype(np.float32)
+                    np.matmul(block, queries.T, out=scores[start:stop])
+                    scores[start:stop] *= self._scales[start:stop, None]
+            else:
+                scores = self._matrix[:n] @ queries.T  # (n, число запросов)
+            scores = scores.T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def query(self, query_texts=None, n_results=10, query_embeddings=None, include=("documents", "metadatas", "distances")):
+        vectors = query_embeddings if query_embeddings is not None else self._embed(query_texts)
+        with self._lock:
+            # Позиции действительны, пока держим блокировку: delete переставляет строки
+            positions, scores = self.search(vectors, n_results)
+            result = {"ids": [[self._ids[p] for p in row] for row in positions]}
+            if "documents" in include:
+                result["documents"] = [[self._documents[p] for p in row] for row in positions]
+            if "metadatas" in include:
+                result["metadatas"] = [[self._metadatas[p] for p in row] for row in positions]
+            if "distances" in include:
+                # Как у Chroma с cosine: меньше — ближе
+                result["distances"] = [[float(1.0 - s) for s in row] for row in scores]
+            return result
\ No newline at end of file
@@ -1,41 +1,357 @@
+import os
+import time
+import hashlib
+import importlib.util
+import queue
 import tempfile
+import threading
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
 from database import error_logged, log_error
 
-# Whisper and gTTS are optional; check imports later
-whisper = None
-gTTS = None
-try:
-    import whisper
-except ImportError:
-    pass
-try:
-    from gtts import gTTS
-except ImportError:
-    pass
+# Whisper and gTTS are optional. Импорт тяжёлый (torch), поэтому откладывается
+# до первого использования или фонового прогрева; здесь только проверяем, что пакеты есть.
+WHISPER_INSTALLED = importlib.util.find_spec("whisper") is not None
+GTTS_INSTALLED = importlib.util.find_spec("gtts") is not None
+_whisper = None
+_gTTS = None
+_import_lock = threading.Lock()
+
+def _load_whisper():
+    global _whisper
+    if _whisper is None:
+        with _import_lock:
+            if _whisper is None:
+                import whisper
+                _whisper = whisper
+    return _whisper
+
+def _load_gtts():
+    global _gTTS
+    if _gTTS is None:
+        with _import_lock:
+            if _gTTS is None:
+                from gtts import gTTS
+                _gTTS = gTTS
+    return _gTTS
+
+# ========== РАСПОЗНАВАНИЕ РЕЧИ ==========
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE") or None  # None — whisper выберет cuda/cpu сам
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "auto")  # auto / float16 / float32
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", "1"))
+WHISPER_MAX_QUEUE = int(os.getenv("WHISPER_MAX_QUEUE", "8"))
+WHISPER_MAX_WAIT = float(os.getenv("WHISPER_MAX_WAIT", "30"))
+WHISPER_PRELOAD = os.getenv("WHISPER_PRELOAD", "0") == "1"
+
+OVERLOADED_MESSAGE = "⚠️ Сервис распознавания речи перегружен. Попробуйте ещё раз чуть позже."
+
+class _TranscriptionJob:
+    """Состояние запроса в очереди; меняется только под замком сервиса."""
+
+    def __init__(self, submitted):
+        self.submitted = submitted
+        self.started = False
+        self.cancelled = False
+
+class TranscriptionService:
+    """Модель Whisper загружается один раз; распознавание идёт на ограниченном пуле потоков.
+
+    У каждого воркера своя копия модели: декодер whisper вешает kv-cache хуки на модули модели,
+    поэтому одну модель нельзя использовать из нескольких потоков одновременно.
+    """
+
+    def __init__(self, model_name, device, compute_type, workers, max_queue, max_wait):
+        self.model_name = model_name
+        self.device = device
+        self.compute_type = compute_type
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whisper")
+        self._models = queue.Queue()
+        self._models_loaded = 0
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._recent = deque(maxlen=20)
+        self._stats = {
+            "requests": 0,
+            "completed": 0,
+            "rejected": 0,
+            "errors": 0,
+            "audio_seconds": 0.0,
+            "wall_seconds": 0.0,
+            "wait_seconds": 0.0,
+        }
+
+    def _fp16(self, model):
+        if self.compute_type == "auto":
+            return getattr(model, "device", None) is not None and model.device.type == "cuda"
+        return self.compute_type == "float16"
+
+    def _load_model(self):
+        started = time.perf_counter()
+        model = _load_whisper().load_model(self.model_name, device=self.device)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Whisper '{self.model_name}' загружен за {time.perf_counter() - started:.1f} с")
+        return model
+
+    def _acquire_model(self):
+        try:
+            return self._models.get_nowait()
+        except queue.Empty:
+            pass
+        with self._load_lock:
+            if self._models_loaded < self.workers:
+                model = self._load_model()
+                self._models_loaded += 1
+                return model
+        return self._models.get()
+
+    def warm_up(self):
+        """Заранее загружает модель, чтобы первый запрос не ждал чтения весов с диска."""
+        with self._load_lock:
+            if self._models_loaded > 0:
+                return
+            model = self._load_model()
+            self._models_loaded += 1
+        self._models.put(model)
+
+    def _run(self, audio_path, job):
+        with self._lock:
+            # Вызывающий уже не дождался очереди и получил отказ; счётчики он поправил сам
+            if job.cancelled:
+                return OVERLOADED_MESSAGE
+            job.started = True
+            self._queued -= 1
+            self._running += 1
+            self._stats["wait_seconds"] += time.monotonic() - job.submitted
+        model = None
+        try:
+            model = self._acquire_model()
+            started = time.perf_counter()
+            whisper = _load_whisper()
+            audio = whisper.load_audio(audio_path)
+            audio_seconds = audio.shape[0] / whisper.audio.SAMPLE_RATE
+            result = model.transcribe(audio, fp16=self._fp16(model))
+            wall_seconds = time.perf_counter() - started
+        finally:
+            # Если модель не загрузилась, возвращать в пул нечего
+            if model is not None:
+                self._models.put(model)
+            with self._lock:
+                self._running -= 1
+        with self._lock:
+            self._stats["completed"] += 1
+            self._stats["audio_seconds"] += audio_seconds
+            self._stats["wall_seconds"] += wall_seconds
+            self._recent.append((round(audio_seconds, 2), round(wall_seconds, 2),
+                                 round(wall_seconds / audio_seconds, 3) if audio_seconds else None))
+        return result["text"]
+
+    def transcribe(self, audio_path):
+        with self._lock:
+            self._stats["requests"] += 1
+            if self._queued >= self.max_queue:
+                self._stats["rejected"] += 1
+                return OVERLOADED_MESSAGE
+            self._queued += 1
+        job = _TranscriptionJob(time.monotonic())
+        future = self._executor.submit(self._run, audio_path, job)
+        # В очереди ждём не дольше max_wait; начавшееся распознавание дожидаемся до конца
+        if not wait([future], timeout=self.max_wait).done:
+            with self._lock:
+                if not job.started:
+                    job.cancelled = True
+                    self._queued -= 1
+                    self._stats["rejected"] += 1
+            if job.cancelled:
+                future.cancel()
+                return OVERLOADED_MESSAGE
+        try:
+            return future.result()
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queue_depth"] = self._queued
+            stats["running"] = self._running
+            stats["recent"] = list(self._recent)
+        stats["models_loaded"] = self._models_loaded
+        stats["model"] = self.model_name
+        # Отношение времени обработки к длительности аудио (< 1 — быстрее реального времени)
+        stats["realtime_factor"] = stats["wall_seconds"] / stats["audio_seconds"] if stats["audio_seconds"] else None
+        return stats
+
+transcription_service = TranscriptionService(
+    WHISPER_MODEL, WHISPER_DEVICE, WHISPER_COMPUTE_TYPE,
+    WHISPER_WORKERS, WHISPER_MAX_QUEUE, WHISPER_MAX_WAIT
+)
+
+def warm_up_voice():
+    """Фоновый прогрев: импорт whisper и gTTS, при WHISPER_PRELOAD=1 — ещё и загрузка модели."""
+    if WHISPER_INSTALLED:
+        _load_whisper()
+        if WHISPER_PRELOAD:
+            transcription_service.warm_up()
+    if GTTS_INSTALLED:
+        _load_gtts()
+
+def get_transcription_stats():
+    return transcription_service.stats()
 
 @error_logged
 def transcribe_audio(audio_path):
-    if whisper is None:
+    if not WHISPER_INSTALLED:
         return "⚠️ Whisper не установлен. Голосовой ввод недоступен."
     try:
-        model = whisper.load_model("small")
-        result = model.transcribe(audio_path)
-        return result["text"]
+        return transcription_service.transcribe(audio_path)
     except Exception as e:
         log_error("Whisper", str(e), traceback.format_exc())
         return f"Ошибка распознавания: {e}"
 
+# ========== СИНТЕЗ РЕЧИ И КЭШ АУДИО ==========
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "skillforge_tts"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+TTS_CACHE_MAX_AGE_S = int(os.getenv("TTS_CACHE_MAX_AGE_S", str(7 * 24 * 3600)))
+TTS_REAPER_INTERVAL_S = int(os.getenv("TTS_REAPER_INTERVAL_S", "600"))
+TTS_STALE_TMP_S = 600  # недописанные .tmp старше этого возраста считаются брошенными
+TTS_REAP_EVERY_WRITES = 20  # помимо фонового reaper'а, лимит размера проверяется каждые N записей
+
+class TTSCache:
+    """Кэш синтезированных ответов на диске: ключ — hash(lang, text), вытеснение по LRU (mtime)."""
+
+    def __init__(self, directory, max_bytes, max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._reaper_stop = threading.Event()
+        self._stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def path_for(self, text, lang):
+        key = hashlib.sha256(f"{lang}\0{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get_or_create(self, text, lang, synthesize):
+        """Возвращает путь к mp3; synthesize(path) вызывается только при промахе."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.start_reaper()
+        path = self.path_for(text, lang)
+        if os.path.exists(path):
+            try:
+                os.utime(path)  # mtime служит отметкой последнего использования для LRU
+                with self._lock:
+                    self._stats["hits"] += 1
+                return path
+            except FileNotFoundError:
+                pass  # файл успел удалить reaper — синтезируем заново
+        with self._lock:
+            self._stats["misses"] += 1
+            need_reap = self._stats["misses"] % TTS_REAP_EVERY_WRITES == 0
+        # Пишем во временный файл в том же каталоге и атомарно переименовываем
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        os.close(fd)
+        try:
+            synthesize(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if need_reap:
+            self.reap()
+        return path
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file():
+                    st = entry.stat()
+                    entries.append((entry.path, entry.name, st.st_size, st.st_mtime))
+        return entries
+
+    def reap(self):
+        """Удаляет брошенные .tmp, просроченные файлы и самые старые файлы сверх лимита размера."""
+        if not os.path.isdir(self.directory):
+            return 0
+        now = time.time()
+        removed = 0
+        keep = []
+        for path, name, size, mtime in self._entries():
+            stale_tmp = name.endswith(".tmp") and now - mtime > TTS_STALE_TMP_S
+            expired = name.endswith(".mp3") and now - mtime > self.max_age
+            if stale_tmp or expired:
+                removed += self._remove(path)
+            elif name.endswith(".mp3"):
+                keep.append((mtime, size, path))
+        total = sum(size for _, size, _ in keep)
+        for _mtime, size, path in sorted(keep):
+            if total <= self.max_bytes:
+                break
+            removed += self._remove(path)
+            total -= size
+        if removed:
+            with self._lock:
+                self._stats["evicted"] += removed
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return 1
+        except FileNotFoundError:
+            return 0
+
+    def _reaper_loop(self):
+        while not self._reaper_stop.wait(TTS_REAPER_INTERVAL_S):
+            try:
+                self.reap()
+            except Exception as e:
+                log_error("TTSReaper", str(e), traceback.format_exc())
+
+    def start_reaper(self):
+        if self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reaper_loop, name="tts-reaper", daemon=True)
+                self._reaper.start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        files = [entry for entry in self._entries() if entry[1].endswith(".mp3")] if os.path.isdir(self.directory) else []
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        stats["files"] = len(files)
+        stats["disk_bytes"] = sum(entry[2] for entry in files)
+        stats["max_bytes"] = self.max_bytes
+        stats["directory"] = self.directory
+        return stats
+
+tts_cache = TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES, TTS_CACHE_MAX_AGE_S)
+
+def get_tts_cache_stats():
+    return tts_cache.stats()
+
 @error_logged
 def text_to_speech(text, lang="ru"):
-    if gTTS is None:
+    if not GTTS_INSTALLED:
         return None
     try:
-        tts = gTTS(text=text, lang=lang)
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-        temp_file.close()
-        tts.save(temp_file.name)
-        return temp_file.name
+        # Одинаковые ответы (например, фиксированная подсказка chat_respond) отдаются с диска
+        return tts_cache.get_or_create(text, lang, lambda path: _load_gtts()(text=text, lang=lang).save(path))
     except Exception as e:
         log_error("TTS", str(e), traceback.format_exc())
         return None